@@ -17,6 +17,7 @@ else:
         LOW_MEMORY_MODE: bool = False  # 低内存模式，会阻止 B50 等大型图片合成
         LOW_MEMORY_TIP: str | None = None
         DIVING_FISH_DEVELOPER_TOKEN: str | None = None
+        RENDER_WORKERS: int = 2  # 图片渲染工作进程数，0 表示不使用进程池（在线程中渲染）
         # LYRA_FETCH_SKIP 已被弃用：使用了 CACHE_EXPIRATION_SECONDS 保证 fetch 不会执行次数过多
 
     __plugin_meta__ = PluginMetadata(
@@ -25,11 +26,12 @@ else:
         usage="",
         config=Config,
     )
-    from . import matcher, models, utils, plugin_help, fetch, napcat_stream
+    from . import matcher, models, utils, plugin_help, fetch, napcat_stream, render
     # 将配置项传递给 matcher 模块
     config = get_plugin_config(Config)
     matcher.LOW_MEMORY_MODE = config.LOW_MEMORY_MODE
     matcher.LOW_MEMORY_TIP = config.LOW_MEMORY_TIP
     matcher.DEVELOPER_TOKEN = config.DIVING_FISH_DEVELOPER_TOKEN
+    render.RENDER_WORKERS = config.RENDER_WORKERS
     # 注入 hook 以支持 stream 获取文件
     napcat_stream.install_hook()
@@ -0,0 +1,138 @@
+"""
+maib 头像缓存
+
+B50 用户头像的两级缓存：
+- 内存：按 (QQ, 尺寸) 缓存已解码、已缩放的 PIL 图像（有界 LRU）
+- 磁盘：`network.request_bytes_cached` 缓存原始图片与 ETag / Last-Modified（位于插件缓存目录 avatar/）
+
+两级缓存均有新鲜期 (TTL)；过期后通过条件请求重新验证。
+存在过期头像时，远程获取超过 `AVATAR_DEADLINE` 秒即先返回过期头像，获取任务在后台继续并回填缓存。
+"""
+import asyncio
+import io
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+from loguru import logger
+
+from . import network
+from .bot_registry import PluginRegistry
+from .throttle import SingleFlight
+
+
+AVATAR_TTL_SECONDS = 2 * 3600  # 头像新鲜期
+AVATAR_DEADLINE = 0.8  # 存在过期头像时，等待远程获取的最长时间（秒）
+AVATAR_CACHE_DIR_NAME = "avatar"
+DEFAULT_AVATAR_CACHE_SIZE = 256  # 内存缓存容量（头像数）
+
+AvatarKey = tuple[int, tuple[int, int]]
+
+
+def get_qq_avatar_url(qq: int) -> str:
+    return f"http://q2.qlogo.cn/headimg_dl?dst_uin={qq}&spec=100"
+
+
+def _decode_avatar(data: bytes, size: tuple[int, int]) -> Optional[Image.Image]:
+    """解码并缩放至目标尺寸，失败返回 None"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            avatar = img.convert("RGBA")
+    except Exception as e:
+        logger.warning(f"头像解码失败: {e}")
+        return None
+    if avatar.size != size:
+        avatar = avatar.resize(size, Image.Resampling.LANCZOS)
+    return avatar
+
+
+class AvatarCache:
+    """已缩放头像的两级缓存"""
+
+    def __init__(self, maxsize: int = DEFAULT_AVATAR_CACHE_SIZE, ttl: float = AVATAR_TTL_SECONDS,
+                 deadline: float = AVATAR_DEADLINE):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.deadline = deadline
+        self._avatars: OrderedDict[AvatarKey, tuple[float, Image.Image]] = OrderedDict()
+        self._flight: SingleFlight[AvatarKey, Image.Image] = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+
+    def _put(self, key: AvatarKey, avatar: Image.Image):
+        self._avatars[key] = (time.monotonic(), avatar)
+        self._avatars.move_to_end(key)
+        while len(self._avatars) > self.maxsize:
+            self._avatars.popitem(last=False)
+
+    def _load_disk(self, qq: int, size: tuple[int, int]) -> Optional[Image.Image]:
+        """读取磁盘缓存（不论是否过期），作为远程获取超时时的兜底（含文件读取与解码，应在线程中调用）"""
+        data = network.read_bytes_cache(str(qq), self.cache_dir)
+        return _decode_avatar(data, size) if data is not None else None
+
+    @property
+    def cache_dir(self) -> Path:
+        return PluginRegistry.get_cache_dir() / AVATAR_CACHE_DIR_NAME
+
+    async def _fetch(self, qq: int, size: tuple[int, int]) -> Optional[Image.Image]:
+        """经磁盘缓存获取头像并回填内存缓存"""
+        data, _ = await network.request_bytes_cached(
+            get_qq_avatar_url(qq), cache_name=str(qq), cache_dir=self.cache_dir,
+            max_age=self.ttl, project_name="qlogo*/avatar"
+        )
+        avatar = _decode_avatar(data, size) if data else None
+        if avatar is not None:
+            self._put((qq, size), avatar)
+        return avatar
+
+    async def get(self, qq: int, size: tuple[int, int]) -> Optional[Image.Image]:
+        """
+        获取已缩放至 `size` 的头像副本，无法获取时返回 None
+        - 内存缓存新鲜时直接返回
+        - 否则发起（按键合并的）获取；存在过期头像时最多等待 `deadline` 秒，超时返回过期头像
+        """
+        key = (qq, size)
+        cached = self._avatars.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            self.hits += 1
+            self._avatars.move_to_end(key)
+            return cached[1].copy()
+        self.misses += 1
+
+        fetch = lambda: self._fetch(qq, size)
+        try:
+            try:
+                avatar = await asyncio.wait_for(self._flight.run(key, fetch), self.deadline)
+            except asyncio.TimeoutError:
+                stale = cached[1] if cached is not None else await asyncio.to_thread(self._load_disk, qq, size)
+                if stale is not None:
+                    # 获取任务在后台继续并回填缓存
+                    self.stale_served += 1
+                    return stale.copy()
+                # 无过期头像可用，继续等待进行中的获取
+                avatar = await self._flight.run(key, fetch)
+        except Exception as e:
+            logger.warning(f"获取头像失败: {qq} | Error: {e}")
+            avatar = None
+
+        if avatar is None and cached is not None:
+            self.stale_served += 1
+            return cached[1].copy()
+        return avatar.copy() if avatar is not None else None
+
+    def clear(self):
+        self._avatars.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_served": self.stale_served,
+            "size": len(self._avatars),
+        }
+
+
+avatar_cache = AvatarCache()
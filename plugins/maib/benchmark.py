@@ -0,0 +1,246 @@
+"""
+maib 性能基准
+
+用法（在项目根目录执行）：
+    python -m plugins.maib.benchmark            # 运行全部基准
+    python -m plugins.maib.benchmark inote      # 运行指定基准
+
+不依赖 NoneBot 运行环境：数据库基准使用内存 SQLite 与合成数据。
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+import httpx
+import orjson
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session, selectinload
+
+from . import models, network, utils
+from .bot_registry import PluginRegistry
+from .models import MaiData, MaiChart, MaiChartAch
+
+
+# --- 工具函数 ---
+
+def _measure(func: Callable[[], object], repeat: int = 20) -> float:
+    """多次执行取中位数，返回毫秒"""
+    costs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        costs.append((time.perf_counter() - start) * 1000)
+    return statistics.median(costs)
+
+
+def _peak_memory(func: Callable[[], object]) -> int:
+    """单次执行期间 Python 堆的峰值增量（字节，tracemalloc 统计）"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _print_row(name: str, *cols: str):
+    print(f"  {name:<28}" + "".join(f"{c:>16}" for c in cols))
+
+
+# --- MaiChart.inote 延迟加载 ---
+
+def _seed_charts(session: Session, song_count: int, inote_size: int, user_id: int):
+    """写入合成曲目、谱面（带 inote 文本）与单用户成绩"""
+    inote = ("1,2h[4:1],3-7[8:1],4b,E1," * (inote_size // 25 + 1))[:inote_size]
+    for sid in range(1, song_count + 1):
+        mdt = MaiData(
+            shortid=sid, title=f"song {sid}", bpm=150, artist="", genre=1, cabinet="DX",
+            version=20 + sid % 6, version_cn=None, converter="", zip_path=f"charts/{sid}.zip",
+        )
+        for diff in range(2, 7):
+            mdt.charts.append(MaiChart(
+                shortid=sid, difficulty=diff, lv=7.0 + diff + (sid % 10) / 10, des="", inote=inote,
+                note_count_tap=500, note_count_hold=50, note_count_slide=50,
+                note_count_touch=20, note_count_break=30,
+            ))
+        session.add(mdt)
+    session.flush()
+
+    charts = session.execute(select(MaiChart)).scalars().all()
+    for chart in charts:
+        session.add(MaiChartAch(
+            shortid=chart.shortid, chart_id=chart.id, difficulty=chart.difficulty, server="JP",
+            achievement=100.0 + (chart.id % 50) / 100, dxrating=200 + chart.id % 150, user_id=user_id,
+        ))
+    session.commit()
+
+
+def _hydrated_inote_bytes(session: Session) -> int:
+    """统计会话中已加载的 inote 文本字节数"""
+    return sum(
+        len(obj.__dict__["inote"].encode())
+        for obj in session.identity_map.values()
+        if isinstance(obj, MaiChart) and "inote" in obj.__dict__
+    )
+
+
+def bench_inote(song_count: int = 300, inote_size: int = 8000, repeat: int = 20):
+    """对比 B50 / info 查询在加载与不加载 MaiChart.inote 时的耗时与数据量"""
+    user_id = 10001
+    engine = create_engine("sqlite://")
+    models.Model.metadata.create_all(engine)
+    with Session(engine) as session:
+        _seed_charts(session, song_count, inote_size, user_id)
+
+    def b50_statement(eager_inote: bool):
+        chart_loader = selectinload(MaiChartAch.chart)
+        if eager_inote:
+            chart_loader = chart_loader.undefer(MaiChart.inote)
+        maidata_charts = selectinload(MaiChartAch.chart).selectinload(MaiChart.maidata).selectinload(MaiData.charts)
+        if eager_inote:
+            maidata_charts = maidata_charts.undefer(MaiChart.inote)
+        return (
+            select(MaiChartAch)
+            .options(chart_loader, maidata_charts)
+            .where(MaiChartAch.user_id == user_id, MaiChartAch.server == "JP")
+            .order_by(MaiChartAch.dxrating.desc())
+            .limit(50)
+        )
+
+    def info_statement(eager_inote: bool):
+        charts_loader = selectinload(MaiData.charts)
+        if eager_inote:
+            charts_loader = charts_loader.undefer(MaiChart.inote)
+        return select(MaiData).options(charts_loader).where(MaiData.shortid == song_count // 2)
+
+    print(f"[inote] songs={song_count} charts={song_count * 5} inote_size={inote_size}B")
+    _print_row("path", "median(ms)", "inote bytes")
+    for path_name, build in (("b50", b50_statement), ("info", info_statement)):
+        for eager in (True, False):
+            def run():
+                with Session(engine) as session:
+                    session.execute(build(eager)).scalars().all()
+
+            with Session(engine) as session:
+                # 持有结果，避免对象被弱引用的 identity map 回收
+                rows = session.execute(build(eager)).scalars().all()
+                loaded = _hydrated_inote_bytes(session)
+                del rows
+            label = f"{path_name} ({'eager' if eager else 'deferred'} inote)"
+            _print_row(label, f"{_measure(run, repeat):.2f}", f"{loaded:,}")
+
+
+# --- DX Rating 标量 / 向量化计算 ---
+
+def bench_dxrating(record_count: int = 1000, repeat: int = 20):
+    """对比逐条 `MaiChart.get_dxrating`、逐条 `get_dxrating` 与 `get_dxrating_batch` 的耗时"""
+    rng = random.Random(0)
+    achievements = [rng.uniform(80.0, 101.0) for _ in range(record_count)]
+    levels = [round(rng.uniform(10.0, 15.0), 1) for _ in range(record_count)]
+    ap_bonus = 1
+
+    def run_chart():
+        # 批量上传原路径：每条成绩构建 utils.MaiChart 并 set_ach 后计算
+        for achievement, level in zip(achievements, levels):
+            chart = utils.MaiChart(shortid=1, difficulty=5, lv=level)
+            chart.set_ach(utils.MaiChartAch(shortid=1, difficulty=5, server="JP", achievement=achievement))
+            chart.get_dxrating(server="JP", ap_bonus=ap_bonus)
+
+    def run_scalar():
+        for achievement, level in zip(achievements, levels):
+            utils.get_dxrating(achievement, level, ap_bonus)
+
+    def run_batch():
+        utils.get_dxrating_batch(achievements, levels, ap_bonus).tolist()
+
+    expected = [utils.get_dxrating(a, lv, ap_bonus) for a, lv in zip(achievements, levels)]
+    assert utils.get_dxrating_batch(achievements, levels, ap_bonus).tolist() == expected
+
+    print(f"[dxrating] records={record_count}")
+    _print_row("path", "median(ms)")
+    for label, func in (("MaiChart.get_dxrating", run_chart), ("get_dxrating", run_scalar),
+                        ("get_dxrating_batch", run_batch)):
+        _print_row(label, f"{_measure(func, repeat):.3f}")
+
+
+# --- 上游 JSON 解析 ---
+
+def _recorded_payloads() -> list[Path]:
+    """`network.request_json_cached` 已落盘的响应体（水鱼乐曲数据、拟合数据、别名库等）"""
+    http_dir = PluginRegistry.get_cache_dir() / network.HTTP_CACHE_DIR_NAME
+    paths = [p for p in http_dir.glob("*.json") if not p.name.endswith(".meta.json")]
+    music_data = PluginRegistry.get_data_dir() / "music_data.json"
+    if music_data.exists():
+        paths.append(music_data)
+    return sorted(paths)
+
+
+def _synthetic_music_data(song_count: int = 1500) -> bytes:
+    """按水鱼 music_data 结构合成的响应体（无录制数据时使用）"""
+    rng = random.Random(0)
+    songs = []
+    for sid in range(1, song_count + 1):
+        ds = [round(rng.uniform(1.0, 15.0), 1) for _ in range(5)]
+        songs.append({
+            "id": str(sid), "title": f"曲目 {sid}", "type": rng.choice(["SD", "DX"]),
+            "ds": ds, "level": [f"{int(d)}+" if d % 1 >= 0.7 else str(int(d)) for d in ds],
+            "cids": [sid * 10 + i for i in range(5)],
+            "charts": [{"notes": [rng.randint(0, 800) for _ in range(5)], "charter": "-"} for _ in range(5)],
+            "basic_info": {"title": f"曲目 {sid}", "artist": "artist", "genre": "maimai", "bpm": 150,
+                           "release_date": "", "from": "maimai でらっくす BUDDiES", "is_new": False},
+        })
+    return orjson.dumps(songs)
+
+
+def bench_json(repeat: int = 5):
+    """对比 `response.json()`（标准库 json + str 解码副本）、orjson 解析 bytes 与流式落盘后 mmap 解析"""
+    payloads = [(p.name, p.read_bytes()) for p in _recorded_payloads()]
+    if not payloads:
+        payloads = [("synthetic music_data", _synthetic_music_data())]
+
+    print(f"[json] payloads={len(payloads)}")
+    # peak heap 为解析期间的新增分配；body in heap 为解析时仍驻留在 Python 堆上的响应体
+    _print_row("path", "median(ms)", "peak heap", "body in heap")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, raw in payloads:
+            print(f"  -- {name} ({len(raw):,}B)")
+            response = httpx.Response(200, content=raw)
+            file_path = Path(tmp_dir) / "payload.json"
+            file_path.write_bytes(raw)
+            cases = (
+                ("response.json()", response.json, len(raw)),
+                ("orjson.loads(content)", lambda: orjson.loads(response.content), len(raw)),
+                ("load_json_file (mmap)", lambda: network.load_json_file(file_path), 0),
+            )
+            expected = orjson.loads(raw)
+            for label, func, body_size in cases:
+                assert func() == expected
+                _print_row(label, f"{_measure(func, repeat):.2f}", f"{_peak_memory(func):,}", f"{body_size:,}")
+
+
+BENCHMARKS: dict[str, Callable[[], None]] = {
+    "inote": bench_inote,
+    "dxrating": bench_dxrating,
+    "json": bench_json,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="maib 性能基准")
+    parser.add_argument("names", nargs="*", help=f"要运行的基准（默认全部）：{', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+    if unknown := set(args.names) - BENCHMARKS.keys():
+        parser.error(f"未知的基准: {', '.join(sorted(unknown))}")
+    for name in args.names or BENCHMARKS.keys():
+        BENCHMARKS[name]()
+        print()
+
+
+if __name__ == "__main__":
+    main()
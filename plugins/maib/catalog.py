@@ -0,0 +1,265 @@
+"""
+maib 曲目目录
+
+进程级的只读曲目快照：shortid -> MaiData，曲名/别名 -> shortid。
+目录在 fetch 流程结束后由 `services.rebuild_catalog` 整体构建并原子替换，
+运行期间的增量变更（如新增别名）采用写时复制生成新快照，不修改旧快照。
+
+模糊搜索使用字符 n-gram 倒排索引：
+- 归一化后的曲名/别名按 1-gram 与 2-gram 建立倒排表
+- 查询时对关键词的 n-gram 倒排表取交集得到候选，再以子串校验并排序
+
+容错搜索（子串也无法命中时）使用预计算的归一化键与拼音首字母键，
+对缓存的候选列表整体打分。
+"""
+import time
+from typing import Iterable, Iterator, Optional, NamedTuple
+
+from thefuzz import process, fuzz
+from pypinyin import lazy_pinyin, Style
+
+from . import utils
+from .utils import CHAR_FULL_WIDTH_TABLE
+
+
+# 容错搜索的最低相似度（0~100）
+FUZZY_SCORE_CUTOFF = 70
+
+
+def _build_fold_table() -> dict[int, int]:
+    """构建归一化转换表：全角 -> 半角，片假名 -> 平假名"""
+    table = {full: half for half, full in CHAR_FULL_WIDTH_TABLE.items()}
+    # 片假名 ァ(U+30A1) ~ ヶ(U+30F6) 与平假名 ぁ(U+3041) ~ ゖ(U+3096) 一一对应
+    table.update({code: code - 0x60 for code in range(0x30A1, 0x30F7)})
+    return table
+
+_FOLD_TABLE = _build_fold_table()
+
+
+def normalize_name(text: str) -> str:
+    """曲名/别名归一化：全角/假名折叠，忽略大小写与空白"""
+    return "".join(text.translate(_FOLD_TABLE).casefold().split())
+
+
+def _pinyin_initials(text: str) -> str:
+    """获取文本的拼音首字母键（不含汉字时返回空字符串）"""
+    if not any("\u4e00" <= c <= "\u9fff" for c in text):
+        return ""
+    return normalize_name("".join(lazy_pinyin(text, style=Style.FIRST_LETTER)))
+
+
+def _name_grams(key: str) -> set[str]:
+    """获取归一化名称的 1-gram 与 2-gram 集合"""
+    grams = set(key)
+    grams.update(key[i:i + 2] for i in range(len(key) - 1))
+    return grams
+
+
+class _NameEntry(NamedTuple):
+    """名称索引条目"""
+    key: str  # 归一化后的名称
+    shortid: int  # 曲目 ID
+    is_title: bool  # 是否为曲名（否则为别名）
+
+
+class MaiCatalog:
+    """曲目目录快照（构建后只读）"""
+
+    def __init__(self, maidatas: Iterable[utils.MaiData] = ()):
+        self._maidatas: dict[int, utils.MaiData] = {}
+        self._names: dict[str, tuple[int, ...]] = {}  # 曲名/别名 -> shortid 列表
+        self._entries: list[_NameEntry] = []  # 模糊搜索条目
+        self._entry_keys: set[tuple[str, int]] = set()  # (key, shortid) 去重
+        self._grams: dict[str, set[int]] = {}  # n-gram -> 条目下标
+        self._fuzzy_keys: dict[str, tuple[int, ...]] = {}  # 容错搜索键 -> shortid 列表
+        self._fuzzy_choices: list[str] | None = None  # 容错搜索候选列表缓存
+        self._frozen = False  # 构建完成后冻结，倒排表只能整体替换
+        for maidata in maidatas:
+            self._add(maidata)
+        self._frozen = True
+        self.build_time: float = time.time()
+
+    # --- 构建 ---
+
+    def _add(self, maidata: utils.MaiData):
+        """写入曲目并登记曲名/别名索引（仅在构建阶段调用）"""
+        self._maidatas[maidata.shortid] = maidata
+        self._index_name(maidata.title, maidata.shortid, is_title=True)
+        for alias in maidata.aliases:
+            self._index_name(alias.alias, maidata.shortid)
+
+    def _index_name(self, name: str, shortid: int, is_title: bool = False):
+        """登记名称索引与 n-gram 倒排表
+
+        冻结后倒排表中的集合在快照之间共享，更新时只能整体替换、不能原地修改。
+        """
+        if not name:
+            return
+        shortids = self._names.get(name, ())
+        if shortid not in shortids:
+            self._names[name] = (*shortids, shortid)
+
+        key = normalize_name(name)
+        if not key or (key, shortid) in self._entry_keys:
+            return
+        self._entry_keys.add((key, shortid))
+        index = len(self._entries)
+        self._entries.append(_NameEntry(key, shortid, is_title))
+        for gram in _name_grams(key):
+            if self._frozen:
+                self._grams[gram] = self._grams.get(gram, set()) | {index}
+            else:
+                self._grams.setdefault(gram, set()).add(index)
+
+        # 容错搜索键：归一化名称 + 拼音首字母
+        for fuzzy_key in (key, _pinyin_initials(name)):
+            if not fuzzy_key:
+                continue
+            shortids = self._fuzzy_keys.get(fuzzy_key, ())
+            if shortid not in shortids:
+                self._fuzzy_keys[fuzzy_key] = (*shortids, shortid)
+                self._fuzzy_choices = None
+
+    def _copy(self) -> 'MaiCatalog':
+        """浅复制目录结构，供写时复制使用"""
+        catalog = object.__new__(type(self))
+        catalog._maidatas = dict(self._maidatas)
+        catalog._names = dict(self._names)
+        catalog._entries = list(self._entries)
+        catalog._entry_keys = set(self._entry_keys)
+        catalog._grams = dict(self._grams)
+        catalog._fuzzy_keys = dict(self._fuzzy_keys)
+        catalog._fuzzy_choices = self._fuzzy_choices
+        catalog._frozen = True
+        catalog.build_time = self.build_time
+        return catalog
+
+    def with_aliases(self, aliases: Iterable[utils.MaiAlias]) -> 'MaiCatalog':
+        """返回追加别名后的新目录（写时复制，不修改当前快照）"""
+        grouped: dict[int, list[utils.MaiAlias]] = {}
+        for alias in aliases:
+            if alias.shortid in self._maidatas:
+                grouped.setdefault(alias.shortid, []).append(alias)
+        if not grouped:
+            return self
+
+        catalog = self._copy()
+        for shortid, new_aliases in grouped.items():
+            maidata = self._maidatas[shortid].copy()
+            maidata.add_aliases(new_aliases)
+            catalog._maidatas[shortid] = maidata
+            for alias in maidata.aliases:
+                catalog._index_name(alias.alias, shortid)
+        return catalog
+
+    # --- 查询 ---
+
+    def __iter__(self) -> Iterator[utils.MaiData]:
+        return iter(self._maidatas.values())
+
+    def __len__(self) -> int:
+        return len(self._maidatas)
+
+    def __contains__(self, shortid: int) -> bool:
+        return shortid in self._maidatas
+
+    def get(self, shortid: int) -> Optional[utils.MaiData]:
+        """通过 `shortid` 获取曲目副本（不含成绩）"""
+        maidata = self._maidatas.get(shortid)
+        return maidata.copy() if maidata else None
+
+    def get_many(self, shortids: Iterable[int]) -> list[utils.MaiData]:
+        """批量获取曲目副本，忽略不存在的 `shortid`"""
+        return [m.copy() for sid in shortids if (m := self._maidatas.get(sid))]
+
+    def find_by_name(self, keyword: str) -> list[int]:
+        """通过 曲名/别名 精确匹配 `shortid`"""
+        return sorted(self._names.get(keyword, ()))
+
+    def find_by_title(self, title: str) -> list[int]:
+        """通过 曲名 精确匹配 `shortid`"""
+        return sorted(sid for sid in self._names.get(title, ()) if self._maidatas[sid].title == title)
+
+    def search(self, keyword: str, limit: int | None = None) -> list[int]:
+        """
+        通过 曲名/别名 子串匹配 `shortid`，按相关度降序返回
+        排序规则：完全一致 > 前缀匹配 > 关键词占名称长度比例 > 曲名优先于别名
+        """
+        keyword = normalize_name(keyword)
+        if not keyword:
+            return []
+
+        # 1. 倒排表取交集（从最短的倒排表开始）
+        if len(keyword) == 1:
+            grams = {keyword}
+        else:
+            grams = {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+        postings = sorted((self._grams.get(g, set()) for g in grams), key=len)
+        if not postings or not postings[0]:
+            return []
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                return []
+
+        # 2. 子串校验并计算排序分数，每首曲目取最高分
+        scores: dict[int, tuple[bool, bool, float, bool]] = {}
+        for index in candidates:
+            entry = self._entries[index]
+            if keyword not in entry.key:
+                continue
+            score = (
+                entry.key == keyword,
+                entry.key.startswith(keyword),
+                len(keyword) / len(entry.key),
+                entry.is_title,
+            )
+            if score > scores.get(entry.shortid, (False, False, 0.0, False)):
+                scores[entry.shortid] = score
+
+        ranked = sorted(scores, key=lambda sid: (scores[sid], -sid), reverse=True)
+        return ranked[:limit] if limit is not None else ranked
+
+    def search_fuzzy(self, keyword: str, limit: int = 10) -> list[int]:
+        """
+        通过 曲名/别名 容错匹配 `shortid`，按相似度降序返回
+        同时匹配归一化名称与拼音首字母，适用于错字、漏字等子串无法命中的情况
+        """
+        keyword = normalize_name(keyword)
+        if not keyword or not self._fuzzy_keys:
+            return []
+
+        if self._fuzzy_choices is None:
+            self._fuzzy_choices = list(self._fuzzy_keys)
+        choices = self._fuzzy_choices
+
+        # 同一曲目可能对应多个键，多取一些候选后再按曲目去重
+        # 候选键已归一化，跳过 thefuzz 的逐条预处理
+        matched = [
+            (choice, score)
+            for choice, score in process.extract(keyword, choices, processor=None, scorer=fuzz.ratio, limit=limit * 3)
+            if score >= FUZZY_SCORE_CUTOFF
+        ]
+
+        ranked: list[int] = []
+        for choice, _ in matched:
+            for shortid in sorted(self._fuzzy_keys[choice]):
+                if shortid not in ranked:
+                    ranked.append(shortid)
+        return ranked[:limit]
+
+
+# 当前生效的目录快照，None 表示尚未构建
+_catalog: Optional[MaiCatalog] = None
+
+
+def get_catalog() -> Optional[MaiCatalog]:
+    """获取当前目录快照"""
+    return _catalog
+
+
+def set_catalog(catalog: MaiCatalog):
+    """原子替换目录快照"""
+    global _catalog
+    _catalog = catalog
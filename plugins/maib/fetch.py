@@ -1,3 +1,4 @@
+import asyncio
 import re
 import time
 import orjson
@@ -8,7 +9,7 @@ from nonebot import logger, require
 require("nonebot_plugin_datastore")
 from nonebot_plugin_datastore.db import post_db_init
 
-from . import utils, models, services, network
+from . import utils, models, services, network, image_gen
 from .bot_registry import PluginRegistry
 from .constants import GENRES_DATA
 
@@ -133,6 +134,31 @@ async def parse_maidata(raw_mdt: dict[str, str], zip_path: Path | str) -> utils.
 @post_db_init
 async def maintenance_task():
     """数据重整主流程"""
+    await _maintenance_pipeline()
+
+    # 无论流程是否提前结束，都以数据库为准重建内存曲目目录
+    try:
+        catalog = await services.rebuild_catalog()
+        logger.info(f"maib-fetch: 曲目目录已重建，共 {len(catalog)} 首曲目")
+    except Exception as e:
+        logger.error(f"maib-fetch: 曲目目录重建失败，查询将回退到数据库，原因：{e}")
+        return
+
+    # 为新增或变更的谱面 ZIP 预生成曲绘缩略图，绘图时不再解压
+    start_time = time.time()
+    built = await asyncio.to_thread(image_gen.COVERS.build_all, list(catalog))
+    if built:
+        logger.info(f"maib-fetch: 生成 {built} 首曲目的曲绘缩略图，耗时: {(time.time() - start_time):.2f} 秒")
+
+    # 按尺寸打包曲绘图集，供渲染进程 mmap 读取
+    start_time = time.time()
+    atlases = await asyncio.to_thread(image_gen.COVERS.build_atlases, list(catalog))
+    if atlases:
+        logger.info(f"maib-fetch: 重建 {atlases} 个曲绘图集，耗时: {(time.time() - start_time):.2f} 秒")
+
+
+async def _maintenance_pipeline():
+    """数据重整流程（Step 1~6）"""
     now_time = time.time()
 
 
@@ -182,19 +208,14 @@ async def maintenance_task():
 
 
     # --- 2. ID 迁移 ---
-    # 处理 id_check 表中已填写的映射 (每个 id 单独事务)
+    # 处理 id_check 表中已填写的映射 (全部映射在单个事务中以集合操作完成)
     try:
-        id_checks = await services.list_pending_id_checks()
-        if id_checks:
-            logger.info(f"maib-fetch Step 2/6: 处理 {len(id_checks)} 条 shortid 映射规则")
-            for k, v in id_checks:
-                try:
-                    await services.apply_id_mapping(k, v)
-                    logger.info(f"maib-fetch Step 2/6: 应用映射 {k} -> {v}")
-                except Exception as e:
-                    logger.error(f"maib-fetch Step 2/6: 映射 {k}->{v} 失败: {e}")
+        counts = await services.apply_id_mappings()
+        if counts["mappings"]:
+            detail = ", ".join(f"{step}={count}" for step, count in counts.items())
+            logger.info(f"maib-fetch Step 2/6: 应用 {counts['mappings']} 条 shortid 映射规则 ({detail})")
     except Exception as e:
-        logger.error(f"maib-fetch Step 2/6: 读取 id_check 失败: {e}")
+        logger.error(f"maib-fetch Step 2/6: 应用 shortid 映射失败: {e}")
 
 
     # --- 2. 进行文件解析并更新数据库 ---
@@ -218,9 +239,9 @@ async def maintenance_task():
 
         if maidata_dict:
             try:
-                await services.sync_mdt_list([models.MaiDataModel.mdt(maidata)
-                                              for maidata in maidata_dict.values()])
-                logger.info(f"maib-fetch Step 3/6: 成功同步 {len(maidata_dict)} 个曲目")
+                synced_count = await services.sync_mdt_list([models.MaiDataModel.mdt(maidata)
+                                                              for maidata in maidata_dict.values()])
+                logger.info(f"maib-fetch Step 3/6: 成功同步 {len(maidata_dict)} 个曲目，其中 {synced_count} 个新增或变更")
             except Exception as e:
                 logger.error(f"maib-fetch Step 3/6: 数据库同步失败，原因：{e}")
 
@@ -269,10 +290,18 @@ async def maintenance_task():
                     if version_update_list:
                         await services.set_mdt_version_batch(version_update_list, 'CN', session=session)
                     
-                    # 批量更新谱面定数
+                    # 批量更新谱面定数（仅定数实际变动的谱面）
+                    changed_charts: list[tuple[int, int]] = []
                     if level_update_list:
-                        await services.set_mct_level_batch(level_update_list, 'CN', session=session)
-                    
+                        changed_charts = await services.set_mct_level_batch(level_update_list, 'CN', session=session)
+
+                    # 定数变动的谱面：批量重算已存成绩的 DX Rating 与用户缓存
+                    if changed_charts:
+                        refresh_start = time.time()
+                        affected_users = await services.refresh_dxrating_cache_by_charts(changed_charts, 'CN', session=session)
+                        logger.info(f"maib-fetch Step 4/6: 定数变动 {len(changed_charts)} 个谱面，"
+                                    f"重算 {len(affected_users)} 名用户的 DX Rating，耗时: {(time.time() - refresh_start):.2f} 秒")
+
                     await session.commit()
                     logger.success(f"maib-fetch Step 4/6: 同步完成 (曲目:{len(version_update_list)}, 谱面:{len(level_update_list)})")
             except Exception as e:
@@ -285,8 +314,10 @@ async def maintenance_task():
     
     
     # --- 4. 尝试从水鱼获取拟合数据 ---
-    sy_chart_stats = await network.sy_chart_stats()
-    if sy_chart_stats:
+    sy_chart_stats, is_new = await network.sy_chart_stats()
+    if sy_chart_stats and not (is_new or change_files):
+        logger.info("maib-fetch Step 5/6: 水鱼拟合定数数据未更新，跳过")
+    elif sy_chart_stats:
         logger.info("maib-fetch Step 5/6: 更新水鱼的国服拟合定数数据")
         try:
             synh_list: list[dict] = []
@@ -304,10 +335,12 @@ async def maintenance_task():
     # --- 5. 从别名库更新别名 ---
     logger.info("maib-fetch Step 6/6: 同步别名库数据")
     
-    async def yuzuchan():
-        yuzuchan_data = await network.yuzuchan_alias_list()
+    async def yuzuchan() -> list[tuple[int, str]] | None:
+        yuzuchan_data, is_new = await network.yuzuchan_alias_list()
         if not yuzuchan_data:
             return []
+        if not (is_new or change_files):
+            return None
         aliases_set: set[tuple[int, str]] = set()
         for entry in yuzuchan_data.get("content", []):
             song_id = int(entry.get('SongID', 0))
@@ -315,10 +348,12 @@ async def maintenance_task():
             aliases_set.update((song_id, alias) for alias in aliases)
         return list(aliases_set)
     
-    async def lxns():
-        lxns_data = await network.lx_alias_list()
+    async def lxns() -> list[tuple[int, str]] | None:
+        lxns_data, is_new = await network.lx_alias_list()
         if not lxns_data:
             return []
+        if not (is_new or change_files):
+            return None
         aliases_set: set[tuple[int, str]] = set()
         for entry in lxns_data.get("aliases", []):
             song_id = int(entry.get('song_id', 0))
@@ -327,10 +362,17 @@ async def maintenance_task():
         return list(aliases_set)
     
     
-    await services.add_mdt_alias_batch(await yuzuchan(), -101)
-    logger.info("maib-fetch Step 6/6: 同步 yuzuchan 别名数据完成")
-    await services.add_mdt_alias_batch(await lxns(), -102, lxns_id_rule=True)
-    logger.info("maib-fetch Step 6/6: 同步 lxns 别名数据完成")
+    # 别名库未更新 (304) 且无新谱面时返回 None，跳过入库
+    if (yuzuchan_aliases := await yuzuchan()) is None:
+        logger.info("maib-fetch Step 6/6: yuzuchan 别名数据未更新，跳过")
+    else:
+        await services.add_mdt_alias_batch(yuzuchan_aliases, -101)
+        logger.info("maib-fetch Step 6/6: 同步 yuzuchan 别名数据完成")
+    if (lxns_aliases := await lxns()) is None:
+        logger.info("maib-fetch Step 6/6: lxns 别名数据未更新，跳过")
+    else:
+        await services.add_mdt_alias_batch(lxns_aliases, -102, lxns_id_rule=True)
+        logger.info("maib-fetch Step 6/6: 同步 lxns 别名数据完成")
     
     
     # --- 6. 结束 ---
@@ -0,0 +1,149 @@
+"""
+maib 成品图片缓存
+
+按内容寻址（键为渲染输入的哈希）缓存已编码的成品图片字节，命中时无需任何 PIL 绘制与编码。
+
+- 内存：按总字节数限制的 LRU
+- 磁盘：`<缓存目录>/<名称>/<键>.img`，超过容量上限时按最近访问时间 (mtime) 淘汰
+- 内存缓存仅在事件循环线程中读写，磁盘读写放到线程中执行
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+from .bot_registry import PluginRegistry
+
+
+B50_CACHE_MEMORY_BYTES = 64 * 1024 * 1024  # B50 成品图内存缓存上限
+B50_CACHE_DISK_BYTES = 512 * 1024 * 1024  # B50 成品图磁盘缓存上限
+DISK_EVICT_RATIO = 0.9  # 磁盘超限时淘汰至上限的该比例，避免频繁扫描目录
+
+
+class ImageBytesCache:
+    """按内容寻址的图片字节两级缓存（内存 LRU + 磁盘）"""
+
+    def __init__(self, name: str, max_memory_bytes: int, max_disk_bytes: int, cache_dir: Optional[Path] = None):
+        self.name = name
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._cache_dir = cache_dir
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None  # 首次写入时扫描目录得到
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def cache_dir(self) -> Path:
+        return self._cache_dir or PluginRegistry.get_cache_dir() / self.name
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.img"
+
+    def _put_memory(self, key: str, data: bytes):
+        if len(data) > self.max_memory_bytes:
+            return
+        if (old := self._memory.pop(key, None)) is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """查询缓存，磁盘命中时回填内存"""
+        if (data := self._memory.get(key)) is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return data
+        data = await asyncio.to_thread(self._read_disk, key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._put_memory(key, data)
+        return data
+
+    async def put(self, key: str, data: bytes):
+        """写入内存与磁盘缓存"""
+        self._put_memory(key, data)
+        await asyncio.to_thread(self._write_disk, key, data)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        """读取磁盘缓存并刷新访问时间"""
+        path = self._disk_path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"[{self.name}] 读取图片缓存失败: {e}")
+            return None
+
+    def _write_disk(self, key: str, data: bytes):
+        path = self._disk_path(key)
+        try:
+            with self._disk_lock:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if self._disk_bytes is None:
+                    self._disk_bytes = sum(p.stat().st_size for p in path.parent.glob("*.img"))
+                tmp_path = path.with_name(f"{path.name}.tmp")
+                tmp_path.write_bytes(data)
+                old_size = path.stat().st_size if path.exists() else 0
+                tmp_path.replace(path)
+                self._disk_bytes += len(data) - old_size
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk()
+        except OSError as e:
+            logger.warning(f"[{self.name}] 写入图片缓存失败: {e}")
+
+    def _evict_disk(self):
+        """按访问时间从旧到新淘汰磁盘缓存，直至低于上限的 `DISK_EVICT_RATIO`"""
+        target = self.max_disk_bytes * DISK_EVICT_RATIO
+        entries = []
+        for p in self.cache_dir.glob("*.img"):
+            try:
+                stat = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        start = time.perf_counter()
+        removed = 0
+        for _, size, p in entries:
+            if total <= target:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        self._disk_bytes = total
+        logger.debug(f"[{self.name}] 淘汰 {removed} 个磁盘缓存文件，耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def clear(self):
+        """清空内存缓存（磁盘缓存保留）"""
+        self._memory.clear()
+        self._memory_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+        }
+
+
+b50_image_cache = ImageBytesCache("b50", B50_CACHE_MEMORY_BYTES, B50_CACHE_DISK_BYTES)
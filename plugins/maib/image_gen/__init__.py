@@ -38,9 +38,10 @@ from .utils import (
     BOUNDARIES_DX_RATING, BOUNDARIES_DX_RATING_NEW,
     _MS_DEFAULT
 )
-from .resources import FontManager, AssetsManager
+from .resources import FontManager, AssetsManager, CoverStore
+from ..bot_registry import PluginRegistry
 from .components import TextStyle, BaseDrawer, LevelBadge, DifficultyBadge, DrawBadge
-from .components import AchievementComponent, DXScoreComponent, EvaluateComponent
+from .components import AchievementComponent, DXScoreComponent, EvaluateComponent, TileCache
 
 # ========================================
 # 全局资源实例化
@@ -52,6 +53,28 @@ FONT = FontManager(ASSETS_PATH / "fonts")
 # 资源管理器实例化
 ASSETS = AssetsManager(ASSETS_PATH)
 
+# 曲绘缩略图存储实例化：预生成 mini_box (32) 与 info box (54) 在默认倍率下的尺寸
+COVER_THUMBNAIL_BASE_SIZES = (32, 54)
+COVERS = CoverStore(
+    sizes=[_MS_DEFAULT.x(size) for size in COVER_THUMBNAIL_BASE_SIZES],
+    root=lambda: PluginRegistry.get_cache_dir() / "covers",
+)
+
+# 图块缓存实例化（每个渲染进程各自持有）
+TILE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+TILE_CACHE = TileCache(TILE_CACHE_MAX_BYTES)
+
+
+def _cover_tile_key(data: MaiData) -> str:
+    """图块中曲绘的版本：与 `COVERS` 相同的谱面 ZIP stat 标识（无 ZIP 时退化为图片路径）"""
+    return COVERS.identity(data) or str(data.img_path)
+
+
+def _ach_tile_key(chart: MaiChart, server: SERVER_TAG) -> tuple:
+    """图块中成绩部分的可见输入：达成率、DX 分数与星级、FC / FS"""
+    ach = chart.get_ach(server=server)
+    return (ach.achievement, *ach.dxscore_tuple, ach.combo, ach.sync)
+
 
 def get_genre(genre_id: int, cn_level: Literal[0, 1, 2]) -> Tuple[str, str]:
     """获取流派信息"""
@@ -365,11 +388,15 @@ class ImageUnit:
         """组件：谱面信息框 Lite"""
         w, h, ow = 108, 25, 1  # w, h, outline_width
         diff = Difficulty.get(chart.difficulty)
+        plus = round(chart.lv % 1 * 10) >= plus_level
+        key = ("chart_box_lite", chart.difficulty, cabinet_dx, chart.lv, plus, is_utage,
+               *_ach_tile_key(chart, server), ms.multiple, cn_level)
+        if (tile := TILE_CACHE.get(key)) is not None:
+            return tile
 
         img = IMU.chart_box_base(diff=diff, cabinet_dx=cabinet_dx, w=w, h=h, ow=ow, ms=ms, cn_level=cn_level).copy()
         du = DrawUnit(img, multiple=ms, cn_level=cn_level)
         # 等级 LV
-        plus = round(chart.lv % 1 * 10) >= plus_level
         du.level(ow + 64, ow + 7.4, diff, chart.lv, plus=plus, ignore_decimal=is_utage)
         # 达成率
         ach = chart.get_ach(server=server)
@@ -381,6 +408,7 @@ class ImageUnit:
         img.paste(fc, ms.xy(ow + 3, ow + 12 - 3), fc)
         fs = IMU.evaluate(Sync.get(ach.sync), ms=ms, cn_level=cn_level)
         img.paste(fs, ms.xy(ow + 3, ow + 17 - 3), fs)
+        TILE_CACHE.put(key, img)
         return img
 
     @lru_cache(maxsize=32)
@@ -409,6 +437,10 @@ class ImageUnit:
         chart = data.get_chart(diff_number) if data else None
         if not chart or data is None:
             return width, height  # 视为占位，返回尺寸供布局使用
+        key = ("mini_box", data.shortid, diff_number, data.is_cabinet_dx, _cover_tile_key(data),
+               *_ach_tile_key(chart, server), ms.multiple, cn_level)
+        if (tile := TILE_CACHE.get(key)) is not None:
+            return tile
         ach = chart.get_ach(server=server)
 
         img = IMU.mini_box_base(
@@ -422,12 +454,12 @@ class ImageUnit:
             cn_level=cn_level,
         ).copy()
         du = DrawUnit(img, multiple=ms, cn_level=cn_level)
-        # 曲绘
-        cover = data.get_image(shared_zip=shared_zip)
-        if cover:
+        # 曲绘（预缩放缩略图）
+        cover_img = COVERS.thumbnail(data, ms.x(32), shared_zip=shared_zip)
+        if cover_img:
             mask = IMU.get_mask(w=32, h=32, radius=1.5, ms=ms)
-            cover_img = cover.resize(ms.xy(32, 32), Image.Resampling.LANCZOS)
             img.paste(cover_img, ms.xy(ow + 2, ow + 2), mask)
+            cover_img.close()
         # 达成率
         du.ach(ow + 35, ow + 9, diff, ach_percent=ach.achievement)
         dxs, dxs_max, dxs_star = ach.dxscore_tuple
@@ -438,6 +470,7 @@ class ImageUnit:
         fs = IMU.evaluate(Sync.get(ach.sync), mini=True, ms=ms, cn_level=cn_level)
         img.paste(fs, ms.xy(ow + 36, ow + 29), fs)
         # INFO: 留空 (x=53, y=25, w=42, h=5) 可供自定义
+        TILE_CACHE.put(key, img)
         return img
 
     @lru_cache(maxsize=12)
@@ -462,6 +495,12 @@ class ImageUnit:
         chart = data.get_chart(diff_number)
         if not chart:
             return None
+        dxrating = data.get_chart_dxrating(diff_number, server, current_version)
+        # 名次变化时仅需重绘底部标签，底图由 mini_box 缓存提供
+        key = ("b50_box", data.shortid, diff_number, data.is_cabinet_dx, _cover_tile_key(data),
+               *_ach_tile_key(chart, server), is_b15, index, chart.lv, dxrating, ms.multiple, cn_level)
+        if (tile := TILE_CACHE.get(key)) is not None:
+            return tile
         img = self.mini_box(data=data, diff_number=diff_number, server=server, ms=ms, cn_level=cn_level, shared_zip=shared_zip)
         if isinstance(img, tuple):
             return None
@@ -471,7 +510,8 @@ class ImageUnit:
         du.rounded_rect(54, 25, 16, 5, fill='#006', radius=4)
         b_type = '15' if is_b15 else '35'
         du.text(62, 27.5, f"b{b_type} #{index}", fill='#FFF', anchor='mm', font=FONT.font(FontCode.MiSans_Demibold, size=ms.x(3)))
-        du.text(74, 27.5, f"{chart.lv:.1f} > {data.get_chart_dxrating(diff_number, server, current_version)}", fill='#FFF', anchor='lm', font=FONT.font(FontCode.MiSans_Demibold, size=ms.x(3)))
+        du.text(74, 27.5, f"{chart.lv:.1f} > {dxrating}", fill='#FFF', anchor='lm', font=FONT.font(FontCode.MiSans_Demibold, size=ms.x(3)))
+        TILE_CACHE.put(key, img)
         return img
 
 IMU = ImageUnit()  # 全局图像元件实例
@@ -578,6 +618,6 @@ def _user_header_board(
     return board_title
 
 
-from .builder import draw_b50, draw_info_box, get_image_bytes, simple_list, simple_maidata_box
+from .builder import draw_b50, draw_info_box, get_image_bytes, get_user_avatar_size, simple_list, simple_maidata_box
 
 __all__ = ["draw_info_box", "draw_b50", "simple_list"]
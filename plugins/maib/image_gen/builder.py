@@ -6,7 +6,6 @@ image_gen 高级画布拼装层
 from __future__ import annotations
 
 import io
-import zipfile
 from pathlib import Path
 from typing import Literal, Optional, Tuple, List
 
@@ -31,7 +30,7 @@ from .utils import MS, _MS_DEFAULT, bcm, get_full_width_text
 
 # 这些对象由 image_gen.__init__ 初始化后回填到包级命名空间。
 # builder 通过包级导入复用它们，避免重复初始化资源。
-from . import ASSETS, FONT, IMU, DrawUnit, get_genre
+from . import ASSETS, COVERS, FONT, IMU, DrawUnit, get_genre
 
 
 __all__ = [
@@ -40,8 +39,16 @@ __all__ = [
     "simple_list",
     "simple_maidata_box",
     "get_image_bytes",
+    "get_user_avatar_size",
 ]
 
+USER_AVATAR_SIZE = 32  # 用户头像边长（缩放前）
+
+
+def get_user_avatar_size(ms: MS = _MS_DEFAULT) -> tuple[int, int]:
+    """用户头像的实际像素尺寸，预先缩放的头像按此尺寸传入可跳过绘制时的缩放"""
+    return ms.xy(USER_AVATAR_SIZE, USER_AVATAR_SIZE)
+
 
 def _image_grid_board(
     image_list: list[Image.Image],
@@ -89,7 +96,7 @@ def _user_header_board(
     board_title = Image.new("RGBA", ms.xy(inner_width, header_h), NO_COLOR)
     du1 = DrawUnit(board_title, multiple=ms, cn_level=cn_level)
 
-    avatar_size = 32
+    avatar_size = USER_AVATAR_SIZE
     if user_avatar and isinstance(user_avatar, bytes):
         try:
             avatar = Image.open(io.BytesIO(user_avatar)).convert("RGBA")
@@ -148,9 +155,8 @@ def draw_info_box(
     board1 = Image.new("RGBA", ms.xy(width, cover_width + 2), NO_COLOR)
     du1 = DrawUnit(board1, multiple=ms, cn_level=cn_level)
 
-    img = maidata.image if maidata.image else Image.new("RGB", ms.xy(cover_width, cover_width), color="#999")
+    cover_img = COVERS.thumbnail(maidata, ms.x(cover_width)) or Image.new("RGB", ms.xy(cover_width, cover_width), color="#999")
     mask = IMU.get_mask(w=cover_width, h=cover_width, radius=5, ms=ms)
-    cover_img = img.resize(ms.xy(cover_width, cover_width), Image.Resampling.LANCZOS) if img.size != (cover_width, cover_width) else img
     board1.paste(cover_img, ms.xy(1, 1), mask)
     du1.rounded_rect(1, 1, cover_width, cover_width, radius=5, fill=None, outline="#FFF", width=1)
 
@@ -308,49 +314,20 @@ def draw_b50(
         cn_level=cn_level,
     )
 
-    shared_zip_handles: dict[Path, zipfile.ZipFile] = {}
-    try:
-        for maidata, _ in (*b35_entries, *b15_entries):
-            zip_path = maidata.zip_path
-            if zip_path and zip_path not in shared_zip_handles:
-                shared_zip_handles[zip_path] = zipfile.ZipFile(zip_path, "r")
-
-        b35_imgs = [
-            IMU.b50_box(
-                maidata,
-                diff,
-                server,
-                current_version,
-                index,
-                False,
-                ms,
-                cn_level,
-                shared_zip=shared_zip_handles.get(maidata.zip_path) if maidata.zip_path else None,
-            )
-            for index, (maidata, diff) in enumerate(b35_entries, start=1)
-        ]
-        b35_imgs = [img for img in b35_imgs if img is not None]
-        board_b35 = _image_grid_board(b35_imgs, cols=line_width, gap=ms.x(5), skip_first=line_width == 4, auto_close=True)
-
-        b15_imgs = [
-            IMU.b50_box(
-                maidata,
-                diff,
-                server,
-                current_version,
-                index,
-                True,
-                ms,
-                cn_level,
-                shared_zip=shared_zip_handles.get(maidata.zip_path) if maidata.zip_path else None,
-            )
-            for index, (maidata, diff) in enumerate(b15_entries, start=1)
-        ]
-        b15_imgs = [img for img in b15_imgs if img is not None]
-        board_b15 = _image_grid_board(b15_imgs, cols=line_width, gap=ms.x(5), skip_first=line_width == 4, auto_close=True)
-    finally:
-        for zip_handle in shared_zip_handles.values():
-            zip_handle.close()
+    # 曲绘取自预生成的缩略图 (COVERS)，无需打开谱面 ZIP
+    b35_imgs = [
+        IMU.b50_box(maidata, diff, server, current_version, index, False, ms, cn_level)
+        for index, (maidata, diff) in enumerate(b35_entries, start=1)
+    ]
+    b35_imgs = [img for img in b35_imgs if img is not None]
+    board_b35 = _image_grid_board(b35_imgs, cols=line_width, gap=ms.x(5), skip_first=line_width == 4, auto_close=True)
+
+    b15_imgs = [
+        IMU.b50_box(maidata, diff, server, current_version, index, True, ms, cn_level)
+        for index, (maidata, diff) in enumerate(b15_entries, start=1)
+    ]
+    b15_imgs = [img for img in b15_imgs if img is not None]
+    board_b15 = _image_grid_board(b15_imgs, cols=line_width, gap=ms.x(5), skip_first=line_width == 4, auto_close=True)
 
     board_last = IMU.copyright_bar(width=width, ms=ms, cn_level=cn_level)
 
@@ -6,9 +6,11 @@ image_gen 组件库
 from .base import TextStyle, BaseDrawer
 from .badge import LevelBadge, DifficultyBadge, DrawBadge
 from .score import AchievementComponent, DXScoreComponent, EvaluateComponent
+from .tile_cache import TileCache
 
 __all__ = [
     'TextStyle', 'BaseDrawer',
     'LevelBadge', 'DifficultyBadge', 'DrawBadge',
     'AchievementComponent', 'DXScoreComponent', 'EvaluateComponent',
+    'TileCache',
 ]
@@ -0,0 +1,61 @@
+"""
+图块渲染缓存
+- TileCache: 已渲染图块（b50_box / mini_box / chart_box_lite）的 LRU 缓存，按像素字节数限额
+
+键由调用方按图块的全部可见输入构造；读写均复制图像，调用方可自由修改或关闭返回的图块。
+"""
+
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from PIL import Image
+
+
+class TileCache:
+    """按字节预算的图块 LRU 缓存"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._tiles: OrderedDict[Hashable, Image.Image] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size_of(img: Image.Image) -> int:
+        return img.width * img.height * len(img.getbands())
+
+    def get(self, key: Hashable) -> Optional[Image.Image]:
+        """命中时返回图块副本"""
+        tile = self._tiles.get(key)
+        if tile is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._tiles.move_to_end(key)
+        return tile.copy()
+
+    def put(self, key: Hashable, img: Image.Image):
+        """保存图块副本（超过总预算的单个图块不缓存）"""
+        size = self._size_of(img)
+        if size > self.max_bytes:
+            return
+        if (old := self._tiles.pop(key, None)) is not None:
+            self._bytes -= self._size_of(old)
+        self._tiles[key] = img.copy()
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._tiles.popitem(last=False)
+            self._bytes -= self._size_of(evicted)
+
+    def clear(self):
+        self._tiles.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "tiles": len(self._tiles),
+            "bytes": self._bytes,
+        }
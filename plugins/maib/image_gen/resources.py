@@ -2,14 +2,22 @@
 image_gen 资源管理器
 - FontManager: 字体加载与缓存
 - AssetsManager: 图片资源加载与缓存
+- CoverStore: 曲绘缩略图存储（预先解压、预先缩放，按尺寸打包为可 mmap 的图集）
 """
 
+import mmap
+import struct
+import zipfile
 from pathlib import Path
-from typing import Optional, Tuple, Union
+from typing import Callable, Iterable, NamedTuple, Optional, Tuple, Union
 from functools import lru_cache
 from enum import StrEnum
 
+import orjson
 from PIL import Image, ImageFont
+from loguru import logger
+
+from ..utils import MaiData, get_file_stat_identity
 
 
 class FontCode(StrEnum):
@@ -175,3 +183,235 @@ class AssetsManager:
     def background(self, size: Tuple[int, int] | None = None) -> Image.Image | None:
         """获取背景图"""
         return self._get_image(self._assets_path / "img" / "bakamai.png", size)
+
+
+# 图集文件格式：文件头（魔数、索引偏移与长度）| 填充至页对齐 | 按槽位连续存放的 RGBA 原始像素 | 索引 JSON
+ATLAS_MAGIC = b"MAIBCOV1"
+ATLAS_HEADER = struct.Struct("<8sQI")
+ATLAS_DATA_OFFSET = mmap.ALLOCATIONGRANULARITY
+
+
+class _Atlas(NamedTuple):
+    """已映射的缩略图图集"""
+    stat_key: tuple[int, int]  # (st_ino, st_mtime_ns)，文件被替换后重新映射
+    buffer: Optional[memoryview]  # 文件损坏时为 None
+    slots: dict[str, int]  # 缩略图键 -> 槽位
+    keys: frozenset[str]  # 生成时的全部曲目键（含无曲绘的曲目），用于判断是否需要重建
+
+
+class CoverStore:
+    """
+    曲绘缩略图存储 - 以 `shortid + 谱面 ZIP stat 标识 + 像素边长` 为键，存放可直接粘贴的缩略图
+
+    - 由 fetch 流程在入库后调用 `build_all` 预先生成 PNG 缩略图，再调用 `build_atlases` 按尺寸打包为图集
+    - 绘图时 `thumbnail` 优先从 mmap 映射的图集中以 `Image.frombuffer` 零拷贝取得缩略图，
+      不解码 PNG；各渲染进程共享同一份页缓存
+    - ZIP 变更（stat 标识变化）后旧缩略图自动失效，重建时清除
+    - 图集中缺少时依次回退为读取 PNG 缩略图、解压原图并缩放（同时补写 PNG 缩略图）
+    """
+
+    def __init__(self, sizes: Iterable[int], root: Path | Callable[[], Path]):
+        """
+        Args:
+            sizes: 需要预生成的缩略图像素边长
+            root: 存储目录，或返回存储目录的函数（延迟获取）
+        """
+        self.sizes = tuple(sorted(set(sizes)))
+        self._root = root
+        self._atlases: dict[int, _Atlas] = {}
+
+    @property
+    def root(self) -> Path:
+        if callable(self._root):
+            self._root = self._root()
+        return self._root
+
+    @root.setter
+    def root(self, root: Path):
+        self._root = root
+
+    @staticmethod
+    def identity(maidata: MaiData) -> Optional[str]:
+        """谱面 ZIP 的 stat 标识，ZIP 不存在时返回 None"""
+        if not maidata.zip_path:
+            return None
+        try:
+            return get_file_stat_identity(Path(maidata.zip_path))
+        except OSError:
+            return None
+
+    def _path(self, shortid: int, identity: str, size: int) -> Path:
+        return self.root / f"{shortid}_{identity}_{size}.png"
+
+    def _atlas_path(self, size: int) -> Path:
+        return self.root / f"atlas_{size}.rgba"
+
+    @staticmethod
+    def _tile_key(shortid: int, identity: str) -> str:
+        return f"{shortid}_{identity}"
+
+    @staticmethod
+    def _scale(cover: Image.Image, size: int) -> Image.Image:
+        if cover.mode not in ("RGB", "RGBA"):
+            cover = cover.convert("RGBA")
+        return cover.resize((size, size), Image.Resampling.LANCZOS)
+
+    def _save(self, img: Image.Image, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.stem}.tmp{path.suffix}")
+        img.save(tmp_path, format="png")
+        tmp_path.replace(path)
+
+    def thumbnail(self, maidata: MaiData, size: int,
+                  shared_zip: zipfile.ZipFile | None = None) -> Image.Image | None:
+        """获取 `size x size` 的曲绘缩略图，无曲绘时返回 None（图集命中时返回只读图像，不可原地修改）"""
+        identity = self.identity(maidata)
+        if identity is not None:
+            if (tile := self._atlas_tile(self._tile_key(maidata.shortid, identity), size)) is not None:
+                return tile
+            path = self._path(maidata.shortid, identity, size)
+            try:
+                with Image.open(path) as img:
+                    img.load()
+                    return img.copy() if img.mode in ("RGB", "RGBA") else img.convert("RGBA")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"曲绘缩略图损坏，将重新生成: {path} | {e}")
+
+        # 回退：解压原图并缩放（不写入 maidata，曲目可能是共享的目录快照）
+        cover = maidata.open_image(shared_zip=shared_zip)
+        if cover is None:
+            return None
+        try:
+            thumb = self._scale(cover, size)
+        finally:
+            cover.close()
+        if identity is not None:
+            try:
+                self._save(thumb, self._path(maidata.shortid, identity, size))
+            except OSError as e:
+                logger.warning(f"保存曲绘缩略图失败: {e}")
+        return thumb
+
+    def build(self, maidata: MaiData, force: bool = False) -> bool:
+        """解压一次曲绘并生成全部尺寸的缩略图，返回是否实际生成"""
+        identity = self.identity(maidata)
+        if identity is None:
+            return False
+        paths = {size: self._path(maidata.shortid, identity, size) for size in self.sizes}
+        if not force and all(p.exists() for p in paths.values()):
+            return False
+        cover = maidata.open_image()
+        if cover is None:
+            return False
+        try:
+            for size, path in paths.items():
+                self._save(self._scale(cover, size), path)
+        finally:
+            cover.close()
+        # 清理该曲目旧 ZIP 标识下的缩略图
+        current = set(paths.values())
+        for old in self.root.glob(f"{maidata.shortid}_*.png"):
+            if old not in current and old.stem.rsplit("_", 1)[0] != f"{maidata.shortid}_{identity}":
+                old.unlink(missing_ok=True)
+        return True
+
+    def build_all(self, maidatas: Iterable[MaiData]) -> int:
+        """为缺少缩略图的曲目批量生成缩略图（同步执行，耗时较长，应放到线程中调用），返回生成数量"""
+        built = 0
+        for maidata in maidatas:
+            try:
+                built += self.build(maidata)
+            except Exception as e:
+                logger.warning(f"生成曲绘缩略图失败: {maidata.shortid} | {e}")
+        return built
+
+    # --- 图集 ---
+
+    def _open_atlas(self, size: int) -> Optional[_Atlas]:
+        """映射 `size` 尺寸的图集，文件不存在时返回 None，文件被替换后重新映射（损坏的图集视为空图集）"""
+        path = self._atlas_path(size)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self._atlases.pop(size, None)
+            return None
+        stat_key = (stat.st_ino, stat.st_mtime_ns)
+        atlas = self._atlases.get(size)
+        if atlas is not None and atlas.stat_key == stat_key:
+            return atlas
+
+        # 旧映射不主动关闭：仍被引用的图块持有其缓冲区，释放引用后自动回收
+        self._atlases.pop(size, None)
+        try:
+            with open(path, "rb") as f:
+                buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            magic, index_offset, index_len = ATLAS_HEADER.unpack_from(buffer)
+            if magic != ATLAS_MAGIC:
+                raise ValueError("魔数不匹配")
+            index = orjson.loads(buffer[index_offset:index_offset + index_len])
+            if index["size"] != size or index_offset < ATLAS_DATA_OFFSET + len(index["slots"]) * size * size * 4:
+                raise ValueError("索引与文件长度不一致")
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            logger.warning(f"曲绘图集无法读取，将回退为 PNG 缩略图: {path} | {e}")
+            atlas = _Atlas(stat_key, None, {}, frozenset())
+        else:
+            atlas = _Atlas(stat_key, buffer, index["slots"], frozenset(index["keys"]))
+        self._atlases[size] = atlas
+        return atlas
+
+    def _atlas_tile(self, key: str, size: int) -> Optional[Image.Image]:
+        atlas = self._open_atlas(size)
+        if atlas is None or (slot := atlas.slots.get(key)) is None:
+            return None
+        tile_bytes = size * size * 4
+        start = ATLAS_DATA_OFFSET + slot * tile_bytes
+        return Image.frombuffer("RGBA", (size, size), atlas.buffer[start:start + tile_bytes], "raw", "RGBA", 0, 1)
+
+    def build_atlas(self, maidatas: Iterable[MaiData], size: int) -> bool:
+        """将全部曲目 `size` 尺寸的缩略图打包为图集，曲目集合与 ZIP 标识均未变化时跳过，返回是否实际重建"""
+        entries: dict[str, MaiData] = {}
+        for maidata in maidatas:
+            if (identity := self.identity(maidata)) is not None:
+                entries[self._tile_key(maidata.shortid, identity)] = maidata
+        atlas = self._open_atlas(size)
+        if atlas is not None and atlas.keys == entries.keys():
+            return False
+
+        # 逐个写入像素数据，最后写入索引并回填文件头
+        path = self._atlas_path(size)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        slots: dict[str, int] = {}
+        with open(tmp_path, "wb") as f:
+            f.seek(ATLAS_DATA_OFFSET)
+            for key, maidata in entries.items():
+                try:
+                    tile = self.thumbnail(maidata, size)
+                except Exception as e:
+                    logger.warning(f"读取曲绘缩略图失败: {maidata.shortid} | {e}")
+                    continue
+                if tile is None:
+                    continue
+                slots[key] = len(slots)
+                f.write(tile.tobytes() if tile.mode == "RGBA" else tile.convert("RGBA").tobytes())
+                tile.close()
+            index_offset = f.tell()
+            index_bytes = orjson.dumps({"size": size, "slots": slots, "keys": list(entries)})
+            f.write(index_bytes)
+            f.seek(0)
+            f.write(ATLAS_HEADER.pack(ATLAS_MAGIC, index_offset, len(index_bytes)))
+        tmp_path.replace(path)
+        return True
+
+    def build_atlases(self, maidatas: Iterable[MaiData]) -> int:
+        """为每个尺寸重建图集（同步执行，应放到线程中调用），返回重建的图集数量"""
+        maidatas = list(maidatas)
+        built = 0
+        for size in self.sizes:
+            try:
+                built += self.build_atlas(maidatas, size)
+            except OSError as e:
+                logger.warning(f"生成曲绘图集失败: {size}px | {e}")
+        return built
@@ -11,22 +11,7 @@ from pathlib import Path
 from typing import Optional, Tuple
 from PIL import Image, ImageFont
 
-
-# ========================================
-# 全角字符转换表
-# ========================================
-
-def _build_full_width_table():
-    """构建半角到全角的转换表"""
-    # 半角空格 (32) 对应全角空格 (12288)
-    # 其他 ASCII 可打印字符 (33-126) 对应全角 (65281-65374)
-    # 偏移量通常为 0xFEE0 (65248)
-    half_width = "".join(chr(i) for i in range(32, 127))
-    full_width = "　" + "".join(chr(i + 0xFEE0) for i in range(33, 127))
-    return str.maketrans(half_width, full_width)
-
-
-CHAR_FULL_WIDTH_TABLE = _build_full_width_table()
+from ..utils import CHAR_FULL_WIDTH_TABLE
 
 
 # ========================================
@@ -1,8 +1,10 @@
+import asyncio
 import base64
 import hashlib
 import re
 import time
 import random
+from functools import wraps
 from pathlib import Path
 from typing import Optional, List, Any, cast
 
@@ -11,15 +13,19 @@ import orjson
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
-from . import utils, services, image_gen, bot_services, network, models
+from . import utils, services, image_gen, bot_services, network, models, render
 from .napcat_stream import NapCatStreamFile
 # from .report import build_achievements_report, build_import_report
 from .report import MaiChartAchDiffReport, build_diff_report
+from .user_cache import user_cache
+from .avatar_cache import avatar_cache
+from .throttle import SingleFlight
 from .utils import MaiChart, MaiChartAch, link_cache, link_hash_index, NoLinkQQError
 from .constants import *
 from .bot_registry import PluginRegistry
 
 from nonebot import logger, on_regex, on_message
+from nonebot.exception import MatcherException
 from nonebot.rule import Rule
 from nonebot.params import RegexGroup
 from nonebot.internal.matcher import Matcher
@@ -110,7 +116,7 @@ _REPLY_DICT: dict[str, str | list[str]] = {
     "mws_found_one": "猜你想找：{shortid}. {title}",
     "mws_found_multiple": "小梨找到了 {count} 首乐曲，请查看是否有你的期待w",
     "mws_found_multiple_more": "小梨翻到了好多歌……呜哇，{count}首（）",
-    "mws_found_too_many": "太多了啦！缩小一下搜索范围吧qwq",
+    "mws_found_multiple_top": "小梨翻到了好多歌……先列出最接近的 {count} 首吧！",
     # mai_alias (alias)
     "alias_added_successfully": "成功为 {shortid} 添加别名【{alias}】！",
     "alias_already_exists": "这个别名似乎已经存在了捏~",
@@ -215,6 +221,29 @@ async def _build_sy_records_hash(records: list[dict[str, Any]]) -> str:
     return hashlib.md5(payload).hexdigest()
 
 
+@Bot.on_calling_api
+async def _commit_scope_before_api(bot: Bot, api: str, data: dict[str, Any]):
+    """调用 Bot API（发送消息、上传文件等）前提交处理器的数据库作用域，等待期间不占用连接与锁"""
+    # 钩子在独立任务中执行，处理器任务此时正在等待 API 调用
+    await services.commit_scope(owner_waiting=True)
+
+
+def db_scope(func):
+    """命令处理器装饰器：整个命令复用同一个数据库会话（外部 I/O 前提前提交），结束时记录查询数"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        # matcher.finish() 等流程控制异常视为正常结束，照常提交
+        async with services.session_scope(commit_on=(MatcherException,)) as session:
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                logger.debug(f"maib {func.__name__}: 数据库查询 {services.get_scope_query_count(session)} 次，"
+                             f"耗时 {(time.perf_counter() - start_time) * 1000:.1f} ms，"
+                             f"用户缓存命中率 {user_cache.hit_ratio:.1%}")
+    return wrapper
+
+
 # --- 准业务逻辑 ---
 
 async def get_maiuser(event: Event, user_id: int | None = None) -> utils.MaiUser:
@@ -229,11 +258,12 @@ async def get_maiuser(event: Event, user_id: int | None = None) -> utils.MaiUser
             raise ValueError(reply("error_invalid_user_id", raw_uid=raw_uid)) from e
 
     if isinstance(event, OneBotV11Event):
-        mu = await services.get_or_create_user_by_id(user_id)
+        mu = await services.get_user_data(user_id)
     elif isinstance(event, TGEvent):
-        mu = await services.get_user_by_telegram_id(user_id)
-        if mu is None:
+        tg_mu = await services.get_user_by_telegram_id(user_id)
+        if tg_mu is None:
             raise NoLinkQQError(reply("error_user_not_found"))
+        mu = tg_mu.to_data()
     else:
         # platform event
         raise ValueError(reply("error_unexpected"))
@@ -246,15 +276,14 @@ async def get_maiuser(event: Event, user_id: int | None = None) -> utils.MaiUser
         await services.set_username(qq, username)
         mu.username = username
     
-    return mu.to_data()
+    return mu
 
 async def get_maidata_with_ach(short_id: int, target_server: SERVER_TAG, user_id: int) -> Optional[tuple[utils.MaiData, SERVER_TAG]]:
     """获取乐曲数据并处理服务器回退逻辑"""
-    mdt = await services.get_mdt_by_id(short_id, user_id)
-    if not mdt:
+    maidata = await services.get_maidata_by_id(short_id, user_id)
+    if not maidata:
         return None
         
-    maidata = mdt.to_data(include_achs=True)
     # 核心回退逻辑：如果没有国服版本，强制回退到日服展示
     actual_server = target_server if maidata.version_cn is not None else "JP"
     
@@ -325,6 +354,7 @@ async def tg_read_json(bot: TGBot, file_id: str) -> Optional[Any]:
 # --- link ---
 
 @link.handle()
+@db_scope
 async def link_handled(event: Event, matcher: Matcher, groups: tuple = RegexGroup()):
     """处理命令: link"""
     action, args_text = groups
@@ -478,6 +508,7 @@ async def _cleanup_expired_group_files(bot: OneBotV11Bot, group_id: int, folder_
             break
 
 @adx_download.handle()
+@db_scope
 async def adx_download_handled(bot: Bot, event: Event, matcher: Matcher, groups: tuple = RegexGroup()): 
     """处理命令: 下载谱面11568"""
     raw_short_id, archive_type = groups
@@ -621,6 +652,7 @@ async def adx_download_handled(bot: Bot, event: Event, matcher: Matcher, groups:
 # --- mai_info ---
 
 @mai_info.handle()
+@db_scope
 async def mai_info_handled(event: Event, matcher: Matcher, groups: tuple = RegexGroup()):
     """处理命令: id11451 / info11451"""
     _, short_id, args = groups
@@ -647,17 +679,17 @@ async def mai_info_handled(event: Event, matcher: Matcher, groups: tuple = Regex
     
     server = server if (server != 'ALL' and server is not None) else default_server  # 暂不支持 ALL
     # 查询乐曲信息
-    if (mdt := await services.get_mdt_by_id(shortid, qq)) is None:
+    if (maidata := await services.get_maidata_by_id(shortid, qq)) is None:
         await matcher.finish(reply("mai_info_no_maidata", short_id=shortid))
         return
-    maidata = mdt.to_data(include_achs=True)
     s = server if maidata.version_cn is not None else "JP"  # 如果乐曲没有国服版本，则展示日服数据
     
-    info_box = image_gen.draw_info_box(maidata, s, maiuser=maiuser, cn_level=1 if s == 'CN' else 0)
-    info_box_bytes = image_gen.get_image_bytes(info_box)
+    info_box_bytes = await render.render(
+        render.InfoBoxRenderSpec(maidata, s, maiuser=maiuser, cn_level=1 if s == 'CN' else 0)
+    )
     
     payload = [
-        ("text", f"{mdt.shortid}. {mdt.title}"),
+        ("text", f"{maidata.shortid}. {maidata.title}"),
         ("image", info_box_bytes)
     ]
     if qq is None:
@@ -665,6 +697,7 @@ async def mai_info_handled(event: Event, matcher: Matcher, groups: tuple = Regex
     await build_msg(matcher, event, payload, tag='finish')
 
 @mai_what_song.handle()
+@db_scope
 async def mai_what_song_handled(event: Event, matcher: Matcher, groups: tuple = RegexGroup()):
     """处理命令: xxx是什么歌"""
     keyword, all_tag = groups
@@ -686,8 +719,8 @@ async def mai_what_song_handled(event: Event, matcher: Matcher, groups: tuple =
 
     try:
         # 搜索歌曲
-        search_func = services.get_mdt_by_name_blur if blur_search else services.get_mdt_by_name_smart
-        mdt_list = list(await search_func(keyword, achs_userid=qq))
+        search_func = services.get_maidata_by_name_blur if blur_search else services.get_maidata_by_name_smart
+        mdt_list, truncated = await search_func(keyword, achs_userid=qq)
     except ValueError as exc:
         await matcher.finish(str(exc))
         return
@@ -698,12 +731,12 @@ async def mai_what_song_handled(event: Event, matcher: Matcher, groups: tuple =
         await matcher.finish(reply("mws_found_no_results", keyword=keyword))
         return
 
-    def generate_single_info_box(mdt) -> bytes:
+    async def generate_single_info_box(maidata: utils.MaiData) -> bytes:
         """生成单首乐曲的 info box 图片字节"""
-        maidata = mdt.to_data(include_achs=True)
         s = server if maidata.version_cn is not None else "JP"
-        info_box = image_gen.draw_info_box(maidata, server=s, maiuser=maiuser, cn_level=1 if s == 'CN' else 0)
-        return image_gen.get_image_bytes(info_box)
+        return await render.render(
+            render.InfoBoxRenderSpec(maidata, s, maiuser=maiuser, cn_level=1 if s == 'CN' else 0)
+        )
 
     # 输出结果
     payload = []
@@ -711,38 +744,36 @@ async def mai_what_song_handled(event: Event, matcher: Matcher, groups: tuple =
     if len(mdt_list) == 1:
         mdt = mdt_list[0]
         payload.append(("text", reply("mws_found_one", shortid=mdt.shortid, title=mdt.title)))
-        payload.append(("image", generate_single_info_box(mdt)))
+        payload.append(("image", await generate_single_info_box(mdt)))
 
     elif len(mdt_list) <= 4:
         payload.append(("text", reply("mws_found_multiple", count=len(mdt_list))))
-        for mdt in mdt_list:
-            payload.append(("image", generate_single_info_box(mdt)))
+        # 多张信息图并行渲染
+        info_boxes = await asyncio.gather(*(generate_single_info_box(mdt) for mdt in mdt_list))
+        payload.extend(("image", info_box) for info_box in info_boxes)
 
-    elif len(mdt_list) <= 40:
-        # 结果大于 4 首，采用简要列表图承载
+    else:
+        # 结果大于 4 首（至多 `MAX_BLUR_SEARCH_RESULTS` 首），采用简要列表图承载
         # TODO 采用类似于 b50 样式的可视化列表图（默认显示对应的最高难度）
-        img = image_gen.simple_maidata_box([mdt.to_data() for mdt in mdt_list])
-        img_bytes = image_gen.get_image_bytes(img)
-        payload.append(("text", reply("mws_found_multiple_more", count=len(mdt_list))))
+        img_bytes = await render.render(render.MaidataListRenderSpec(mdt_list))
+        # 模糊搜索结果被截断时，列表为按相关度截取的前 N 首
+        more_key = "mws_found_multiple_top" if truncated else "mws_found_multiple_more"
+        payload.append(("text", reply(more_key, count=len(mdt_list))))
         payload.append(("image", img_bytes))
 
-    else:
-        await matcher.finish(reply("mws_found_too_many"))
-        return
-
     # 4. 统一发送消息
     await build_msg(matcher, event, payload, tag='finish')
 
 # --- mai_alias ---
 
 @mai_alias.handle()
+@db_scope
 async def mai_alias_handled(event: Event, matcher: Matcher, groups: tuple = RegexGroup()):
     """处理命令: 添加别名 id11451 xxx / 删除别名 id11451 xxx"""
     action, shortid, alias = groups
     try:
         short_id = int(shortid)
-        mdt: Optional[services.MaiData] = await services.get_mdt_by_id(short_id)
-        if not mdt:
+        if not await services.get_maidata_by_id(short_id):
             raise ValueError
     except (ValueError, TypeError):
         await matcher.finish(reply("mai_info_no_shortid"))
@@ -775,6 +806,7 @@ async def mai_alias_handled(event: Event, matcher: Matcher, groups: tuple = Rege
 # --- ra_calc ---
 
 @ra_calc.handle()
+@db_scope
 async def ra_calc_handled(matcher: Matcher, groups: tuple = RegexGroup()):
     """处理命令: ra 13.2 100.1000"""
     info, rate = groups
@@ -797,11 +829,11 @@ async def ra_calc_handled(matcher: Matcher, groups: tuple = RegexGroup()):
         level = 0  # 大于 20 则一定不为定数，驳回上述解析
         try:
             shortid = int(info)
-            mai = await services.get_mdt_by_id(shortid)
+            mai = await services.get_maidata_by_id(shortid)
         except (ValueError, TypeError):
             mai = None
         if mai and mai.charts:
-            level = mai.charts[-1].lv  # 取最高难度的定数
+            level = mai.charts[max(mai.charts)].lv  # 取最高难度的定数
 
     # 3. 尝试以 id11451/info11451/id114514紫 形式解析
     if level == 0:
@@ -816,11 +848,11 @@ async def ra_calc_handled(matcher: Matcher, groups: tuple = RegexGroup()):
             level_str = match.group(0)
             try:
                 shortid = int(level_str)
-                mai = await services.get_mdt_by_id(shortid)
+                mai = await services.get_maidata_by_id(shortid)
             except (ValueError, TypeError):
                 mai = None
-            if mai:
-                charts = mai.charts
+            if mai and mai.charts:
+                charts = [mai.charts[d] for d in sorted(mai.charts)]
                 s = diff_info.group(0) if diff_info else ''
                 diff = utils.parse_status(s, DIFFS_MAP)
                 if diff:
@@ -852,28 +884,44 @@ async def ra_calc_handled(matcher: Matcher, groups: tuple = RegexGroup()):
 
 # --- sytb ---
 
-async def get_sy_and_upload(user_id: int) -> MaiChartAchDiffReport:
-    # 获取水鱼数据
-    data = await network.sy_dev_player_records(qq=user_id, developer_token=DEVELOPER_TOKEN)
-    records = data.pop('records', []) if data else []
+# 同一 QQ 的水鱼同步：并发调用共享同一次下载与上传，完成后的新鲜期内不再重复同步
+SY_SYNC_FRESH_SECONDS = 60
+_sy_sync_flight: SingleFlight[int, MaiChartAchDiffReport] = SingleFlight(ttl=SY_SYNC_FRESH_SECONDS)
+
+async def _sy_sync(user_id: int) -> Optional[MaiChartAchDiffReport]:
+    """下载水鱼成绩并上传，在独立会话中提交后返回报告；下载失败返回 None"""
+    async with services.session_scope():
+        # 获取水鱼数据
+        data = await network.sy_dev_player_records(qq=user_id, developer_token=DEVELOPER_TOKEN)
+        if data is None:
+            return None
+        records = data.pop('records', [])
 
-    # records 稳定哈希一致时，直接短路跳过上传流程
-    sy_hash = await _build_sy_records_hash(records)
-    last_sy_hash = await services.get_last_sy_hash(user_id)
-    if last_sy_hash == sy_hash:
-        return MaiChartAchDiffReport()
+        # records 稳定哈希一致时，直接短路跳过上传流程
+        sy_hash = await _build_sy_records_hash(records)
+        last_sy_hash = await services.get_last_sy_hash(user_id)
+        if last_sy_hash == sy_hash:
+            return MaiChartAchDiffReport()
 
-    achs = utils.get_sy_records(records) if data else None
-    # 批量上传到数据库
-    if data is None or achs is None:
-        return MaiChartAchDiffReport()
+        # 批量上传到数据库
+        achs = utils.get_sy_records(records)
+        report: MaiChartAchDiffReport = await services.upload_achievements_batch(user_id, achs)
 
-    report: MaiChartAchDiffReport = await services.upload_achievements_batch(user_id, achs)
+        await services.set_last_sy_hash(user_id, sy_hash)
+        return report
 
-    await services.set_last_sy_hash(user_id, sy_hash)
-    return report
+async def get_sy_and_upload(user_id: int) -> MaiChartAchDiffReport:
+    """同步水鱼数据（single-flight：同一 QQ 并发调用共享结果，新鲜期内直接返回最近一次同步的报告）"""
+    if (report := _sy_sync_flight.get_fresh(user_id)) is not None:
+        return report
+    # 同步任务使用独立会话写入同一用户行；先提交调用方作用域中未提交的写入（如新建用户、设置用户名），
+    # 否则调用方持有的行锁会使同步任务阻塞（SQLite: database is locked；PostgreSQL: 互相等待）
+    await services.commit_scope()
+    report = await _sy_sync_flight.run(user_id, lambda: _sy_sync(user_id))
+    return report or MaiChartAchDiffReport()
 
 @sytb.handle()
+@db_scope
 async def sytb_handled(event: Event, matcher: Matcher):
     """处理命令: sytb (水鱼同步)"""
     try:
@@ -904,6 +952,7 @@ async def sytb_handled(event: Event, matcher: Matcher):
 # --- b50 ---
 
 @b50.handle()
+@db_scope
 async def b50_handled(event: Event, matcher: Matcher, groups: tuple = RegexGroup()):
     """处理命令: xxxb50/xxxkkb xxx"""
     # 低内存模式，短路拦截
@@ -965,96 +1014,87 @@ async def b50_handled(event: Event, matcher: Matcher, groups: tuple = RegexGroup
         logger.warning(f"未能解析出目标 QQ，无法继续执行 b50 命令。平台：{type(event)}")
         await matcher.finish(reply("b50_no_target"))
         return
+    # 获取 QQ 头像（与后续数据库查询、水鱼同步并发进行）
+    avatar_task = asyncio.create_task(avatar_cache.get(target_qq, image_gen.get_user_avatar_size()))
     try:
-        target_maiuser = (await services.get_or_create_user_by_id(target_qq)).to_data()
-    except ValueError as e:
-        await matcher.finish(str(e))
-        return
-
-    # 获取 QQ 头像
-    avatar_url = f"http://q2.qlogo.cn/headimg_dl?dst_uin={target_qq}&spec=100"
-    avatar = await network.request_image(avatar_url)
-
-    payload: list[tuple[str, Any]] = [("at", (sender_username, sender_user_id)), ("text", reply("b50_drawing"))]
-    # extra. 查询内容含国服，强制刷新水鱼数据
-    if server in ['CN', 'ALL']:
         try:
-            report = await get_sy_and_upload(target_qq)
-            if report.has_changes:
-                # 有变化，考虑查询者是否在查询自己，展示不同的报告细节
-                if is_querying_self:
-                    summary_text, diff_img = build_diff_report(report)
-                    sync_payload: list[tuple[str, Any]] = [
-                        ("text", f"已同步水鱼数据！以下是水鱼数据的同步详情：\n\n{summary_text}")
-                    ]
-                    if diff_img:
-                        sync_payload.append(("image", image_gen.get_image_bytes(diff_img)))
-                    await build_msg(matcher, event, sync_payload, tag='send')
-                    await build_msg(matcher, event, payload, tag='send')
+            target_maiuser = await services.get_user_data(target_qq)
+        except ValueError as e:
+            await matcher.finish(str(e))
+            return
+
+        payload: list[tuple[str, Any]] = [("at", (sender_username, sender_user_id)), ("text", reply("b50_drawing"))]
+        # extra. 查询内容含国服，强制刷新水鱼数据
+        if server in ['CN', 'ALL']:
+            try:
+                report = await get_sy_and_upload(target_qq)
+                if report.has_changes:
+                    # 有变化，考虑查询者是否在查询自己，展示不同的报告细节
+                    if is_querying_self:
+                        summary_text, diff_img = build_diff_report(report)
+                        sync_payload: list[tuple[str, Any]] = [
+                            ("text", f"已同步水鱼数据！以下是水鱼数据的同步详情：\n\n{summary_text}")
+                        ]
+                        if diff_img:
+                            sync_payload.append(("image", image_gen.get_image_bytes(diff_img)))
+                        await build_msg(matcher, event, sync_payload, tag='send')
+                        await build_msg(matcher, event, payload, tag='send')
+                    else:
+                        # 查询他人：简化提示
+                        payload[1] = ("text", reply("b50_other_updated_drawing"))
+                        await build_msg(matcher, event, payload, tag='send')
                 else:
-                    # 查询他人：简化提示
-                    payload[1] = ("text", reply("b50_other_updated_drawing"))
                     await build_msg(matcher, event, payload, tag='send')
-            else:
-                await build_msg(matcher, event, payload, tag='send')
-        except Exception as e:
-            logger.warning(f"强制刷新水鱼数据失败: {e}")
+            except Exception as e:
+                logger.warning(f"强制刷新水鱼数据失败: {e}")
         
-        # 由于进行了更新，刷新 MaiUser 数据
-        target_maiuser = (await services.get_or_create_user_by_id(target_qq)).to_data()
-    else:
-        await build_msg(matcher, event, payload, tag='send')
+            # 由于进行了更新，刷新 MaiUser 数据
+            target_maiuser = await services.get_user_data(target_qq)
+        else:
+            await build_msg(matcher, event, payload, tag='send')
 
 
-    # 确定版本并获取 achs 数据
-    ver_jp, ver_cn = utils.get_current_versions()
-    current_version = ver_cn if server == 'CN' else ver_jp  # 目前不兼容 ALL 混合模式
-    cut_version = services.get_cut_version(current_version)
+        # 确定版本并获取 achs 数据
+        ver_jp, ver_cn = utils.get_current_versions()
+        current_version = ver_cn if server == 'CN' else ver_jp  # 目前不兼容 ALL 混合模式
+        cut_version = services.get_cut_version(current_version)
     
-    b35_achs: list[models.MaiChartAch]
-    b15_achs: list[models.MaiChartAch]
-    b35_achs, b15_achs = await services.get_mdts_for_b50(target_qq, server, cut_version)
-    dxrating = sum([mca.dxrating for mca in (b35_achs + b15_achs)])
-
-    # 清洗谱面数据，构建绘图数据结构
-    def _build_entries(achs: list[models.MaiChartAch]) -> list[tuple[utils.MaiData, int]]:
-        entries = []
-        for ach in achs:
-            chart = ach.chart
-            if not chart or not chart.maidata:
-                continue
-            maidata = chart.maidata.to_data()
-            maidata.set_chart_ach(chart.difficulty, ach.to_data())
-            entries.append((maidata, chart.difficulty))
-        return entries
-
-    b35_entries = _build_entries(list(b35_achs))
-    b15_entries = _build_entries(list(b15_achs))
-
-    if server == 'JP' and not (b35_entries or b15_entries):
-        await build_msg(matcher, event, [("text", reply("b50_no_jp_data"))], tag='send')
-
-    # 绘制 b50
-    img = image_gen.draw_b50(
-        b35_entries, b15_entries,
-        current_version=current_version,
-        server=server,
-        user_name=target_maiuser.username,
-        user_avatar=avatar,
-        dxrating=dxrating,
-        update_time=target_maiuser.get_formated_time(server),
-        cn_level=1 if server == 'CN' else 0
-    )
-    img_bytes = image_gen.get_image_bytes(img)
+        b35_rows, b15_rows = await services.get_b50_rows(target_qq, server, cut_version)
+        dxrating = sum(row.dxrating for row in (b35_rows + b15_rows))
+
+        # 仅使用列查询结果构建绘图数据结构
+        b35_entries = [services.b50_row_to_entry(row, server) for row in b35_rows]
+        b15_entries = [services.b50_row_to_entry(row, server) for row in b15_rows]
+
+        if server == 'JP' and not (b35_entries or b15_entries):
+            await build_msg(matcher, event, [("text", reply("b50_no_jp_data"))], tag='send')
+
+        # 绘制 b50
+        avatar = await avatar_task
+        img_bytes = await render.render(render.B50RenderSpec(
+            b35_entries, b15_entries,
+            current_version=current_version,
+            server=server,
+            user_name=target_maiuser.username,
+            user_avatar=avatar,
+            dxrating=dxrating,
+            update_time=target_maiuser.get_formated_time(server),
+            cn_level=1 if server == 'CN' else 0
+        ))
     
-    final_payload = [
-        ("at", (sender_username, sender_user_id)),
-        ("image", img_bytes)
-    ]
-    await build_msg(matcher, event, final_payload, tag='finish')
+        final_payload = [
+            ("at", (sender_username, sender_user_id)),
+            ("image", img_bytes)
+        ]
+        await build_msg(matcher, event, final_payload, tag='finish')
+    finally:
+        # 提前结束（finish）或出错时，不遗留头像获取任务
+        if not avatar_task.done():
+            avatar_task.cancel()
 
 
 @file_receiver.handle()
+@db_scope
 async def file_receiver_handled(bot: Bot, event: Event, matcher: Matcher):
     
     file_name: str = ""
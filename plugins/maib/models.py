@@ -2,7 +2,7 @@ import time
 from pathlib import Path
 from typing import Literal, Optional
 
-from sqlalchemy import ForeignKey, UniqueConstraint, BigInteger
+from sqlalchemy import ForeignKey, UniqueConstraint, BigInteger, Index, inspect
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from . import utils
@@ -83,10 +83,15 @@ class MaiChartAch(Model):
             dxscore=self.dxscore,
             combo=self.combo,
             sync=self.sync,
-            update_time=self.update_time
+            update_time=self.update_time,
+            user_id=self.user_id if self.user_id is not None else -1
         )
 
 
+# B50 查询索引：按 (user_id, server) 过滤后直接按 dxrating 降序读取
+Index("ix_maib_maichartachs_user_id_server_dxrating", MaiChartAch.user_id, MaiChartAch.server, MaiChartAch.dxrating.desc())
+
+
 class MaiChart(Model):
     """MaiChart 谱面数据"""
     __tablename__ = "maib_maicharts"
@@ -99,7 +104,9 @@ class MaiChart(Model):
     lv_cn: Mapped[Optional[float]] = mapped_column(index=True)
     lv_synh: Mapped[Optional[float]] = mapped_column(index=True)  # 水鱼拟合定数
     des: Mapped[str]
-    inote: Mapped[str]
+    # 完整 simai 谱面文本：延迟加载，仅在显式 undefer(MaiChart.inote) 时读取
+    # 未加载时访问会直接抛出异常，避免在异步会话中触发隐式 IO
+    inote: Mapped[str] = mapped_column(deferred=True, deferred_raiseload=True)
 
     # Note 统计数据
     note_count_tap: Mapped[int]
@@ -120,7 +127,7 @@ class MaiChart(Model):
             lv_cn=self.lv_cn,
             lv_synh=self.lv_synh,
             des=self.des,
-            inote=self.inote,
+            inote=self.inote if "inote" not in inspect(self).unloaded else "",
             note_count_tap=self.note_count_tap,
             note_count_hold=self.note_count_hold,
             note_count_slide=self.note_count_slide,
@@ -133,6 +140,14 @@ class MaiChart(Model):
         return maichart
 
 
+def resolve_zip_path(zip_path: Optional[str]) -> Optional[Path]:
+    """将数据库中的 `zip_path`（相对插件数据目录）还原为绝对路径"""
+    path = Path(zip_path) if zip_path else None
+    if path and not path.is_absolute():
+        path = PluginRegistry.get_data_dir() / path
+    return path
+
+
 class MaiData(Model):
     """MaiData 曲目数据"""
     __tablename__ = "maib_maidatas"
@@ -152,6 +167,7 @@ class MaiData(Model):
     converter: Mapped[Optional[str]]
     zip_path: Mapped[str]
     tg_file_id_cache: Mapped[Optional[str]] = mapped_column(default=None, nullable=True)  # Telegram 文件 ID 缓存
+    sync_hash: Mapped[Optional[str]] = mapped_column(default=None, nullable=True)  # 曲目内容指纹，用于 fetch 时跳过未变更曲目
 
     # Utage 特有字段 (常规曲目设为 None)
     is_utage: Mapped[bool] = mapped_column(default=False, index=True)  
@@ -168,9 +184,7 @@ class MaiData(Model):
 
     def to_data(self, include_achs: bool = False) -> utils.MaiData:
         """转换为 utils.MaiData 对象"""
-        zip_path = Path(self.zip_path) if self.zip_path else None
-        if zip_path and not zip_path.is_absolute():
-            zip_path = PluginRegistry.get_data_dir() / zip_path
+        zip_path = resolve_zip_path(self.zip_path)
 
         maidata = utils.MaiData(
             shortid=self.shortid,
@@ -257,6 +271,25 @@ class MaiUser(Model):
         )
 
 
+class MaiUserBest(Model):
+    """MaiUserBest 用户 B35/B15 成绩（物化缓存）
+
+    设计：
+    - 每个 (user_id, server) 最多保存 35 条 B35 与 15 条 B15 记录，随成绩上传增量维护
+    - cut_version: 构建时使用的 B50 分段版本，与当前分段版本不一致时整体重建
+    """
+    __tablename__ = "maib_maiuserbests"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, index=True)  # qq
+    server: Mapped[Literal["JP", "CN"]]
+    is_b15: Mapped[bool]  # 是否属于 B15（否则为 B35）
+    ach_id: Mapped[int] = mapped_column(ForeignKey("maib_maichartachs.id", ondelete="CASCADE"), unique=True)
+    dxrating: Mapped[int]  # 冗余 MaiChartAch.dxrating，用于排序与门槛比较
+    achievement: Mapped[float]  # 冗余 MaiChartAch.achievement，同分时排序使用
+    cut_version: Mapped[int]
+
+
 class MaiIdCheck(Model):
     """ID 映射检查表 - 用于临时记录 shortid 的重映射 (original_id -> mapped_id)
 
@@ -1,10 +1,20 @@
 import asyncio
+import mmap
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
 import httpx
 import orjson
 from pathlib import Path
 from typing import Optional, Any
 from loguru import logger
 
+from . import services
+from .bot_registry import PluginRegistry
+from .throttle import TokenBucket, CircuitBreaker
+
 try:
     from nonebot import get_driver
     driver = get_driver()
@@ -38,53 +48,204 @@ ENDPOINTS = {
 # --- 2. 全局客户端单例 ---
 _client: Optional[httpx.AsyncClient] = None
 
+HTTP_TIMEOUT = httpx.Timeout(20.0, connect=5.0)  # 连接阶段快速失败
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+PER_HOST_MAX_CONNECTIONS = 6  # 单个上游主机的最大并发请求数
+_host_semaphores: dict[str, asyncio.Semaphore] = {}
+
 def get_http_client() -> httpx.AsyncClient:
     global _client
     if _client is None or _client.is_closed:
         _client = httpx.AsyncClient(
-            timeout=20.0, 
+            timeout=HTTP_TIMEOUT,
+            limits=HTTP_LIMITS,
             follow_redirects=True
         )
     return _client
 
-# --- 3. 核心请求引擎 ---
+def _get_host_semaphore(url: str) -> asyncio.Semaphore:
+    host = httpx.URL(url).host
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(PER_HOST_MAX_CONNECTIONS)
+        _host_semaphores[host] = semaphore
+    return semaphore
+
+# --- 3. 开发者接口限流 ---
+# 每个 Developer-Token 一个令牌桶，避免单个活跃群聊耗尽水鱼开发者接口配额
+DEVELOPER_TOKEN_BUCKET_CAPACITY = 10  # 突发容量
+DEVELOPER_TOKEN_BUCKET_RATE = 0.5  # 每秒补充令牌数
+DEVELOPER_TOKEN_MAX_WAIT = 10.0  # 令牌不足时的最长排队时间（秒），超过则直接放弃请求
+_token_buckets: dict[str, TokenBucket] = {}
+
+def _get_token_bucket(developer_token: str) -> TokenBucket:
+    bucket = _token_buckets.get(developer_token)
+    if bucket is None:
+        bucket = TokenBucket(DEVELOPER_TOKEN_BUCKET_CAPACITY, DEVELOPER_TOKEN_BUCKET_RATE)
+        _token_buckets[developer_token] = bucket
+    return bucket
+
+# --- 4. 上游熔断与重试策略 ---
+# 按 ENDPOINTS 分组熔断：同一上游连续失败达到阈值后，冷却期内直接返回 None（调用方回退到缓存数据）
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}  # 视为上游故障、可重试的状态码
+BACKOFF_MAX_DELAY = 10.0  # 指数退避的单次最长等待（秒）
+RETRY_AFTER_MAX = 30.0  # 服务端要求的 Retry-After 超过该值时不再重试
+_breakers: dict[str, CircuitBreaker] = {}
+_stats: dict[str, dict[str, int]] = {}
+
+def _endpoint_group(url: str) -> str:
+    """按 ENDPOINTS 中最长匹配的前缀确定上游分组，未匹配时使用主机名"""
+    matched = max(
+        (name for name, base in ENDPOINTS.items() if url.startswith(base)),
+        key=lambda name: len(ENDPOINTS[name]),
+        default=None,
+    )
+    return matched or httpx.URL(url).host
+
+def _get_breaker(group: str) -> CircuitBreaker:
+    breaker = _breakers.get(group)
+    if breaker is None:
+        breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+        _breakers[group] = breaker
+    return breaker
+
+def _get_stats(group: str) -> dict[str, int]:
+    stats = _stats.get(group)
+    if stats is None:
+        stats = {"requests": 0, "failures": 0, "retries": 0, "circuit_opens": 0, "short_circuits": 0}
+        _stats[group] = stats
+    return stats
+
+def get_network_stats() -> dict[str, dict[str, int | str]]:
+    """各上游分组的请求计数（请求、失败、重试、熔断次数、熔断拒绝数）与当前熔断状态"""
+    return {
+        group: {**stats, "state": _get_breaker(group).state}
+        for group, stats in _stats.items()
+    }
+
+def _parse_retry_after(response: httpx.Response) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），无效时返回 None"""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def _backoff_delay(base_delay: float, attempt: int) -> float:
+    """指数退避 + 抖动：在 [d/2, d] 内随机，d = min(base * 2^attempt, BACKOFF_MAX_DELAY)"""
+    delay = min(base_delay * 2 ** attempt, BACKOFF_MAX_DELAY)
+    return random.uniform(delay / 2, delay)
+
+# --- 5. 核心请求引擎 ---
+STREAM_CHUNK_SIZE = 64 * 1024  # 流式落盘的分块大小
+
+async def _stream_to_file(client: httpx.AsyncClient, method: str, url: str, dest: Path, **kwargs) -> httpx.Response:
+    """流式请求：200 响应体分块写入 `dest`（不在内存中保留完整响应体），其余状态码照常读取响应体"""
+    async with client.stream(method=method, url=url, **kwargs) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return response
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with dest.open("wb") as f:
+                async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                    f.write(chunk)
+        except BaseException:
+            dest.unlink(missing_ok=True)
+            raise
+    return response
+
+def load_json_file(path: Path) -> Any:
+    """以内存映射方式解析 JSON 文件，响应体不经过 Python 堆上的 bytes/str 副本"""
+    with path.open("rb") as f:
+        if f.seek(0, 2) == 0:
+            raise ValueError(f"空文件: {path}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return orjson.loads(view)
+
 async def _request(url: str, method: str = "GET", developer_token: Optional[str] = None, **kwargs) -> Optional[httpx.Response]:
     """
     通用异步请求核心。
-    kwargs 可包含: json, params, headers, retries, project_name 等
+    kwargs 可包含: json, params, headers, retries, project_name, stream_to 等
+    - 指定 stream_to 时，200 响应体流式写入该路径，返回的 response 不含响应体
+    - 上游分组处于熔断状态时直接返回 None
+    - 仅对网络错误与 RETRYABLE_STATUS 重试（指数退避 + 抖动，优先遵循 Retry-After）；其余 4xx 不重试
+    - 请求前提交调用方的数据库作用域，等待网络期间不占用连接与锁
     """
+    await services.commit_scope()
     retries = kwargs.pop("retries", 1)
     project_name = kwargs.pop("project_name", "Network")
     delay = kwargs.pop("delay", 1.0)
+    stream_to: Optional[Path] = kwargs.pop("stream_to", None)
     header = kwargs.get("headers", {})
     if developer_token:
         header["Developer-Token"] = developer_token
         kwargs["headers"] = header
-    
+        if not await _get_token_bucket(developer_token).acquire(max_wait=DEVELOPER_TOKEN_MAX_WAIT):
+            logger.warning(f"[{project_name}] Developer-Token 请求过于频繁，已放弃请求: {url}")
+            return None
+
+    group = _endpoint_group(url)
+    breaker = _get_breaker(group)
+    stats = _get_stats(group)
+    if not breaker.allow():
+        stats["short_circuits"] += 1
+        logger.warning(f"[{project_name}] 上游 {group} 处于熔断状态，跳过请求: {url}")
+        return None
+
     client = get_http_client()
     response = None
     for i in range(retries):
+        retry_after = None
+        stats["requests"] += 1
         try:
-            response = await client.request(method=method, url=url, **kwargs)
+            async with _get_host_semaphore(url):
+                if stream_to is None:
+                    response = await client.request(method=method, url=url, **kwargs)
+                else:
+                    response = await _stream_to_file(client, method, url, stream_to, **kwargs)
             if response.status_code == 304:
+                breaker.record_success()
                 return response
+            if response.status_code in RETRYABLE_STATUS:
+                retry_after = _parse_retry_after(response)
             response.raise_for_status()
+            breaker.record_success()
+            return response
         except Exception as e:
-            if i < retries - 1:
-                logger.warning(f"[{project_name}] 尝试 {i+1} 失败: {e}")
-                await asyncio.sleep(delay)
-            else:
-                logger.error(f"[{project_name}] 最终请求失败: {url} | Error: {e}")
+            stats["failures"] += 1
+            upstream_failure = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code in RETRYABLE_STATUS
+            if not upstream_failure:
+                # 客户端错误（如 400/404）说明上游可用，不计入熔断也不重试
+                breaker.record_success()
+            elif breaker.record_failure():
+                stats["circuit_opens"] += 1
+                logger.warning(f"[{project_name}] 上游 {group} 连续失败，熔断 {CIRCUIT_RESET_TIMEOUT:.0f} 秒")
+
+            wait = retry_after if retry_after is not None else _backoff_delay(delay, i)
+            if upstream_failure and i < retries - 1 and breaker.state != "open" and wait <= RETRY_AFTER_MAX:
+                stats["retries"] += 1
+                logger.warning(f"[{project_name}] 尝试 {i+1} 失败: {e}，{wait:.1f} 秒后重试")
+                await asyncio.sleep(wait)
+                continue
+            logger.error(f"[{project_name}] 最终请求失败: {url} | Error: {e}")
+            break
     return response
 
 async def request_json(url: str, method: str = "GET", **kwargs) -> Optional[Any]:
-    """请求并解析 JSON，失败时返回 None"""
+    """请求并解析 JSON（orjson 直接解析响应 bytes，不经 str 解码副本），失败时返回 None"""
     if not url:
         return
     response = await _request(url, method=method, **kwargs)
     if response:
         try:
-            return response.json()
+            return orjson.loads(response.content)
         except Exception as e:
             logger.error(f"JSON 解析失败: {url} | Error: {e}")
     return None
@@ -97,87 +258,178 @@ async def request_image(url: str, method: str = "GET", **kwargs) -> Optional[byt
     return None
 
 
-# --- 4. 具体接口实现 ---
+# --- 6. 条件请求缓存 ---
+# 响应体与 ETag / Last-Modified 存放于插件缓存目录，下次请求携带 If-None-Match / If-Modified-Since 重新验证
+HTTP_CACHE_DIR_NAME = "http"
 
-async def sy_music_data(etag: str | None = None) -> tuple[str | None, list | None]:
-    """获取公开乐曲数据"""
-    headers = {"If-None-Match": etag} if etag else {}
-    response = await _request(ENDPOINTS["diving_fish"] + "/music_data", project_name="diving-fish*/music_data", headers=headers)
-    if response is None:
-        return None, None
-    if response.status_code == 304:
-        return etag, None
-    if response.status_code == 200:
-        try:
-            data = response.json()
-            new_etag = response.headers.get("etag", "")  # 强制保留引号
-            return new_etag, data
-        except Exception as e:
-            logger.error(f"解析水鱼数据失败: {e}")
-    return None, None
+def _http_cache_paths(cache_name: str, cache_dir: Optional[Path] = None, suffix: str = ".json") -> tuple[Path, Path]:
+    """返回 (响应体文件, 元数据文件) 路径"""
+    base_dir = cache_dir or PluginRegistry.get_cache_dir() / HTTP_CACHE_DIR_NAME
+    return base_dir / f"{cache_name}{suffix}", base_dir / f"{cache_name}.meta.json"
+
+def _read_cache_meta(data_path: Path, meta_path: Path, cache_name: str) -> dict[str, Any]:
+    """读取缓存元数据（响应体缺失或元数据损坏时返回空字典）"""
+    if not (data_path.exists() and meta_path.exists()):
+        return {}
+    try:
+        return orjson.loads(meta_path.read_bytes())
+    except Exception as e:
+        logger.warning(f"[{cache_name}] 缓存元数据损坏，将重新下载: {e}")
+        return {}
 
-async def sy_music_data_from_file(dir_path: Path, max_retries: int = 3) -> tuple[list | None, bool]:
+def _conditional_headers(meta: dict[str, Any], headers: Optional[dict] = None) -> dict:
+    """根据缓存元数据构造条件请求头"""
+    headers = dict(headers or {})
+    if etag := meta.get("etag"):
+        headers["If-None-Match"] = etag
+    if last_modified := meta.get("last_modified"):
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+def _write_cache_meta(meta_path: Path, url: str, response: httpx.Response):
+    meta_path.write_bytes(orjson.dumps({
+        "url": url,
+        "etag": response.headers.get("etag"),  # 强制保留引号
+        "last_modified": response.headers.get("last-modified"),
+        "timestamp": time.time(),
+    }))
+
+async def request_json_cached(url: str, cache_name: str, cache_dir: Optional[Path] = None,
+                              stream: bool = False, fallback_to_cache: bool = True,
+                              **kwargs) -> tuple[Optional[Any], bool]:
     """
-    获取公开乐曲数据
+    带磁盘缓存的条件请求
     返回：数据; 是否为刚刚获取的远程新数据
+    - 200：解析并写入缓存，返回 (新数据, True)
+    - 304 / 请求失败：返回 (磁盘缓存数据, False)，调用方可据此跳过后续处理
+    - fallback_to_cache=False：请求失败时不回退到磁盘缓存，返回 (None, False)，供调用方切换备用源
+    - stream=True：响应体流式写入临时文件后以内存映射解析，适用于数 MB 的大响应
     """
-    data_path = dir_path / "music_data.json"
-    etag_path = dir_path / "music_data.etag"
-    
-    attempts = 0
-    while attempts <= max_retries:
-        attempts += 1
-        
-        # 1. 获取本地 ETag
-        current_etag = None
-        if etag_path.exists() and data_path.exists():
-            current_etag = etag_path.read_text(encoding="utf-8").strip()
-
-        # 2. 请求网络数据
-        new_etag, remote_data = await sy_music_data(etag=current_etag)
-
-        # 3. 处理新数据（远程更新）
-        if remote_data:
+    data_path, meta_path = _http_cache_paths(cache_name, cache_dir)
+    meta = _read_cache_meta(data_path, meta_path, cache_name)
+    headers = _conditional_headers(meta, kwargs.pop("headers", None))
+
+    part_path = data_path.with_name(data_path.name + ".part")
+    if stream:
+        kwargs["stream_to"] = part_path
+    response = await _request(url, headers=headers, **kwargs)
+    if response is not None and response.status_code == 200:
+        try:
+            data = load_json_file(part_path) if stream else orjson.loads(response.content)
+        except Exception as e:
+            logger.error(f"JSON 解析失败: {url} | Error: {e}")
+            part_path.unlink(missing_ok=True)
+        else:
             try:
-                dir_path.mkdir(parents=True, exist_ok=True)
-                data_path.write_bytes(orjson.dumps(remote_data))
-                if new_etag:
-                    etag_path.write_text(new_etag, encoding="utf-8")
+                if stream:
+                    part_path.replace(data_path)
+                else:
+                    data_path.parent.mkdir(parents=True, exist_ok=True)
+                    data_path.write_bytes(response.content)
+                _write_cache_meta(meta_path, url, response)
             except Exception as e:
-                logger.error(f"保存数据失败: {e}")
+                logger.error(f"[{cache_name}] 保存缓存失败: {e}")
             # 无论保存成功与否，该数据都可用
-            return remote_data, True  # 数据比本地的新
-
-        # 4. 处理缓存数据（ETag 命中）
-        if new_etag and not remote_data:
-            if data_path.exists():
-                try:
-                    return orjson.loads(data_path.read_bytes()), False
-                except Exception as e:
-                    logger.warning(f"本地缓存损坏，清除 ETag 并重试: {e}")
-                    etag_path.unlink(missing_ok=True)
-                    continue # 触发下一次循环，重新下载
-            else:
-                # 理论上不应到达这里（有 ETag 没数据），清除 ETag 重试
-                etag_path.unlink(missing_ok=True)
-                continue
+            return data, True
 
-        # 5. 异常降级：如果 ETag 为 None 或其他未知情况
-        # 尝试读取本地现有数据作为最后的保障
-        if data_path.exists():
-            try:
-                return orjson.loads(data_path.read_bytes()), False
-            except:
-                pass
-        
-        break # 无效状态，跳出循环
+    # 304 命中或请求失败：回退到磁盘缓存
+    if not fallback_to_cache and (response is None or response.status_code != 304):
+        return None, False
+    if data_path.exists():
+        try:
+            return load_json_file(data_path), False
+        except Exception as e:
+            logger.warning(f"[{cache_name}] 本地缓存损坏，已清除: {e}")
+            data_path.unlink(missing_ok=True)
+            meta_path.unlink(missing_ok=True)
+            if response is not None and response.status_code == 304:
+                # 缓存已清除，不再携带条件请求头，重新完整下载一次
+                kwargs.pop("stream_to", None)
+                return await request_json_cached(url, cache_name, cache_dir, stream, fallback_to_cache, **kwargs)
     return None, False
 
+def read_json_cache(cache_name: str, cache_dir: Optional[Path] = None) -> Optional[Any]:
+    """读取条件请求的磁盘缓存数据（不发起请求），不存在或损坏时返回 None"""
+    data_path, _ = _http_cache_paths(cache_name, cache_dir)
+    if not data_path.exists():
+        return None
+    try:
+        return load_json_file(data_path)
+    except Exception as e:
+        logger.warning(f"[{cache_name}] 读取本地缓存失败: {e}")
+        return None
 
-async def sy_chart_stats():
-    """获取公开乐曲统计数据"""
-    return await request_json(
+async def request_bytes_cached(url: str, cache_name: str, cache_dir: Optional[Path] = None,
+                               max_age: float = 0.0, **kwargs) -> tuple[Optional[bytes], bool]:
+    """
+    带磁盘缓存的二进制条件请求（图片等）
+    返回：数据; 是否为刚刚获取的远程新数据
+    - 缓存写入后 `max_age` 秒内直接返回磁盘缓存，不发起请求
+    - 304 时刷新缓存时间戳；请求失败时返回（可能已过期的）磁盘缓存
+    - 磁盘读写均在线程中执行，不阻塞事件循环
+    """
+    data_path, meta_path = _http_cache_paths(cache_name, cache_dir, suffix=".bin")
+    meta = await asyncio.to_thread(_read_cache_meta, data_path, meta_path, cache_name)
+    if meta and time.time() - meta.get("timestamp", 0) < max_age:
+        if (data := await asyncio.to_thread(read_bytes_cache, cache_name, cache_dir)) is not None:
+            return data, False
+
+    response = await _request(url, headers=_conditional_headers(meta, kwargs.pop("headers", None)), **kwargs)
+    if response is not None and response.status_code == 200 and response.content:
+        try:
+            await asyncio.to_thread(_write_bytes_cache, data_path, meta_path, url, response)
+        except Exception as e:
+            logger.error(f"[{cache_name}] 保存缓存失败: {e}")
+        return response.content, True
+
+    data = await asyncio.to_thread(read_bytes_cache, cache_name, cache_dir)
+    if data is None:
+        return None, False
+    if response is not None and response.status_code == 304 and meta:
+        # 重新验证通过，重置新鲜期
+        meta["timestamp"] = time.time()
+        await asyncio.to_thread(meta_path.write_bytes, orjson.dumps(meta))
+    return data, False
+
+def _write_bytes_cache(data_path: Path, meta_path: Path, url: str, response: httpx.Response):
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+    data_path.write_bytes(response.content)
+    _write_cache_meta(meta_path, url, response)
+
+def read_bytes_cache(cache_name: str, cache_dir: Optional[Path] = None) -> Optional[bytes]:
+    """读取二进制条件请求的磁盘缓存数据（不发起请求，同步读取），不存在时返回 None"""
+    data_path, _ = _http_cache_paths(cache_name, cache_dir, suffix=".bin")
+    try:
+        return data_path.read_bytes()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning(f"[{cache_name}] 读取本地缓存失败: {e}")
+        return None
+
+
+# --- 7. 具体接口实现 ---
+
+async def sy_music_data_from_file(dir_path: Path) -> tuple[list | None, bool]:
+    """
+    获取公开乐曲数据（缓存于 `dir_path`）
+    返回：数据; 是否为刚刚获取的远程新数据
+    """
+    return await request_json_cached(
+        ENDPOINTS["diving_fish"] + "/music_data",
+        cache_name="music_data",
+        cache_dir=dir_path,
+        stream=True,
+        project_name="diving-fish*/music_data"
+    )
+
+
+async def sy_chart_stats() -> tuple[dict | None, bool]:
+    """获取公开乐曲统计数据（条件请求缓存），返回：数据; 是否为远程新数据"""
+    return await request_json_cached(
         ENDPOINTS["diving_fish"] + "/chart_stats",
+        cache_name="sy_chart_stats",
+        stream=True,
         project_name="diving-fish*/chart_stats"
     )
 
@@ -216,26 +468,34 @@ async def sy_dev_player_record(shortid: int | str | list[int | str], qq: int | s
 
 # 水鱼之外的：
 
-async def maichart_index() -> dict[str, str] | None:
-    """获取谱面索引 (带 Fallback 机制)"""
+async def maichart_index() -> tuple[dict[str, str], bool]:
+    """获取谱面索引 (带 Fallback 机制，条件请求缓存)，返回：数据; 是否为远程新数据"""
     MAICHART_INDEX_URL = "/Neskol/Maichart-Converts/refs/heads/master/index.json"
-    # 尝试直连
-    res = await request_json(ENDPOINTS["maichart_raw"] + MAICHART_INDEX_URL, project_name="maichart*/index.json")
-    if not res:
-        # 尝试代理
-        res = await request_json(ENDPOINTS["maichart_proxy"] + MAICHART_INDEX_URL, project_name="maichart_proxy*/index.json")
-    return res or {}
-
-async def lx_alias_list() -> dict | None:
-    """获取落雪别名库"""
-    return await request_json(
+    # 尝试直连（304 视为成功，直接使用缓存）
+    res, is_new = await request_json_cached(ENDPOINTS["maichart_raw"] + MAICHART_INDEX_URL, cache_name="maichart_index",
+                                            fallback_to_cache=False, project_name="maichart*/index.json")
+    if res is None:
+        # 直连失败时尝试代理（代理使用独立的缓存与验证信息，不同主机的 ETag 不通用）
+        res, is_new = await request_json_cached(ENDPOINTS["maichart_proxy"] + MAICHART_INDEX_URL,
+                                                cache_name="maichart_index_proxy", fallback_to_cache=False,
+                                                project_name="maichart_proxy*/index.json")
+    if res is None:
+        # 均失败：回退到任一磁盘缓存
+        res = read_json_cache("maichart_index") or read_json_cache("maichart_index_proxy")
+    return res or {}, is_new
+
+async def lx_alias_list() -> tuple[dict | None, bool]:
+    """获取落雪别名库（条件请求缓存），返回：数据; 是否为远程新数据"""
+    return await request_json_cached(
         ENDPOINTS["lxns"] + "/alias/list", 
+        cache_name="lx_alias_list",
         project_name="lxns*/alias/list"
     )
 
-async def yuzuchan_alias_list() -> dict | None:
-    """获取 YuzuChaN 别名库"""
-    return await request_json(
+async def yuzuchan_alias_list() -> tuple[dict | None, bool]:
+    """获取 YuzuChaN 别名库（条件请求缓存），返回：数据; 是否为远程新数据"""
+    return await request_json_cached(
         ENDPOINTS["yuzuchan"] + "/maimaidxalias",
+        cache_name="yuzuchan_alias_list",
         project_name="yuzuchan*/maimaidxalias"
     )
@@ -0,0 +1,215 @@
+"""
+maib 渲染执行器
+
+将 `image_gen` 的绘图入口放到工作进程中执行，避免大型 PIL 合成（如 B50）阻塞事件循环。
+
+- 渲染参数以可 pickle 的渲染规格 (`*RenderSpec`) 传递，工作进程内完成绘制与编码，仅回传图片字节
+- 工作进程数由插件配置 `RENDER_WORKERS` 决定；为 0 时退化为在线程中渲染
+- 工作进程以 spawn 方式启动，不继承主进程的事件循环、数据库连接等状态
+- B50 成品图按渲染输入的哈希缓存（`image_cache.b50_image_cache`），未变化的 B50 不再绘制
+"""
+import asyncio
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Literal, Optional, Union
+
+import orjson
+from PIL import Image
+from loguru import logger
+
+from . import image_gen, services, utils
+from .constants import SERVER_TAG
+from .image_cache import b50_image_cache
+
+try:
+    from nonebot import get_driver
+    driver = get_driver()
+
+    @driver.on_startup
+    async def _():
+        if RENDER_WORKERS > 0:
+            await warmup()
+            logger.info(f"渲染进程池已启动 (workers={RENDER_WORKERS})")
+
+    @driver.on_shutdown
+    async def _():
+        shutdown()
+except (ImportError, ValueError):
+    pass
+
+
+RENDER_WORKERS: int = 2  # 渲染工作进程数，由插件配置覆盖；0 表示在线程中渲染
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _detach(maidata: utils.MaiData) -> utils.MaiData:
+    """去除已加载的封面图片，缩小 pickle 体积（封面在工作进程内按路径重新读取）"""
+    return replace(maidata, _cached_image=None) if maidata._cached_image is not None else maidata
+
+
+# --- 渲染规格 ---
+
+@dataclass
+class B50RenderSpec:
+    """B50 成绩图"""
+    b35_entries: list[tuple[utils.MaiData, int]]
+    b15_entries: list[tuple[utils.MaiData, int]]
+    dxrating: int
+    current_version: int
+    server: SERVER_TAG
+    user_name: str
+    user_avatar: Optional[Image.Image] = None
+    update_time: str = "Unknown Update Time"
+    cn_level: Literal[0, 1, 2] = 0
+    image_format: str = "jpeg"
+
+    def __post_init__(self):
+        self.b35_entries = [(_detach(mdt), diff) for mdt, diff in self.b35_entries]
+        self.b15_entries = [(_detach(mdt), diff) for mdt, diff in self.b15_entries]
+
+    def _entry_key(self, maidata: utils.MaiData, diff: int) -> tuple:
+        chart = maidata.get_chart(diff)
+        if chart is None:
+            return (maidata.shortid, diff)
+        ach = chart.get_ach(self.server)
+        # 曲绘版本取谱面 ZIP 的 stat 标识：ZIP 原地更新时路径不变，但成品图需要重绘
+        cover_key = image_gen.COVERS.identity(maidata) or str(maidata.img_path)
+        return (
+            maidata.shortid, diff, maidata.title, cover_key, chart.lv, chart.lv_cn, chart.dxscore_max,
+            ach.achievement, ach.combo, ach.sync, ach.dxscore,
+            maidata.get_chart_dxrating(diff, self.server, self.current_version),
+        )
+
+    def cache_key(self) -> str:
+        """成品图缓存键：B50 条目、用户头部信息、绘图模型版本、缩放倍率与输出格式的哈希"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(orjson.dumps([
+            [self._entry_key(mdt, diff) for mdt, diff in self.b35_entries],
+            [self._entry_key(mdt, diff) for mdt, diff in self.b15_entries],
+            self.dxrating, self.current_version, self.server, self.user_name, self.update_time, self.cn_level,
+            image_gen.MODEL_VERSION, image_gen._MS_DEFAULT.multiple, self.image_format,
+        ]))
+        if self.user_avatar is not None:
+            digest.update(self.user_avatar.mode.encode())
+            digest.update(orjson.dumps(self.user_avatar.size))
+            digest.update(self.user_avatar.tobytes())
+        return digest.hexdigest()
+
+    def render(self) -> bytes:
+        img = image_gen.draw_b50(
+            self.b35_entries, self.b15_entries,
+            dxrating=self.dxrating,
+            current_version=self.current_version,
+            server=self.server,
+            user_name=self.user_name,
+            user_avatar=self.user_avatar,
+            update_time=self.update_time,
+            cn_level=self.cn_level,
+        )
+        return image_gen.get_image_bytes(img, format=self.image_format)
+
+
+@dataclass
+class InfoBoxRenderSpec:
+    """曲目详细信息图"""
+    maidata: utils.MaiData
+    server: SERVER_TAG
+    maiuser: Optional[utils.MaiUser] = None
+    cn_level: Literal[0, 1, 2] = 0
+
+    def __post_init__(self):
+        self.maidata = _detach(self.maidata)
+
+    def render(self) -> bytes:
+        img = image_gen.draw_info_box(self.maidata, self.server, maiuser=self.maiuser, cn_level=self.cn_level)
+        return image_gen.get_image_bytes(img)
+
+
+@dataclass
+class MaidataListRenderSpec:
+    """曲目简要列表图"""
+    maidata_list: list[utils.MaiData]
+
+    def __post_init__(self):
+        self.maidata_list = [_detach(mdt) for mdt in self.maidata_list]
+
+    def render(self) -> bytes:
+        return image_gen.get_image_bytes(image_gen.simple_maidata_box(self.maidata_list))
+
+
+RenderSpec = Union[B50RenderSpec, InfoBoxRenderSpec, MaidataListRenderSpec]
+
+
+# --- 执行器 ---
+
+def _render_spec(spec: RenderSpec) -> bytes:
+    """工作进程入口"""
+    return spec.render()
+
+
+def _init_worker(cover_root: Path) -> None:
+    """工作进程初始化：工作进程中没有 NoneBot 环境，缩略图目录由主进程传入"""
+    image_gen.COVERS.root = cover_root
+
+
+def _warmup_worker() -> None:
+    """工作进程预热：反序列化本函数时即已导入 image_gen（字体、素材管理器）"""
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(image_gen.COVERS.root,),
+        )
+    return _executor
+
+
+async def warmup():
+    """提前启动全部工作进程，避免首次渲染承担进程启动开销"""
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    await asyncio.gather(*(loop.run_in_executor(executor, _warmup_worker) for _ in range(RENDER_WORKERS)))
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _render_uncached(spec: RenderSpec) -> bytes:
+    if RENDER_WORKERS <= 0:
+        return await asyncio.to_thread(spec.render)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_executor(), _render_spec, spec)
+    except BrokenProcessPool:
+        # 工作进程异常退出（如内存不足被杀），重建进程池后重试一次
+        logger.warning("渲染进程池已损坏，正在重建")
+        shutdown()
+        return await loop.run_in_executor(_get_executor(), _render_spec, spec)
+
+
+async def render(spec: RenderSpec) -> bytes:
+    """在渲染进程池中绘制并编码图片，返回图片字节（B50 优先读取成品图缓存）"""
+    # 渲染期间不占用调用方的数据库连接与锁
+    await services.commit_scope()
+    if not isinstance(spec, B50RenderSpec):
+        return await _render_uncached(spec)
+    # 缓存键需逐曲目 stat 谱面 ZIP 并哈希头像像素，放到线程中计算
+    cache_key = await asyncio.to_thread(spec.cache_key)
+    if (cached := await b50_image_cache.get(cache_key)) is not None:
+        return cached
+    data = await _render_uncached(spec)
+    await b50_image_cache.put(cache_key, data)
+    return data
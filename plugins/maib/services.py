@@ -1,19 +1,143 @@
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from functools import wraps
+import hashlib
+from pathlib import Path
 import time
-from typing import cast, Optional, Sequence, Any, Callable, Coroutine
+from typing import cast, Optional, Sequence, Any, AsyncIterator, Callable, Coroutine, Iterable, NamedTuple
 
-from sqlalchemy import select, or_, delete, func, update, bindparam, insert, Select
+from sqlalchemy import select, or_, delete, func, update, bindparam, insert, case, literal, tuple_, Select, Row, Float, Integer, Table, MetaData, Column
+from sqlalchemy import cast as sa_cast, event
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import selectinload, noload, undefer, ORMExecuteState
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import utils
-from .models import MaiData, MaiChart, MaiChartAch, MaiAlias, MaiUser, MaiDataModel, MaiIdCheck
+from .models import MaiData, MaiChart, MaiChartAch, MaiAlias, MaiUser, MaiUserBest, MaiDataModel, MaiIdCheck, resolve_zip_path
 from .report import MaiChartAchDiff, MaiChartAchDiffReport
 from .bot_registry import PluginRegistry
+from .catalog import MaiCatalog, get_catalog, set_catalog
+from .user_cache import user_cache
 from .constants import *
 
 
+# 请求级会话作用域：处于作用域内时，`with_session` 装饰的服务函数自动复用同一会话
+# 同时记录创建作用域的任务：子任务会继承 ContextVar，但 AsyncSession 不能被并发使用
+_scoped_session: ContextVar[Optional[tuple[AsyncSession, Optional[asyncio.Task]]]] = ContextVar(
+    "maib_scoped_session", default=None
+)
+
+
+def _get_owned_scope() -> Optional[AsyncSession]:
+    """获取当前任务所属的作用域会话；从父任务继承而来的作用域视为不存在"""
+    scope = _scoped_session.get()
+    if scope is None:
+        return None
+    session, owner = scope
+    return session if owner is asyncio.current_task() else None
+
+SCOPE_QUERY_COUNT_KEY = "maib_query_count"
+USER_CACHE_DIRTY_KEY = "maib_dirty_users"
+AFTER_COMMIT_KEY = "maib_after_commit"
+
+
+def _count_scope_query(orm_execute_state: ORMExecuteState) -> None:
+    """`do_orm_execute` 事件：累计作用域会话执行的查询数（含关系加载）"""
+    info = orm_execute_state.session.info
+    info[SCOPE_QUERY_COUNT_KEY] = info.get(SCOPE_QUERY_COUNT_KEY, 0) + 1
+
+
+def get_scope_query_count(session: AsyncSession) -> int:
+    """获取作用域会话至今执行的查询数"""
+    return session.info.get(SCOPE_QUERY_COUNT_KEY, 0)
+
+
+@asynccontextmanager
+async def session_scope(*, commit_on: tuple[type[BaseException], ...] = ()) -> AsyncIterator[AsyncSession]:
+    """
+    数据库会话作用域（unit of work）
+    - 作用域内调用的 `with_session` 服务函数自动复用该会话，正常退出时提交
+    - 网络请求、渲染、发送消息等耗时操作前会经 `commit_scope` 提前提交并释放连接，不在等待期间占用行锁
+    - 已处于作用域内时直接复用外层会话，由最外层负责提交
+    - 在子任务（`asyncio.create_task` / `gather`）中不加入父任务的作用域，而是新建独立作用域
+    Args:
+        commit_on: 视为正常结束、仍然提交的异常类型（如 NoneBot 的 `MatcherException`）
+    """
+    if (session := _get_owned_scope()) is not None:
+        yield session
+        return
+
+    async with PluginRegistry.get_session() as session:
+        # 自动托管会话时关闭 commit 后过期，避免返回对象在会话结束后触发 DetachedInstanceError
+        original_expire_on_commit = session.sync_session.expire_on_commit
+        session.sync_session.expire_on_commit = False
+        event.listen(session.sync_session, "do_orm_execute", _count_scope_query)
+        token = _scoped_session.set((session, asyncio.current_task()))
+        try:
+            yield session
+            await session.commit()
+        except commit_on:
+            await session.commit()
+            raise
+        finally:
+            _scoped_session.reset(token)
+            session.sync_session.expire_on_commit = original_expire_on_commit
+            # 事务结束（提交或回滚）后再次失效，覆盖事务期间被其他请求回填的旧快照
+            if dirty_user_ids := session.info.pop(USER_CACHE_DIRTY_KEY, None):
+                user_cache.invalidate(dirty_user_ids)
+
+
+async def commit_scope(*, owner_waiting: bool = False):
+    """
+    提前提交当前作用域会话并将连接归还连接池（不在作用域内时无操作），之后作用域会话仍可继续使用
+    - 由网络请求 (`network`)、渲染 (`render`)、Bot API 调用钩子 (`matcher`) 在等待外部 I/O 前调用，
+      以及在等待使用独立连接写库的任务前调用，释放本作用域持有的写锁 / 行锁
+    Args:
+        owner_waiting: 调用方保证作用域所属任务正在等待当前任务（如 Bot API 调用钩子），此时允许在子任务中提交
+    """
+    if owner_waiting:
+        scope = _scoped_session.get()
+        session = scope[0] if scope is not None else None
+    else:
+        session = _get_owned_scope()
+    if session is not None and session.in_transaction():
+        await session.commit()
+
+
+def _run_after_commit(sync_session):
+    """`after_commit` 事件：执行本事务登记的回调"""
+    for callback in sync_session.info.pop(AFTER_COMMIT_KEY, []):
+        callback()
+
+
+def _discard_after_commit(sync_session):
+    """`after_rollback` 事件：事务回滚，丢弃登记的回调"""
+    sync_session.info.pop(AFTER_COMMIT_KEY, None)
+
+
+def _after_commit(session: AsyncSession, callback: Callable[[], None]):
+    """登记在当前事务提交成功后执行的回调（回滚时丢弃），用于仅在写入落库后才更新的内存状态"""
+    sync_session = session.sync_session
+    if not event.contains(sync_session, "after_commit", _run_after_commit):
+        event.listen(sync_session, "after_commit", _run_after_commit)
+        event.listen(sync_session, "after_rollback", _discard_after_commit)
+    sync_session.info.setdefault(AFTER_COMMIT_KEY, []).append(callback)
+
+
+def _add_catalog_aliases(aliases: list[utils.MaiAlias]):
+    """将已落库的别名同步到内存目录（写时复制，已存在的别名会被忽略）"""
+    if (catalog := get_catalog()) is not None:
+        set_catalog(catalog.with_aliases(aliases))
+
+
+def _invalidate_user_cache(user_ids: int | Iterable[int], *, session: AsyncSession):
+    """使 `MaiUser` 快照缓存失效，并登记到会话，待事务结束后再次失效"""
+    user_ids = {user_ids} if isinstance(user_ids, int) else set(user_ids)
+    user_cache.invalidate(user_ids)
+    session.info.setdefault(USER_CACHE_DIRTY_KEY, set()).update(user_ids)
+
+
 def with_session(func: Callable[..., Coroutine[Any, Any, Any]]):
     @wraps(func)
     async def wrapper(*args, **kwargs):
@@ -22,21 +146,12 @@ def with_session(func: Callable[..., Coroutine[Any, Any, Any]]):
             # 已提供，直接使用
             result = await func(*args, **kwargs)
             return result
-        
-        # 如果没提供，则调用工厂函数获取上下文管理器
-        get_session = PluginRegistry.get_session
-        async with get_session() as session:
+
+        # 如果没提供，则加入当前作用域的会话（无作用域时新建并在结束时提交）
+        async with session_scope() as session:
             kwargs['session'] = session
-            # 自动托管会话时关闭 commit 后过期，避免返回对象在会话结束后触发 DetachedInstanceError
-            original_expire_on_commit = session.sync_session.expire_on_commit
-            session.sync_session.expire_on_commit = False
-            try:
-                result = await func(*args, **kwargs)
-                await session.commit()
-                return result
-            finally:
-                session.sync_session.expire_on_commit = original_expire_on_commit
-      
+            return await func(*args, **kwargs)
+
     return wrapper
 
 
@@ -48,8 +163,14 @@ BASE_STMT = (
         )
     )
 
-# 模糊查询结果过多时的最大允许值，超过该值会抛出 ValueError 异常
+# 模糊查询结果的最大数量
+# 目录模式下按相关度截取前 N 条；数据库回退模式下超过该值会抛出 ValueError 异常
 MAX_BLUR_SEARCH_RESULTS = 30
+# 容错查询结果的最大数量
+MAX_FUZZY_SEARCH_RESULTS = 10
+# B50 分段容量
+B35_SIZE = 35
+B15_SIZE = 15
 
 # === 业务逻辑：用户信息相关 ===
 
@@ -66,18 +187,29 @@ async def _get_user_by_id(user_id: int, *, session: AsyncSession) -> Optional[Ma
 
 async def get_or_create_user_by_id(user_id: int) -> MaiUser:
     """通过 `user_id` 获取用户数据，支持不存在自动创建"""
-    # 该方法不接受外部 session，内部自行管理生命周期
-    async with PluginRegistry.get_session() as session:
+    # 该方法不接受外部 session：处于作用域内时复用作用域会话，否则内部自行管理生命周期
+    async with session_scope() as session:
         user = await _get_user_by_id(user_id, session=session)
         if user:
             return user
 
+        # 立即提交：新用户行不随请求作用域一直处于未提交状态
         new_user = MaiUser(user_id=user_id)
         session.add(new_user)
+        _invalidate_user_cache(user_id, session=session)
         await session.commit()
-        await session.refresh(new_user)
         return new_user
 
+
+async def get_user_data(user_id: int) -> utils.MaiUser:
+    """通过 `user_id` 获取 `utils.MaiUser` 快照（读穿 LRU 缓存，不存在时自动创建）"""
+    if (user := user_cache.get(user_id)) is not None:
+        return user
+    generation = user_cache.generation
+    user = (await get_or_create_user_by_id(user_id)).to_data()
+    user_cache.put(user, generation)
+    return user
+
 @with_session
 async def get_user_by_telegram_id(telegram_id: int, *, session: AsyncSession) -> Optional[MaiUser]:
     """通过 `telegram_id` 获取 `MaiUser`（唯一）"""
@@ -101,6 +233,8 @@ async def set_username(user_id: int, new_username: str, *, session: AsyncSession
     
     if user:
         user.username = new_username
+        _invalidate_user_cache(user_id, session=session)
+        await session.commit()
 
 @with_session
 async def set_telegram_id(user_id: int, telegram_id: int, *, session: AsyncSession):
@@ -115,6 +249,8 @@ async def set_telegram_id(user_id: int, telegram_id: int, *, session: AsyncSessi
     
     if user:
         user.user_telegram_id = telegram_id
+        _invalidate_user_cache(user_id, session=session)
+        await session.commit()
 
 @with_session
 async def remove_telegram_id(user_id: int, *, session: AsyncSession):
@@ -129,6 +265,8 @@ async def remove_telegram_id(user_id: int, *, session: AsyncSession):
     
     if user:
         user.user_telegram_id = None
+        _invalidate_user_cache(user_id, session=session)
+        await session.commit()
 
 
 # tg
@@ -274,6 +412,103 @@ async def get_mdt_by_genre(genre: int, achs_userid: int | None = None, *, sessio
     return result.scalars().all()
 
 
+# --- 目录 (catalog) ---
+
+@with_session
+async def rebuild_catalog(*, session: AsyncSession) -> MaiCatalog:
+    """从数据库全量构建曲目目录，并原子替换当前快照"""
+    result = await session.execute(BASE_STMT)
+    catalog = MaiCatalog(mdt.to_data() for mdt in result.scalars().all())
+    set_catalog(catalog)
+    return catalog
+
+@with_session
+async def _overlay_user_achs(maidatas: Sequence[utils.MaiData], user_id: int | None,
+                             *, session: AsyncSession) -> None:
+    """为目录返回的曲目副本叠加指定用户的成绩（单次查询）"""
+    if user_id is None or not maidatas:
+        return
+    maidata_map = {m.shortid: m for m in maidatas}
+    statement = (
+        select(MaiChartAch)
+        .options(noload(MaiChartAch.chart))
+        .where(
+            MaiChartAch.user_id == user_id,
+            MaiChartAch.shortid.in_(list(maidata_map)),
+        )
+    )
+    result = await session.execute(statement)
+    for ach in result.scalars().all():
+        maidata_map[ach.shortid].set_chart_ach(ach.difficulty, ach.to_data())
+
+# 通过 `shortid` 获取 `utils.MaiData`（目录优先）
+async def get_maidata_by_id(shortid: int, achs_userid: int | None = None) -> Optional[utils.MaiData]:
+    """通过 `shortid` 获取 `utils.MaiData`（含成绩），目录未构建时回退到数据库"""
+    catalog = get_catalog()
+    if catalog is None:
+        mdt = await get_mdt_by_id(shortid, achs_userid)
+        return mdt.to_data(include_achs=True) if mdt else None
+
+    maidata = catalog.get(shortid)
+    if maidata is not None:
+        await _overlay_user_achs([maidata], achs_userid)
+    return maidata
+
+# 通过 `曲名/别名` 获取 `utils.MaiData`（目录优先）
+async def get_maidata_by_name(keyword: str, achs_userid: int | None = None) -> list[utils.MaiData]:
+    """通过 曲名/别名 精确获取 `utils.MaiData`（列表）"""
+    catalog = get_catalog()
+    if catalog is None:
+        return [mdt.to_data(include_achs=True) for mdt in await get_mdt_by_name(keyword, achs_userid)]
+
+    maidatas = catalog.get_many(catalog.find_by_name(keyword))
+    await _overlay_user_achs(maidatas, achs_userid)
+    return maidatas
+
+# 通过 `曲名/别名` 模糊获取 `utils.MaiData`（目录优先）
+async def get_maidata_by_name_blur(keyword: str, achs_userid: int | None = None) -> tuple[list[utils.MaiData], bool]:
+    """
+    通过 曲名/别名 模糊获取 `utils.MaiData`（列表，按相关度降序，最多 `MAX_BLUR_SEARCH_RESULTS` 条）
+    返回：曲目列表; 是否因超过上限而被截断
+    """
+    catalog = get_catalog()
+    if catalog is None:
+        # 数据库回退模式下超过上限直接抛出 ValueError，不会截断
+        return [mdt.to_data(include_achs=True) for mdt in await get_mdt_by_name_blur(keyword, achs_userid)], False
+
+    # 多取一条，用于判断是否截断
+    shortids = catalog.search(keyword, limit=MAX_BLUR_SEARCH_RESULTS + 1)
+    truncated = len(shortids) > MAX_BLUR_SEARCH_RESULTS
+    maidatas = catalog.get_many(shortids[:MAX_BLUR_SEARCH_RESULTS])
+    await _overlay_user_achs(maidatas, achs_userid)
+    return maidatas, truncated
+
+# 通过 `曲名/别名` 容错获取 `utils.MaiData`（仅目录）
+async def get_maidata_by_name_fuzzy(keyword: str, achs_userid: int | None = None) -> list[utils.MaiData]:
+    """通过 曲名/别名 容错获取 `utils.MaiData`（列表，按相似度降序），目录未构建时返回空列表"""
+    catalog = get_catalog()
+    if catalog is None:
+        return []
+
+    maidatas = catalog.get_many(catalog.search_fuzzy(keyword, limit=MAX_FUZZY_SEARCH_RESULTS))
+    await _overlay_user_achs(maidatas, achs_userid)
+    return maidatas
+
+# 通过 `曲名/别名` 智能获取 `utils.MaiData`（目录优先）
+async def get_maidata_by_name_smart(keyword: str, achs_userid: int | None = None) -> tuple[list[utils.MaiData], bool]:
+    """
+    通过 曲名/别名 智能获取 `utils.MaiData`（列表）：精确 -> 子串 -> 容错
+    返回：曲目列表; 是否因超过上限而被截断（仅子串匹配可能截断）
+    """
+    maidatas = await get_maidata_by_name(keyword, achs_userid)
+    if maidatas:
+        return maidatas, False
+    maidatas, truncated = await get_maidata_by_name_blur(keyword, achs_userid)
+    if maidatas:
+        return maidatas, truncated
+    return await get_maidata_by_name_fuzzy(keyword, achs_userid), False
+
+
 def split_mdt_by_plate_excludes(mdts: Sequence[MaiData], server_tag: SERVER_TAG) -> tuple[list[MaiData], list[MaiData]]:
     """按服务器牌子排除表拆分曲目列表。"""
     excluded_shortids = set(PLATE_EXCLUDES_DATA.get(server_tag, []))
@@ -446,10 +681,34 @@ def _is_achievement_priority_better(new_ach: utils.MaiChartAch, old_ach: utils.M
 async def get_mdts_for_b50(user_id: int, server: SERVER_TAG, cut_version: int, *, session: AsyncSession) -> tuple[Sequence[MaiChartAch], Sequence[MaiChartAch]]:
     """
     通过 `user_id, server, cut_version` 获取 `MaiChartAch`（列表）（用于 best 50 生成）
+    `cut_version` 与当前分段版本一致时读取 `MaiUserBest` 物化缓存，否则直接查询成绩表
     Returns:
     - b35 列表（版本 < cut_version，按 DX Rating 降序，最多 35 条）
     - b15 列表（版本 >= cut_version，按 DX Rating 降序，最多 15 条）
     """
+    b50_options = (
+        selectinload(MaiChartAch.chart)
+        .selectinload(MaiChart.maidata)
+        .selectinload(MaiData.charts),
+        selectinload(MaiChartAch.chart)
+        .selectinload(MaiChart.maidata)
+        .selectinload(MaiData.aliases),
+    )
+
+    if server in ("JP", "CN") and cut_version == get_cut_version(server):
+        bests = await _load_user_best(user_id=user_id, server=server, session=session)
+        statement = (
+            select(MaiChartAch)
+            .options(*b50_options)
+            .where(MaiChartAch.id.in_([b.ach_id for b in bests]))
+        )
+        ach_map = {a.id: a for a in (await session.execute(statement)).scalars().all()}
+        b35_bests, b15_bests = _split_user_best(bests)
+        return (
+            [ach_map[b.ach_id] for b in b35_bests if b.ach_id in ach_map],
+            [ach_map[b.ach_id] for b in b15_bests if b.ach_id in ach_map],
+        )
+
     def _build_b50_statement(
     user_id: int, server: SERVER_TAG, version_condition, limit_count: int
     ) -> Select:
@@ -458,14 +717,7 @@ async def get_mdts_for_b50(user_id: int, server: SERVER_TAG, cut_version: int, *
             select(MaiChartAch)
             .join(MaiChartAch.chart)
             .join(MaiChart.maidata)
-            .options(
-                selectinload(MaiChartAch.chart)
-                .selectinload(MaiChart.maidata)
-                .selectinload(MaiData.charts),
-                selectinload(MaiChartAch.chart)
-                .selectinload(MaiChart.maidata)
-                .selectinload(MaiData.aliases),
-            )
+            .options(*b50_options)
             .where(
                 MaiChartAch.user_id == user_id,
                 MaiChartAch.server == server,
@@ -481,7 +733,7 @@ async def get_mdts_for_b50(user_id: int, server: SERVER_TAG, cut_version: int, *
         user_id=user_id,
         server=server,
         version_condition=version_field < cut_version,
-        limit_count=35,
+        limit_count=B35_SIZE,
     )
     result = await session.execute(stmt_b35)
     achs_b35 = result.scalars().all()
@@ -490,7 +742,7 @@ async def get_mdts_for_b50(user_id: int, server: SERVER_TAG, cut_version: int, *
         user_id=user_id,
         server=server,
         version_condition=version_field >= cut_version,
-        limit_count=15,
+        limit_count=B15_SIZE,
     )
     result = await session.execute(stmt_b15)
     achs_b15 = result.scalars().all()
@@ -498,6 +750,127 @@ async def get_mdts_for_b50(user_id: int, server: SERVER_TAG, cut_version: int, *
     return achs_b35, achs_b15
 
 
+# B50 绘图所需的最小列集合（仅返回普通行，不水合 ORM 对象）
+B50_ROW_COLUMNS = (
+    MaiChartAch.id,
+    MaiChartAch.user_id,
+    MaiChartAch.shortid,
+    MaiChartAch.difficulty,
+    MaiChartAch.achievement,
+    MaiChartAch.dxscore,
+    MaiChartAch.combo,
+    MaiChartAch.sync,
+    MaiChartAch.dxrating,
+    MaiChartAch.update_time,
+    MaiChart.lv,
+    MaiChart.lv_cn,
+    MaiChart.note_count_tap,
+    MaiChart.note_count_hold,
+    MaiChart.note_count_slide,
+    MaiChart.note_count_touch,
+    MaiChart.note_count_break,
+    MaiData.title,
+    MaiData.cabinet,
+    MaiData.version,
+    MaiData.version_cn,
+    MaiData.zip_path,
+    MaiData.is_utage,
+    MaiData.utage_tag,
+    MaiData.buddy,
+)
+
+
+# 通过 `user_id, server, cut_version` 获取 B50 绘图行（轻量版 `get_mdts_for_b50`）
+@with_session
+async def get_b50_rows(user_id: int, server: SERVER_TAG, cut_version: int, *, session: AsyncSession) -> tuple[list[Row], list[Row]]:
+    """
+    通过 `user_id, server, cut_version` 获取 B50 绘图所需的列（`B50_ROW_COLUMNS`）
+    与 `get_mdts_for_b50` 排序、分段规则一致，但不加载 `MaiData.charts` / `aliases`
+    Returns:
+    - b35 行列表（版本 < cut_version，按 DX Rating 降序，最多 35 条）
+    - b15 行列表（版本 >= cut_version，按 DX Rating 降序，最多 15 条）
+    """
+    base = (
+        select(*B50_ROW_COLUMNS)
+        .join(MaiChart, MaiChartAch.chart_id == MaiChart.id)
+        .join(MaiData, MaiChart.shortid == MaiData.shortid)
+    )
+
+    if server in ("JP", "CN") and cut_version == get_cut_version(server):
+        bests = await _load_user_best(user_id=user_id, server=server, session=session)
+        statement = base.where(MaiChartAch.id.in_([b.ach_id for b in bests]))
+        row_map = {row.id: row for row in (await session.execute(statement)).all()}
+        b35_bests, b15_bests = _split_user_best(bests)
+        return (
+            [row_map[b.ach_id] for b in b35_bests if b.ach_id in row_map],
+            [row_map[b.ach_id] for b in b15_bests if b.ach_id in row_map],
+        )
+
+    version_field = MaiData.version_cn if server == "CN" else MaiData.version
+    result: list[list[Row]] = []
+    for version_condition, limit_count in (
+        (version_field < cut_version, B35_SIZE),
+        (version_field >= cut_version, B15_SIZE),
+    ):
+        statement = (
+            base
+            .where(
+                MaiChartAch.user_id == user_id,
+                MaiChartAch.server == server,
+                version_condition,
+            )
+            .order_by(MaiChartAch.dxrating.desc(), MaiChartAch.achievement.desc())
+            .limit(limit_count)
+        )
+        result.append(list((await session.execute(statement)).all()))
+    return result[0], result[1]
+
+
+def b50_row_to_entry(row: Row, server: SERVER_TAG) -> tuple[utils.MaiData, int]:
+    """将 `get_b50_rows` 返回的行转换为绘图用的 `(utils.MaiData, difficulty)`"""
+    zip_path = resolve_zip_path(row.zip_path)
+    maidata = utils.MaiData(
+        shortid=row.shortid,
+        title=row.title,
+        bpm=0,
+        artist='',
+        genre=0,
+        cabinet=row.cabinet,
+        version=row.version,
+        version_cn=row.version_cn,
+        converter='',
+        img_path=(zip_path / "bg.png") if zip_path else Path("bg.png"),
+        zip_path=zip_path,
+        is_utage=row.is_utage,
+        buddy=all((row.buddy, row.is_utage)),
+        utage_tag=row.utage_tag if row.is_utage and isinstance(row.utage_tag, str) else '',
+    )
+    chart = utils.MaiChart(
+        shortid=row.shortid,
+        difficulty=row.difficulty,
+        lv=row.lv,
+        lv_cn=row.lv_cn,
+        note_count_tap=row.note_count_tap,
+        note_count_hold=row.note_count_hold,
+        note_count_slide=row.note_count_slide,
+        note_count_touch=row.note_count_touch,
+        note_count_break=row.note_count_break,
+    )
+    maidata.set_chart(chart)
+    chart.set_ach(utils.MaiChartAch(
+        shortid=row.shortid,
+        difficulty=row.difficulty,
+        server=server,
+        achievement=row.achievement,
+        dxscore=row.dxscore,
+        combo=row.combo,
+        sync=row.sync,
+        update_time=row.update_time,
+        user_id=row.user_id,
+    ))
+    return maidata, row.difficulty
+
+
 # --- 增 (add) ---
 
 # 新增 `MaiData`（全新曲目）
@@ -575,15 +948,12 @@ async def update_mdt(mdt: MaiData, *, session: AsyncSession):
                 else:
                     # 全新难度，直接添加
                     existing.charts.append(new_chart)
-        # 检查并更新别名数据
-        # TODO
-        # 问题： 在更新曲目时，每有一个别名就去查一次数据库。如果批量更新 100 首歌，每首歌 5 个别名，就会产生 500 次查询。
-        # 建议： 先用 in_() 语句一次性查出该曲目的所有别名，在内存中进行比对。
-        aliases = {alias.alias: alias for alias in mdt.aliases}
-        for alias_text, mdt_alias in aliases.items():
-            alias = await get_mdt_alias(alias_text, existing.shortid, session=session)
-            if not alias:
+        # 检查并更新别名数据（`existing.aliases` 已由 `get_mdt_by_id` 一次性加载，在内存中比对）
+        existing_aliases = {alias.alias for alias in existing.aliases}
+        for mdt_alias in mdt.aliases:
+            if mdt_alias.alias not in existing_aliases:
                 # 数据库不存在该别名，直接添加
+                existing_aliases.add(mdt_alias.alias)
                 existing.aliases.append(mdt_alias)
 
 # 设置 `MaiChart` 的 `level` (通过 `shortid, difficulty, server ( 支持 synh )`)
@@ -623,7 +993,15 @@ async def set_mct_level(mct: MaiChart | tuple[int, int], server: SERVER_TAG | Li
 # [批量] 通过 `shortid, difficulty, server (支持 synh)` 设置 `MaiChart` 的 `level`
 @with_session
 async def set_mct_level_batch(data: list[dict], server: SERVER_TAG | Literal['synh'], 
-                              *, session: AsyncSession):
+                              *, session: AsyncSession) -> list[tuple[int, int]]:
+    """
+    [批量] 设置 `MaiChart` 的 `level`
+    data 格式: [{"shortid": ..., "difficulty": ..., "level": ...}, ...]
+    Returns: 定数实际发生变动的谱面 `[(shortid, difficulty), ...]`
+    """
+    if not data:
+        return []
+
     # 1. 字段映射
     server_field_map = {
         'JP': MaiChart.lv,
@@ -646,7 +1024,21 @@ async def set_mct_level_batch(data: list[dict], server: SERVER_TAG | Literal['sy
         .execution_options(synchronize_session=False)
     )
 
-    # 3. 转换 data 中的键名以匹配 bindparam
+    # 3. 仅保留定数实际变动的谱面
+    current_stmt = (
+        select(table.c.shortid, table.c.difficulty, target_field)
+        .where(table.c.shortid.in_({d["shortid"] for d in data}))
+    )
+    current_levels = {(sid, diff): lv for sid, diff, lv in (await session.execute(current_stmt)).all()}
+    changed = [
+        d for d in data
+        if (d["shortid"], d["difficulty"]) in current_levels
+        and current_levels[(d["shortid"], d["difficulty"])] != d["level"]
+    ]
+    if not changed:
+        return []
+
+    # 4. 转换 data 中的键名以匹配 bindparam
     # 这一步是为了让 data 里的键和上面 bindparam 里的名字对应上
     formatted_data = [
         {
@@ -654,11 +1046,12 @@ async def set_mct_level_batch(data: list[dict], server: SERVER_TAG | Literal['sy
             "b_diff": d["difficulty"],
             "b_level": d["level"]
         }
-        for d in data
+        for d in changed
     ]
 
-    # 4. 执行批量操作
+    # 5. 执行批量操作
     await session.execute(statement, formatted_data)
+    return [(d["shortid"], d["difficulty"]) for d in changed]
 
 # 设置 `MaiData` 的 `version` (通过 `shortid, server`)
 @with_session
@@ -681,11 +1074,15 @@ async def set_mct_version(shortid: int, server: SERVER_TAG, version: int,
 
     if mdt := result.scalar_one_or_none():
         if server == 'CN':
+            changed = mdt.version_cn != version
             mdt.version_cn = version
         elif server == 'JP':
+            changed = mdt.version != version
             mdt.version = version
         else:
             return
+        if changed:
+            await _invalidate_user_best([shortid], server, session=session)
 
 # [批量] 设置 `MaiData` 的 `version` (通过 `shortid, server`)
 @with_session
@@ -719,8 +1116,16 @@ async def set_mdt_version_batch(data: list[tuple[int, int]],  server: SERVER_TAG
         .execution_options(synchronize_session=False)
     )
 
-    # 3. 执行批量更新
-    await session.execute(statement, [{"b_shortid": sid, "b_version": version} for sid, version in data])
+    # 3. 仅更新版本号实际变动的曲目
+    current_stmt = select(table.c.shortid, target_field).where(table.c.shortid.in_({sid for sid, _ in data}))
+    current_versions = dict((await session.execute(current_stmt)).all())
+    changed = [(sid, version) for sid, version in data if sid in current_versions and current_versions[sid] != version]
+    if not changed:
+        return
+
+    # 4. 执行批量更新，并标记受影响用户的 B35/B15 缓存失效
+    await session.execute(statement, [{"b_shortid": sid, "b_version": version} for sid, version in changed])
+    await _invalidate_user_best({sid for sid, _ in changed}, server, session=session)
 
 # 通过 `shortid` 添加 `MaiData.aliases`，带鉴权属性
 @with_session
@@ -750,6 +1155,11 @@ async def add_mdt_alias(shortid: int, alias_text: str, create_qq: int, create_qq
         create_time=int(time.time())
     )
     session.add(new_alias)
+    await session.flush()
+
+    # 提交成功后再同步到内存目录，回滚时目录不受影响
+    alias_data = new_alias.to_data()
+    _after_commit(session, lambda: _add_catalog_aliases([alias_data]))
     return True
 
 # [批量] 通过 `shortid` 添加 `MaiData.aliases`，带鉴权属性
@@ -858,6 +1268,9 @@ async def add_mdt_alias_batch(data: list[tuple[int, str]], create_qq: int,
             if new_objs:
                 session.add_all(new_objs)
 
+        # 本批提交成功后再同步到内存目录
+        chunk_aliases = [utils.MaiAlias(**d) for d in full_data]
+        _after_commit(session, lambda aliases=chunk_aliases: _add_catalog_aliases(aliases))
         await session.commit()
 
 
@@ -903,7 +1316,7 @@ async def set_mct_ach(server: SERVER_TAG, ach: utils.MaiChartAch,
         else:
             maichart.set_ach(new_ach)
             new_dxrating = maichart.get_dxrating(server=server, ap_bonus=ap_bonus, user_id=ach.user_id)
-            session.add(MaiChartAch(
+            mct_ach = MaiChartAch(
                 user_id=ach.user_id,
                 chart_id=chart.id,
                 shortid=chart.shortid,
@@ -915,10 +1328,23 @@ async def set_mct_ach(server: SERVER_TAG, ach: utils.MaiChartAch,
                 combo=new_ach.combo,
                 sync=new_ach.sync,
                 update_time=int(time.time()),
-            ))
-
-        # 先写入 MaiChartAch 的最新 dxrating，再刷新 MaiUser 汇总缓存及更新时间。
-        await refresh_user_dxrating_cache(user_id=ach.user_id, server=server, session=session)
+            )
+            session.add(mct_ach)
+
+        # 先写入 MaiChartAch 的最新 dxrating，再增量维护 B35/B15 缓存与 MaiUser 汇总缓存。
+        if server in ("JP", "CN"):
+            await session.flush()
+            version = chart.maidata.version_cn if server == "CN" else chart.maidata.version
+            candidate = BestCandidate(
+                ach_id=mct_ach.id,
+                is_b15=_is_b15_version(version, get_cut_version(server)),
+                dxrating=mct_ach.dxrating,
+                achievement=mct_ach.achievement,
+                update_time=mct_ach.update_time,
+            )
+            await update_user_best(user_id=ach.user_id, server=server, candidates=[candidate], session=session)
+        else:
+            await refresh_user_dxrating_cache(user_id=ach.user_id, server=server, session=session)
         return generate_change_log(chart, new_ach, old_ach)
     return None
 
@@ -940,57 +1366,156 @@ async def set_last_sy_hash(user_id: int, sy_hash: str, *, session: AsyncSession)
         user = MaiUser(user_id=user_id)
         session.add(user)
     user.last_sy_hash = sy_hash
+    _invalidate_user_cache(user_id, session=session)
 
 # --- 其他 ---
 
+# 曲目同步涉及的字段（`sync_mdt_list` 指纹与批量更新共用）
+MDT_SYNC_FIELDS = ('title', 'bpm', 'artist', 'genre', 'cabinet',
+                   'version', 'version_cn', 'converter', 'zip_path',
+                   'is_utage', 'utage_tag', 'buddy')
+MCT_SYNC_FIELDS = ('lv', 'lv_cn', 'lv_synh', 'des', 'inote',
+                   'note_count_tap', 'note_count_hold', 'note_count_slide',
+                   'note_count_touch', 'note_count_break')
+
+
+def mdt_fingerprint(mdt: MaiData) -> str:
+    """计算曲目内容指纹：元数据 + 各难度谱面 (定数/谱师/谱面/物量) + 别名"""
+    charts = sorted(
+        (chart.difficulty, *(getattr(chart, f) for f in MCT_SYNC_FIELDS))
+        for chart in mdt.charts
+    )
+    aliases = sorted(alias.alias for alias in mdt.aliases)
+    content = repr((tuple(getattr(mdt, f) for f in MDT_SYNC_FIELDS), charts, aliases))
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
 # 通过 `mdt_list` 高效同步曲目列表
 @with_session
-async def sync_mdt_list(mdt_list: list[MaiData], *, session: AsyncSession):
+async def sync_mdt_list(mdt_list: list[MaiData], *, session: AsyncSession) -> int:
     """
     高效同步曲目列表：自动处理新增与更新
+    按内容指纹 `MaiData.sync_hash` 跳过未变更曲目，变更曲目使用 executemany 批量写入
     Args:
         mdt_list: 准备同步的实体对象列表
+    Returns: 实际新增或更新的曲目数量
     """
     if not mdt_list:
-        return
+        return 0
 
-    # 1. 一次性查出所有现有的数据（包含关联的 charts）
+    # 1. 一次性查出现有曲目的指纹（仅查列，不加载 charts / aliases）
     sids = [m.shortid for m in mdt_list]
-    stmt = (
-        select(MaiData)
-        .where(MaiData.shortid.in_(sids))
-        .options(selectinload(MaiData.charts))
-    )
-    result = await session.execute(stmt)
-    existing_map = {m.shortid: m for m in result.scalars().all()}
+    stmt = select(MaiData.shortid, MaiData.sync_hash).where(MaiData.shortid.in_(sids))
+    existing_hashes: dict[int, Optional[str]] = dict((await session.execute(stmt)).tuples().all())
 
+    changed: list[tuple[MaiData, str]] = []
     for new_mdt in mdt_list:
-        existing = existing_map.get(new_mdt.shortid)
-        
-        if not existing:
+        fingerprint = mdt_fingerprint(new_mdt)
+        if new_mdt.shortid not in existing_hashes:
             # A. 数据库没有：直接添加
+            new_mdt.sync_hash = fingerprint
             session.add(new_mdt)
-        else:
-            # B. 数据库已有：手动更新字段（Merge 逻辑）
-            # 基础属性更新
-            for field in ['title', 'bpm', 'artist', 'genre', 'cabinet',
-                          'version', 'version_cn', 'converter', 'zip_path',
-                          'is_utage', 'utage_tag', 'buddy']:
-                setattr(existing, field, getattr(new_mdt, field))
-            
-            # 谱面更新逻辑 (Charts)
-            existing_charts = {c.difficulty: c for c in existing.charts}
-            for new_mct in new_mdt.charts:
-                existing_chart = existing_charts.get(new_mct.difficulty)
-                if existing_chart:
-                    # 更新已有难度属性
-                    for f in ['lv', 'lv_cn', 'lv_synh', 'des', 'inote', 
-                              'note_count_tap', 'note_count_hold', 'note_count_slide', 
-                              'note_count_touch', 'note_count_break']:
-                        setattr(existing_chart, f, getattr(new_mct, f))
-                else:
-                    # 添加新难度
-                    existing.charts.append(new_mct)
+        elif existing_hashes[new_mdt.shortid] != fingerprint:
+            # B. 数据库已有且内容变动：留待批量更新
+            changed.append((new_mdt, fingerprint))
+        # C. 指纹一致：跳过
+
+    added_count = len(mdt_list) - len(existing_hashes)
+    if not changed:
+        return added_count
+
+    changed_sids = [m.shortid for m, _ in changed]
+
+    # 版本号或定数变动的曲目会改变 B35/B15 分段与 rating，记录受影响的服务器
+    # CN 定数为空时回退到 JP 定数，因此 `lv` 变动同时影响两个服务器
+    mdt_table = MaiData.__table__
+    mct_table = MaiChart.__table__
+    version_stmt = (
+        select(mdt_table.c.shortid, mdt_table.c.version, mdt_table.c.version_cn)
+        .where(mdt_table.c.shortid.in_(changed_sids))
+    )
+    old_versions = {sid: (version, version_cn) for sid, version, version_cn in await session.execute(version_stmt)}
+    chart_stmt = (
+        select(mct_table.c.shortid, mct_table.c.difficulty, mct_table.c.lv, mct_table.c.lv_cn)
+        .where(mct_table.c.shortid.in_(changed_sids))
+    )
+    existing_charts = {(sid, diff): (lv, lv_cn) for sid, diff, lv, lv_cn in await session.execute(chart_stmt)}
+    rating_changed: dict[SERVER_TAG, set[int]] = {"JP": set(), "CN": set()}
+    for m, _ in changed:
+        old_version, old_version_cn = old_versions.get(m.shortid, (None, None))
+        old_levels = [existing_charts.get((m.shortid, chart.difficulty)) for chart in m.charts]
+        lv_changed = any(old is None or old[0] != chart.lv for old, chart in zip(old_levels, m.charts))
+        lv_cn_changed = any(old is None or old[1] != chart.lv_cn for old, chart in zip(old_levels, m.charts))
+        if m.version != old_version or lv_changed:
+            rating_changed["JP"].add(m.shortid)
+        if m.version_cn != old_version_cn or lv_changed or lv_cn_changed:
+            rating_changed["CN"].add(m.shortid)
+
+    # 2. 批量更新曲目基础属性
+    mdt_statement = (
+        update(mdt_table)  # type: ignore
+        .where(mdt_table.c.shortid == bindparam("b_shortid"))
+        .values({mdt_table.c[f]: bindparam(f"b_{f}") for f in (*MDT_SYNC_FIELDS, 'sync_hash')})
+    )
+    await session.execute(mdt_statement, [
+        {
+            "b_shortid": m.shortid,
+            "b_sync_hash": fingerprint,
+            **{f"b_{f}": getattr(m, f) for f in MDT_SYNC_FIELDS},
+        }
+        for m, fingerprint in changed
+    ])
+
+    # 3. 谱面：已有难度批量更新，新难度批量插入
+    chart_updates: list[dict] = []
+    chart_inserts: list[dict] = []
+    for m, _ in changed:
+        for chart in m.charts:
+            values = {f: getattr(chart, f) for f in MCT_SYNC_FIELDS}
+            if (m.shortid, chart.difficulty) in existing_charts:
+                chart_updates.append({
+                    "b_shortid": m.shortid,
+                    "b_diff": chart.difficulty,
+                    **{f"b_{f}": v for f, v in values.items()},
+                })
+            else:
+                chart_inserts.append({"shortid": m.shortid, "difficulty": chart.difficulty, **values})
+    if chart_updates:
+        mct_statement = (
+            update(mct_table)  # type: ignore
+            .where(mct_table.c.shortid == bindparam("b_shortid"))
+            .where(mct_table.c.difficulty == bindparam("b_diff"))
+            .values({mct_table.c[f]: bindparam(f"b_{f}") for f in MCT_SYNC_FIELDS})
+        )
+        await session.execute(mct_statement, chart_updates)
+    if chart_inserts:
+        await session.execute(insert(mct_table), chart_inserts)  # type: ignore
+
+    # 4. 别名：仅补充缺失的别名（不删除已有别名）
+    alias_table = MaiAlias.__table__
+    alias_stmt = select(alias_table.c.shortid, alias_table.c.alias).where(alias_table.c.shortid.in_(changed_sids))
+    existing_aliases = set((await session.execute(alias_stmt)).tuples().all())
+    alias_inserts: list[dict] = []
+    for m, _ in changed:
+        for alias in m.aliases:
+            if (m.shortid, alias.alias) in existing_aliases:
+                continue
+            existing_aliases.add((m.shortid, alias.alias))
+            alias_inserts.append({
+                "shortid": m.shortid,
+                "alias": alias.alias,
+                "create_time": alias.create_time if alias.create_time is not None else int(time.time()),
+                "create_qq": alias.create_qq,
+                "create_qq_group": alias.create_qq_group,
+            })
+    if alias_inserts:
+        await session.execute(insert(alias_table), alias_inserts)  # type: ignore
+
+    # 5. 标记受影响用户的 B35/B15 缓存失效
+    for server, shortids in rating_changed.items():
+        await _invalidate_user_best(shortids, server, session=session)
+
+    return added_count + len(changed)
 
 
 def _get_current_version_by_server(server: SERVER_TAG) -> int:
@@ -1026,182 +1551,156 @@ async def list_pending_id_checks(*, session: AsyncSession) -> list[tuple[int, in
     return [(r.original_id, r.mapped_id) for r in rows]  # type: ignore
 
 
+# ID 迁移用的临时映射表（仅在 `apply_id_mappings` 执行期间存在）
+_ID_MAP_TABLE = Table(
+    "maib_tmp_idmap",
+    MetaData(),
+    Column("original_id", Integer, primary_key=True, autoincrement=False),
+    Column("mapped_id", Integer, nullable=False, unique=True),
+    prefixes=["TEMPORARY"],
+)
+
+
 @with_session
-async def apply_id_mapping(original_id: int, mapped_id: int, *, session: AsyncSession):
-    """对单个 original_id -> mapped_id 执行迁移。
+async def apply_id_mappings(*, session: AsyncSession) -> dict[str, int]:
+    """
+    以集合操作一次性执行 `MaiIdCheck` 中所有待处理的 original_id -> mapped_id 迁移（单事务）
 
     策略：
-    - 每个 id 在独立事务中处理（由装饰器保证）。
-    - 如果 target 不存在：复制 source 到 target 并移动子行；然后删除 source。
-    - 如果 target 存在：优先保留 target 的 `MaiData`/`MaiChart`（maidata/maichart），
-      alias 与 ach 使用源数据优先（替换目标冲突）。
-    - 处理过程中保持子对象引用一致（chart_id 映射），并在最后删除 idcheck 条目。
+    - 待处理映射先载入临时表；链式映射 (a -> b, b -> c) 与同一目标的多个来源仅处理其一，其余留待下次
+    - 目标曲目 / 难度不存在时，先由源数据复制生成，从而统一为「合并到已有目标」
+    - 成绩冲突 (同用户、服务器、难度) 保留成就率较高者，成就率相同时保留目标成绩
+    - 别名冲突保留目标别名；其余成绩与别名改指向目标，最后删除源谱面、源曲目与 idcheck 条目
+    - 受影响用户的 B35/B15 与 DXRating 汇总缓存整体重建
+    Returns: 各步骤影响的行数
     """
-    # 获取完整的 source (含 charts -> achs, aliases)
-    stmt = (
-        select(MaiData)
-        .options(
-            selectinload(MaiData.charts).selectinload(MaiChart.achs),
-            selectinload(MaiData.aliases),
-        )
-        .where(MaiData.shortid == original_id)
+    m = _ID_MAP_TABLE
+    mdt_table = MaiData.__table__
+    mct_table = MaiChart.__table__
+    ach_table = MaiChartAch.__table__
+    alias_table = MaiAlias.__table__
+    counts: dict[str, int] = {}
+
+    async def _run(step: str, statement) -> None:
+        result = await session.execute(statement.execution_options(synchronize_session=False))
+        counts[step] = max(result.rowcount, 0)  # type: ignore
+
+    # 1. 载入待处理映射到临时表
+    await session.run_sync(lambda sync_session: m.create(sync_session.connection(), checkfirst=True))
+    await session.execute(delete(m))
+    chained_ids = select(MaiIdCheck.original_id).where(MaiIdCheck.mapped_id.is_not(None))
+    first_per_target = (
+        select(func.min(MaiIdCheck.original_id))
+        .where(MaiIdCheck.mapped_id.is_not(None), MaiIdCheck.original_id != MaiIdCheck.mapped_id)
+        .group_by(MaiIdCheck.mapped_id)
     )
-    result = await session.execute(stmt)
-    source = result.scalar_one_or_none()
-
-    # 无源数据，删除 idcheck 后返回
-    if not source:
-        await session.execute(delete(MaiIdCheck).where(MaiIdCheck.original_id == original_id))
-        return
-
-    # 目标
-    stmt_t = (
-        select(MaiData)
-        .options(selectinload(MaiData.charts).selectinload(MaiChart.achs), selectinload(MaiData.aliases))
-        .where(MaiData.shortid == mapped_id)
+    pending = (
+        select(MaiIdCheck.original_id, MaiIdCheck.mapped_id)
+        .where(
+            MaiIdCheck.original_id.in_(first_per_target),
+            MaiIdCheck.mapped_id.not_in(chained_ids),
+        )
     )
-    result = await session.execute(stmt_t)
-    target = result.scalar_one_or_none()
-
-    # 构建目标难度映射
-    target_charts_map: dict[int, MaiChart] = {}
-    if target:
-        for tc in target.charts:
-            target_charts_map[tc.difficulty] = tc
-
-    # Helper: 删除指定对象安全地
-    async def _del(obj):
-        try:
-            await session.delete(obj)
-        except Exception:
-            pass
-
-    # CASE A: 目标不存在 -> 复制 source 为新 target
-    if not target:
-        new_mdt = MaiData(
-            shortid=mapped_id,
-            title=source.title,
-            bpm=source.bpm,
-            artist=source.artist,
-            genre=source.genre,
-            cabinet=source.cabinet,
-            version=source.version,
-            version_cn=source.version_cn,
-            converter=source.converter,
-            zip_path=source.zip_path,
-            is_utage=source.is_utage,
-            utage_tag=source.utage_tag,
-            buddy=source.buddy,
+    await _run("mappings", insert(m).from_select(["original_id", "mapped_id"], pending))
+
+    if counts["mappings"]:
+        # 记录受影响用户（源 / 目标曲目上持有成绩的用户），用于最后重建缓存
+        affected_stmt = (
+            select(ach_table.c.user_id, ach_table.c.server)
+            .where(or_(
+                ach_table.c.shortid.in_(select(m.c.original_id)),
+                ach_table.c.shortid.in_(select(m.c.mapped_id)),
+            ))
+            .distinct()
         )
-        session.add(new_mdt)
-
-        # 复制 charts + achs
-        for sc in source.charts:
-            new_chart = MaiChart(
-                shortid=mapped_id,
-                difficulty=sc.difficulty,
-                lv=sc.lv,
-                lv_cn=sc.lv_cn,
-                lv_synh=sc.lv_synh,
-                des=sc.des,
-                inote=sc.inote,
-                note_count_tap=sc.note_count_tap,
-                note_count_hold=sc.note_count_hold,
-                note_count_slide=sc.note_count_slide,
-                note_count_touch=sc.note_count_touch,
-                note_count_break=sc.note_count_break,
+        affected_users: dict[str, set[int]] = {"JP": set(), "CN": set()}
+        for user_id, server in (await session.execute(affected_stmt)).tuples().all():
+            affected_users.setdefault(server, set()).add(user_id)
+
+        # 2. 目标曲目不存在：复制源曲目
+        target_mdt = mdt_table.alias("target")
+        await _run("songs_copied", insert(mdt_table).from_select(
+            ["shortid", *MDT_SYNC_FIELDS],
+            select(m.c.mapped_id, *(mdt_table.c[f] for f in MDT_SYNC_FIELDS))
+            .join_from(m, mdt_table, mdt_table.c.shortid == m.c.original_id)
+            .where(~select(target_mdt.c.shortid).where(target_mdt.c.shortid == m.c.mapped_id).exists()),
+        ))
+
+        # 3. 目标难度不存在：复制源谱面
+        target_mct = mct_table.alias("target")
+        await _run("charts_copied", insert(mct_table).from_select(
+            ["shortid", "difficulty", *MCT_SYNC_FIELDS],
+            select(m.c.mapped_id, mct_table.c.difficulty, *(mct_table.c[f] for f in MCT_SYNC_FIELDS))
+            .join_from(m, mct_table, mct_table.c.shortid == m.c.original_id)
+            .where(~select(target_mct.c.id).where(
+                target_mct.c.shortid == m.c.mapped_id,
+                target_mct.c.difficulty == mct_table.c.difficulty,
+            ).exists()),
+        ))
+
+        # 4. 成绩冲突：先删除被源成绩超过的目标成绩，再删除仍然冲突的源成绩
+        source_ach = ach_table.alias("source")
+        await _run("achs_replaced", delete(ach_table).where(
+            select(source_ach.c.id)
+            .join_from(source_ach, m, source_ach.c.shortid == m.c.original_id)
+            .where(
+                m.c.mapped_id == ach_table.c.shortid,
+                source_ach.c.user_id == ach_table.c.user_id,
+                source_ach.c.server == ach_table.c.server,
+                source_ach.c.difficulty == ach_table.c.difficulty,
+                source_ach.c.achievement > ach_table.c.achievement,
             )
-            new_mdt.charts.append(new_chart)
-            for ach in sc.achs:
-                new_ach = MaiChartAch(
-                    shortid=mapped_id,
-                    chart=new_chart,
-                    difficulty=ach.difficulty,
-                    server=ach.server,
-                    achievement=ach.achievement,
-                    dxscore=ach.dxscore,
-                    combo=ach.combo,
-                    sync=ach.sync,
-                    update_time=ach.update_time,
-                    user_id=ach.user_id,
-                    dxrating=ach.dxrating,
-                )
-                session.add(new_ach)
-
-        # 复制 aliases
-        for sa in source.aliases:
-            new_alias = MaiAlias(
-                shortid=mapped_id,
-                alias=sa.alias,
-                create_qq=sa.create_qq,
-                create_qq_group=sa.create_qq_group,
-                create_time=sa.create_time,
+            .exists()
+        ))
+        target_ach = ach_table.alias("target")
+        await _run("achs_dropped", delete(ach_table).where(
+            select(target_ach.c.id)
+            .join_from(m, target_ach, target_ach.c.shortid == m.c.mapped_id)
+            .where(
+                m.c.original_id == ach_table.c.shortid,
+                target_ach.c.user_id == ach_table.c.user_id,
+                target_ach.c.server == ach_table.c.server,
+                target_ach.c.difficulty == ach_table.c.difficulty,
             )
-            new_mdt.aliases.append(new_alias)
-
-        # 删除 source 的子对象与 source 自身
-        for sc in list(source.charts):
-            for ach in list(sc.achs):
-                await _del(ach)
-            await _del(sc)
-        for sa in list(source.aliases):
-            await _del(sa)
-        await _del(source)
-
-    else:
-        # CASE B: 目标存在 -> 合并
-        # 1) charts: 若目标有相同 difficulty 则保留目标 chart 并把源的 achs 移到目标 chart; 否则把源 chart 的 shortid 改为 mapped_id
-        source_chart_map = {c.difficulty: c for c in source.charts}
-        for sd, sc in source_chart_map.items():
-            if sd in target_charts_map:
-                tc = target_charts_map[sd]
-                # 把源 chart 下的 achs 迁移到 tc
-                for ach in list(sc.achs):
-                    # 删除目标可能已有的冲突 ach (新数据优先)
-                    exists_stmt = (
-                        select(MaiChartAch)
-                        .where(
-                            MaiChartAch.user_id == ach.user_id,
-                            MaiChartAch.server == ach.server,
-                            MaiChartAch.shortid == mapped_id,
-                            MaiChartAch.difficulty == ach.difficulty,
-                        )
-                    )
-                    res = await session.execute(exists_stmt)
-                    existing_ach = res.scalar_one_or_none()
-                    if existing_ach:
-                        await _del(existing_ach)
-                    # 更新 ach 指向 target chart
-                    ach.shortid = mapped_id
-                    ach.chart_id = tc.id
-                # 删除源 chart
-                await _del(sc)
-            else:
-                # 将源 chart 移动到 mapped_id（更新 shortid）
-                sc.shortid = mapped_id
-
-        # 2) aliases: 新数据优先 -> 若目标已有同名别名则删掉目标的，再把源 alias 更新为 mapped_id
-        for sa in list(source.aliases):
-            # 查找目标是否已有同名别名
-            dup_stmt = select(MaiAlias).where(MaiAlias.shortid == mapped_id, MaiAlias.alias == sa.alias)
-            res = await session.execute(dup_stmt)
-            dup = res.scalar_one_or_none()
-            if dup:
-                await _del(dup)
-            sa.shortid = mapped_id
-
-        # 3) 其余独立 ach（如果还有）会随 chart 的迁移被处理
-
-        # 4) 尝试删除 source（如果没有残留子行）
-        # 检查残留计数
-        cnt_charts = (await session.execute(select(func.count()).select_from(MaiChart).where(MaiChart.shortid == original_id))).scalar_one()
-        cnt_aliases = (await session.execute(select(func.count()).select_from(MaiAlias).where(MaiAlias.shortid == original_id))).scalar_one()
-        cnt_achs = (await session.execute(select(func.count()).select_from(MaiChartAch).where(MaiChartAch.shortid == original_id))).scalar_one()
-        if cnt_charts == 0 and cnt_aliases == 0 and cnt_achs == 0:
-            await _del(source)
-
-    # 删除 idcheck
-    await session.execute(delete(MaiIdCheck).where(MaiIdCheck.original_id == original_id))
+            .exists()
+        ))
+
+        # 5. 剩余源成绩改指向目标谱面 (UPDATE ... FROM)
+        await _run("achs_moved", update(ach_table).where(
+            ach_table.c.shortid == m.c.original_id,
+            mct_table.c.shortid == m.c.mapped_id,
+            mct_table.c.difficulty == ach_table.c.difficulty,
+        ).values(shortid=m.c.mapped_id, chart_id=mct_table.c.id, update_time=ach_table.c.update_time))  # 保留原成绩时间
+
+        # 6. 别名：删除与目标重复的源别名，其余改指向目标
+        target_alias = alias_table.alias("target")
+        await _run("aliases_dropped", delete(alias_table).where(
+            select(target_alias.c.id)
+            .join_from(m, target_alias, target_alias.c.shortid == m.c.mapped_id)
+            .where(m.c.original_id == alias_table.c.shortid, target_alias.c.alias == alias_table.c.alias)
+            .exists()
+        ))
+        await _run("aliases_moved", update(alias_table).where(
+            alias_table.c.shortid == m.c.original_id,
+        ).values(shortid=m.c.mapped_id))
+
+        # 7. 删除源谱面与源曲目
+        await _run("charts_deleted", delete(mct_table).where(mct_table.c.shortid.in_(select(m.c.original_id))))
+        await _run("songs_deleted", delete(mdt_table).where(mdt_table.c.shortid.in_(select(m.c.original_id))))
+
+        # 8. 重建受影响用户的缓存
+        for server, user_ids in affected_users.items():
+            if server in ("JP", "CN") and user_ids:
+                await refresh_user_dxrating_cache_batch(sorted(user_ids), server, session=session)  # type: ignore
+        counts["users_refreshed"] = sum(len(u) for u in affected_users.values())
+
+    # 9. 删除已处理（及自映射）的 idcheck 条目
+    await _run("idchecks_cleared", delete(MaiIdCheck).where(or_(
+        MaiIdCheck.original_id.in_(select(m.c.original_id)),
+        MaiIdCheck.original_id == MaiIdCheck.mapped_id,
+    )))
+    await session.run_sync(lambda sync_session: m.drop(sync_session.connection()))
+    return counts
 
 
 async def _recalculate_single_mct_ach_dxrating(
@@ -1221,21 +1720,176 @@ async def _recalculate_single_mct_ach_dxrating(
     return new_dxrating
 
 
+def _dxrating_expression(achievement: Any, level: Any, ap_bonus: int) -> Any:
+    """构建与 `utils.get_dxrating` 等价的 SQL 表达式（`RATE_FACTOR_TABLE` 编码为 CASE）"""
+    factor = case(
+        *((achievement >= threshold, literal(f, Float)) for threshold, f in RATE_FACTOR_TABLE),
+        else_=literal(0.0, Float),
+    )
+    capped_achievement = case((achievement >= 100.5, literal(100.5, Float)), else_=achievement)
+    ra = level * capped_achievement * factor
+    # int() 向零截断：SQLite 的 CAST 本身即截断，其余方言 CAST 为四舍五入，需先 floor（rating 非负）
+    if PluginRegistry.get_sql_name() != "sqlite":
+        ra = func.floor(ra)
+    ra = sa_cast(ra, Integer)
+    return ra + ap_bonus if ap_bonus > 0 else ra
+
+
+# --- B35 / B15 物化缓存 (MaiUserBest) ---
+
+class BestCandidate(NamedTuple):
+    """参与 B35/B15 增量维护的成绩"""
+    ach_id: int
+    is_b15: Optional[bool]  # None 表示曲目缺少该服版本号，不参与 B50
+    dxrating: int
+    achievement: float
+    update_time: int
+
+
+def _best_sort_key(best: MaiUserBest) -> tuple[int, float]:
+    """B50 排序键：DX Rating 优先，其次成就率"""
+    return best.dxrating, best.achievement
+
+
+def _split_user_best(bests: Iterable[MaiUserBest]) -> tuple[list[MaiUserBest], list[MaiUserBest]]:
+    """拆分为按排序键降序的 (b35, b15) 列表"""
+    ordered = sorted(bests, key=_best_sort_key, reverse=True)
+    return [b for b in ordered if not b.is_b15], [b for b in ordered if b.is_b15]
+
+
+def _is_b15_version(version: Optional[int], cut_version: int) -> Optional[bool]:
+    """判断曲目版本属于 B15 还是 B35，缺少版本号时返回 None"""
+    if version is None:
+        return None
+    return version >= cut_version
+
+
 @with_session
-async def refresh_user_dxrating_cache(user_id: int, server: SERVER_TAG,
-                                      *, session: AsyncSession):
-    """重算单个用户在指定服务器（JP/CN）的 DXRating 汇总缓存。"""
-    
-    cache_server = "CN" if server == "CN" else "JP"
+async def rebuild_user_best(user_id: int, server: SERVER_TAG, *, session: AsyncSession) -> list[MaiUserBest]:
+    """整体重建用户在指定服务器（JP/CN）的 B35/B15 物化缓存"""
     cut_version = get_cut_version(server)
+    version_field = MaiData.version_cn if server == "CN" else MaiData.version
 
-    b35, b15 = await get_mdts_for_b50(
-        user_id=user_id,
-        server=cache_server,
-        cut_version=cut_version,
-        session=session,
+    await session.execute(
+        delete(MaiUserBest).where(MaiUserBest.user_id == user_id, MaiUserBest.server == server)
     )
-    total_dxrating = sum(a.dxrating for a in b35) + sum(a.dxrating for a in b15)
+
+    bests: list[MaiUserBest] = []
+    for is_b15, limit_count in ((False, B35_SIZE), (True, B15_SIZE)):
+        version_condition = version_field >= cut_version if is_b15 else version_field < cut_version
+        statement = (
+            select(MaiChartAch.id, MaiChartAch.dxrating, MaiChartAch.achievement)
+            .join(MaiChartAch.chart)
+            .join(MaiChart.maidata)
+            .where(
+                MaiChartAch.user_id == user_id,
+                MaiChartAch.server == server,
+                version_condition,
+            )
+            .order_by(MaiChartAch.dxrating.desc(), MaiChartAch.achievement.desc())
+            .limit(limit_count)
+        )
+        for ach_id, dxrating, achievement in (await session.execute(statement)).all():
+            bests.append(MaiUserBest(
+                user_id=user_id,
+                server=server,
+                is_b15=is_b15,
+                ach_id=ach_id,
+                dxrating=dxrating,
+                achievement=achievement,
+                cut_version=cut_version,
+            ))
+    session.add_all(bests)
+    return bests
+
+
+@with_session
+async def rebuild_user_best_batch(user_ids: Sequence[int], server: SERVER_TAG, *, session: AsyncSession):
+    """[批量] 以窗口函数 (ROW_NUMBER) 单条 INSERT ... SELECT 整体重建多个用户的 B35/B15 物化缓存"""
+    if not user_ids:
+        return
+    cut_version = get_cut_version(server)
+    version_field = MaiData.version_cn if server == "CN" else MaiData.version
+
+    await session.execute(
+        delete(MaiUserBest)
+        .where(MaiUserBest.user_id.in_(user_ids), MaiUserBest.server == server)
+    )
+
+    is_b15 = (version_field >= cut_version).label("is_b15")
+    ranked = (
+        select(
+            MaiChartAch.user_id,
+            MaiChartAch.id.label("ach_id"),
+            MaiChartAch.dxrating,
+            MaiChartAch.achievement,
+            is_b15,
+            func.row_number().over(
+                partition_by=(MaiChartAch.user_id, is_b15),
+                order_by=(MaiChartAch.dxrating.desc(), MaiChartAch.achievement.desc()),
+            ).label("rank"),
+        )
+        .join(MaiChartAch.chart)
+        .join(MaiChart.maidata)
+        .where(
+            MaiChartAch.user_id.in_(user_ids),
+            MaiChartAch.server == server,
+            version_field.is_not(None),
+        )
+        .subquery()
+    )
+    statement = insert(MaiUserBest).from_select(
+        ["user_id", "server", "is_b15", "ach_id", "dxrating", "achievement", "cut_version"],
+        select(
+            ranked.c.user_id,
+            literal(server),
+            ranked.c.is_b15,
+            ranked.c.ach_id,
+            ranked.c.dxrating,
+            ranked.c.achievement,
+            literal(cut_version),
+        ).where(
+            ranked.c.rank <= case((ranked.c.is_b15, B15_SIZE), else_=B35_SIZE)
+        ),
+    )
+    await session.execute(statement)
+
+
+async def _load_user_best(user_id: int, server: SERVER_TAG, *, session: AsyncSession) -> list[MaiUserBest]:
+    """读取 B35/B15 物化缓存；缓存为空、分段版本变化或成绩已被删除时整体重建"""
+    statement = (
+        select(MaiUserBest, MaiChartAch.id)
+        .outerjoin(MaiChartAch, MaiChartAch.id == MaiUserBest.ach_id)
+        .where(MaiUserBest.user_id == user_id, MaiUserBest.server == server)
+    )
+    rows = (await session.execute(statement)).all()
+    cut_version = get_cut_version(server)
+    if not rows or any(ach_id is None or best.cut_version != cut_version for best, ach_id in rows):
+        return await rebuild_user_best(user_id=user_id, server=server, session=session)
+    return [best for best, _ in rows]
+
+
+async def _invalidate_user_best(shortids: Iterable[int], server: SERVER_TAG, *, session: AsyncSession):
+    """曲目版本变动后，标记持有这些曲目成绩的用户 B35/B15 缓存失效（下次读取时重建）"""
+    shortids = list(shortids)
+    if not shortids:
+        return
+    affected_users = (
+        select(MaiChartAch.user_id)
+        .where(MaiChartAch.shortid.in_(shortids), MaiChartAch.server == server)
+    )
+    await session.execute(
+        update(MaiUserBest)
+        .where(MaiUserBest.server == server, MaiUserBest.user_id.in_(affected_users))
+        .values(cut_version=-1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _write_user_dxrating_cache(user: MaiUser, server: SERVER_TAG, bests: Iterable[MaiUserBest], update_time: int):
+    """将 B35/B15 的 rating 总和与首尾边界写入 `MaiUser` 缓存"""
+    b35, b15 = _split_user_best(bests)
+    total_dxrating = sum(b.dxrating for b in b35) + sum(b.dxrating for b in b15)
 
     # ---- 提取 B35 和 B15 的首尾 rating 边界 ----
     # 降序排列下：[0] 为最高分(first)，[-1] 为最低门槛(last)
@@ -1244,42 +1898,177 @@ async def refresh_user_dxrating_cache(user_id: int, server: SERVER_TAG,
     b15_first = b15[0].dxrating if b15 else 0
     b15_last = b15[-1].dxrating if b15 else 0
 
-    latest_update_stmt = (
-        select(func.max(MaiChartAch.update_time))
-        .where(MaiChartAch.user_id == user_id, MaiChartAch.server == cache_server)
-    )
-    latest_update_time = (await session.execute(latest_update_stmt)).scalar_one_or_none() or 0
-
-    user = await _get_user_by_id(user_id=user_id, session=session)
-    if not user:
-        user = MaiUser(user_id=user_id)
-        session.add(user)
-
     # ---- 写入对应服务器的 rating 总和与边界缓存 ----
-    if cache_server == "CN":
+    if server == "CN":
         user.cn_dxrating = total_dxrating
-        user.cn_update_time = latest_update_time
+        user.cn_update_time = update_time
         user.cn_dxrating_b35_first = b35_first
         user.cn_dxrating_b35_last = b35_last
         user.cn_dxrating_b15_first = b15_first
         user.cn_dxrating_b15_last = b15_last
     else:
         user.jp_dxrating = total_dxrating
-        user.jp_update_time = latest_update_time
+        user.jp_update_time = update_time
         user.jp_dxrating_b35_first = b35_first
         user.jp_dxrating_b35_last = b35_last
         user.jp_dxrating_b15_first = b15_first
         user.jp_dxrating_b15_last = b15_last
 
+
+@with_session
+async def update_user_best(user_id: int, server: SERVER_TAG, candidates: Iterable[BestCandidate],
+                           *, session: AsyncSession):
+    """
+    成绩写入后增量维护用户的 B35/B15 缓存及 `MaiUser` DXRating 汇总缓存
+    - 已在 B35/B15 中的成绩：直接更新 rating
+    - 新成绩：分段未满时直接加入；已满时与该分段最低门槛（即 `*_last`）比较，超过则替换
+    成绩只会变好（rating 不降），因此无需回查成绩表
+    """
+    bests = await _load_user_best(user_id=user_id, server=server, session=session)
+    best_map = {b.ach_id: b for b in bests}
+    candidates = list(candidates)
+    update_time = max((c.update_time for c in candidates), default=0)
+
+    # 1. 先更新已在 B35/B15 中的成绩，避免其按旧 rating 被其他新成绩挤出
+    new_candidates: list[BestCandidate] = []
+    for candidate in candidates:
+        best = best_map.get(candidate.ach_id)
+        if best is None:
+            if candidate.is_b15 is not None:
+                new_candidates.append(candidate)
+            continue
+        if best.is_b15 != candidate.is_b15:
+            # 分段与缓存不一致（曲目版本已变动），整体重建（重建结果已包含本次所有成绩）
+            bests = await rebuild_user_best(user_id=user_id, server=server, session=session)
+            best_map = {b.ach_id: b for b in bests}
+            new_candidates = []
+            break
+        best.dxrating = candidate.dxrating
+        best.achievement = candidate.achievement
+
+    # 2. 新成绩按排序键降序依次与门槛比较
+    for candidate in sorted(new_candidates, key=lambda c: (c.dxrating, c.achievement), reverse=True):
+        section = [b for b in best_map.values() if b.is_b15 == candidate.is_b15]
+        if len(section) >= (B15_SIZE if candidate.is_b15 else B35_SIZE):
+            lowest = min(section, key=_best_sort_key)
+            if (candidate.dxrating, candidate.achievement) <= _best_sort_key(lowest):
+                continue
+            del best_map[lowest.ach_id]
+            if lowest in session.new:
+                session.expunge(lowest)
+            else:
+                await session.delete(lowest)
+
+        best = MaiUserBest(
+            user_id=user_id,
+            server=server,
+            is_b15=candidate.is_b15,
+            ach_id=candidate.ach_id,
+            dxrating=candidate.dxrating,
+            achievement=candidate.achievement,
+            cut_version=get_cut_version(server),
+        )
+        session.add(best)
+        best_map[best.ach_id] = best
+
+    user = await _get_user_by_id(user_id=user_id, session=session)
+    if not user:
+        user = MaiUser(user_id=user_id)
+        session.add(user)
+    last_update_time = user.cn_update_time if server == "CN" else user.jp_update_time
+    _write_user_dxrating_cache(user, server, best_map.values(), max(last_update_time or 0, update_time))
+    _invalidate_user_cache(user_id, session=session)
+
+
+@with_session
+async def refresh_user_dxrating_cache(user_id: int, server: SERVER_TAG,
+                                      *, session: AsyncSession):
+    """重算单个用户在指定服务器（JP/CN）的 B35/B15 缓存与 DXRating 汇总缓存。"""
+    
+    cache_server = "CN" if server == "CN" else "JP"
+    bests = await rebuild_user_best(user_id=user_id, server=cache_server, session=session)
+
+    latest_update_stmt = (
+        select(func.max(MaiChartAch.update_time))
+        .where(MaiChartAch.user_id == user_id, MaiChartAch.server == cache_server)
+    )
+    latest_update_time = (await session.execute(latest_update_stmt)).scalar_one_or_none() or 0
+
+    user = await _get_user_by_id(user_id=user_id, session=session)
+    if not user:
+        user = MaiUser(user_id=user_id)
+        session.add(user)
+    _write_user_dxrating_cache(user, cache_server, bests, latest_update_time)
+    _invalidate_user_cache(user_id, session=session)
+
 @with_session
 async def refresh_user_dxrating_cache_batch(user_ids: Sequence[int], server: SERVER_TAG,
                                             *, session: AsyncSession):
-    """批量重算用户 DXRating 汇总缓存。"""
+    """批量重算用户 B35/B15 缓存与 DXRating 汇总缓存（集合操作，语句数与用户数无关）。"""
     if not user_ids:
         return
 
-    for uid in set(user_ids):
-        await refresh_user_dxrating_cache(user_id=uid, server=server, session=session)
+    cache_server = "CN" if server == "CN" else "JP"
+    user_ids = sorted(set(user_ids))
+    await rebuild_user_best_batch(user_ids=user_ids, server=cache_server, session=session)
+
+    # 1. 单条查询：按用户聚合 B35/B15 的 rating 总和、首尾边界（降序下 first 为最大值、last 为最小值）及最近更新时间
+    b35_rating = case((~MaiUserBest.is_b15, MaiUserBest.dxrating))
+    b15_rating = case((MaiUserBest.is_b15, MaiUserBest.dxrating))
+    best_agg = (
+        select(
+            MaiUserBest.user_id,
+            func.sum(MaiUserBest.dxrating).label("total"),
+            func.max(b35_rating).label("b35_first"),
+            func.min(b35_rating).label("b35_last"),
+            func.max(b15_rating).label("b15_first"),
+            func.min(b15_rating).label("b15_last"),
+        )
+        .where(MaiUserBest.user_id.in_(user_ids), MaiUserBest.server == cache_server)
+        .group_by(MaiUserBest.user_id)
+        .subquery()
+    )
+    latest_update = (
+        select(MaiChartAch.user_id, func.max(MaiChartAch.update_time).label("update_time"))
+        .where(MaiChartAch.user_id.in_(user_ids), MaiChartAch.server == cache_server)
+        .group_by(MaiChartAch.user_id)
+        .subquery()
+    )
+    cache_stmt = (
+        select(
+            latest_update.c.user_id, latest_update.c.update_time, best_agg.c.total,
+            best_agg.c.b35_first, best_agg.c.b35_last, best_agg.c.b15_first, best_agg.c.b15_last,
+        )
+        .outerjoin(best_agg, best_agg.c.user_id == latest_update.c.user_id)
+    )
+    cache_map = {row.user_id: row for row in (await session.execute(cache_stmt)).all()}
+
+    # 2. 补建不存在的用户
+    existing_stmt = select(MaiUser.user_id).where(MaiUser.user_id.in_(user_ids))
+    existing_ids = set((await session.execute(existing_stmt)).scalars().all())
+    if missing_ids := [uid for uid in user_ids if uid not in existing_ids]:
+        await session.execute(insert(MaiUser).values([{"user_id": uid} for uid in missing_ids]))
+
+    # 3. 单条批量 UPDATE 写入对应服务器的 rating 总和与边界缓存
+    prefix = "cn" if cache_server == "CN" else "jp"
+    fields = ("update_time", "dxrating", "dxrating_b35_first", "dxrating_b35_last", "dxrating_b15_first", "dxrating_b15_last")
+    table = MaiUser.__table__
+    statement = (
+        update(table)  # type: ignore
+        .where(table.c.user_id == bindparam("b_user_id"))
+        .values({table.c[f"{prefix}_{field}"]: bindparam(f"b_{field}") for field in fields})
+        .execution_options(synchronize_session=False)
+    )
+    formatted_data = []
+    for uid in user_ids:
+        row = cache_map.get(uid)
+        values = (
+            (row.update_time, row.total, row.b35_first, row.b35_last, row.b15_first, row.b15_last)
+            if row else (0,) * len(fields)
+        )
+        formatted_data.append({"b_user_id": uid, **{f"b_{f}": v or 0 for f, v in zip(fields, values)}})
+    await session.execute(statement, formatted_data)
+    _invalidate_user_cache(user_ids, session=session)
 
 
 @with_session
@@ -1289,39 +2078,50 @@ async def refresh_dxrating_cache_by_chart(shortid: int, difficulty: int, server:
     场景 1：谱面定数变动后，刷新 `shortid, difficulty, server` 下所有用户的该谱面 DXRating，
     并重算受影响用户的 `MaiUser` DXRating 缓存。
     """
+    await refresh_dxrating_cache_by_charts([(shortid, difficulty)], server=server, session=session)
 
-    statement = (
-        select(MaiChart)
-        .where(MaiChart.shortid == shortid, MaiChart.difficulty == difficulty)
-    )
-    mct = (await session.execute(statement)).scalar_one_or_none()
-    if not mct:
-        return
 
-    maichart = mct.to_data()
-    current_version = _get_current_version_by_server(server)
+@with_session
+async def refresh_dxrating_cache_by_charts(charts: Sequence[tuple[int, int]], server: SERVER_TAG,
+                                           *, session: AsyncSession) -> set[int]:
+    """
+    [批量] 场景 1：谱面定数变动后，以单条 UPDATE 重算 `[(shortid, difficulty), ...]` 下所有用户的 DXRating，
+    并以集合操作重算受影响用户的 B35/B15 缓存与 `MaiUser` DXRating 缓存。
+    Returns: 受影响的用户 ID 集合
+    """
+    if not charts:
+        return set()
 
-    ach_statement = (
-        select(MaiChartAch)
-        .where(
-            MaiChartAch.shortid == shortid,
-            MaiChartAch.difficulty == difficulty,
-            MaiChartAch.server == server,
-        )
-    )
-    mct_achs = (await session.execute(ach_statement)).scalars().all()
-    if not mct_achs:
-        return
+    chunk_size = 512
+    chart_keys = sorted(set(charts))
+    chart_ids: list[int] = []
+    for i in range(0, len(chart_keys), chunk_size):
+        chunk = chart_keys[i:i + chunk_size]
+        chart_stmt = select(MaiChart.id).where(tuple_(MaiChart.shortid, MaiChart.difficulty).in_(chunk))
+        chart_ids.extend((await session.execute(chart_stmt)).scalars().all())
+    if not chart_ids:
+        return set()
+
+    level_field = func.coalesce(MaiChart.lv_cn, MaiChart.lv) if server == "CN" else MaiChart.lv
+    level = select(level_field).where(MaiChart.id == MaiChartAch.chart_id).scalar_subquery()
+    ap_bonus = _get_ap_bonus_by_server(server)
+    dxrating = _dxrating_expression(MaiChartAch.achievement, level, ap_bonus)
 
     affected_user_ids: set[int] = set()
-    for mct_ach in mct_achs:
-        await _recalculate_single_mct_ach_dxrating(
-            mct_ach=mct_ach,
-            maichart=maichart,
-            current_version=current_version,
+    for i in range(0, len(chart_ids), chunk_size):
+        chunk_ids = chart_ids[i:i + chunk_size]
+        await session.execute(
+            update(MaiChartAch)
+            .where(MaiChartAch.chart_id.in_(chunk_ids), MaiChartAch.server == server)
+            .values(dxrating=dxrating)
+            .execution_options(synchronize_session=False)
+        )
+        user_stmt = (
+            select(MaiChartAch.user_id)
+            .where(MaiChartAch.chart_id.in_(chunk_ids), MaiChartAch.server == server, MaiChartAch.user_id.is_not(None))
+            .distinct()
         )
-        if mct_ach.user_id is not None:
-            affected_user_ids.add(mct_ach.user_id)
+        affected_user_ids.update(cast(Sequence[int], (await session.execute(user_stmt)).scalars().all()))
 
     if affected_user_ids:
         await refresh_user_dxrating_cache_batch(
@@ -1329,6 +2129,7 @@ async def refresh_dxrating_cache_by_chart(shortid: int, difficulty: int, server:
             server=server,
             session=session,
         )
+    return affected_user_ids
 
 
 @with_session
@@ -1372,6 +2173,92 @@ async def refresh_dxrating_cache_by_chart_user(shortid: int, difficulty: int, se
     await refresh_user_dxrating_cache(user_id=user_id, server=server, session=session)
 
 
+async def _write_achievements_fallback(user_id: int, to_update: list[dict[str, Any]], to_insert: list[dict[str, Any]],
+                                       *, chunk_size: int, session: AsyncSession):
+    """批量上传成绩的通用写入逻辑（MySQL 或其他方言）：ORM 更新 + 分批插入，冲突时逐条回退"""
+    for update_item in to_update:
+        ach_obj = update_item["ach_obj"]
+        ach_obj.achievement = update_item["new_achievement"]
+        ach_obj.dxscore = update_item["new_dxscore"]
+        ach_obj.combo = update_item["new_combo"]
+        ach_obj.sync = update_item["new_sync"]
+        ach_obj.dxrating = update_item["new_dxrating"]
+        ach_obj.update_time = update_item["new_update_time"]
+
+    await session.flush()
+
+    # 执行批量插入
+    if to_insert:
+        for i in range(0, len(to_insert), chunk_size):
+            chunk = to_insert[i:i + chunk_size]
+            chunk_values = [item["values"] for item in chunk]
+
+            chunk_shortids = sorted({v["shortid"] for v in chunk_values})
+            latest_stmt = (
+                select(MaiChartAch)
+                .where(MaiChartAch.user_id == user_id, MaiChartAch.shortid.in_(chunk_shortids))
+            )
+            latest_rows = (await session.execute(latest_stmt)).scalars().all()
+            chunk_keys = {(v["shortid"], v["difficulty"], v["server"]) for v in chunk_values}
+            latest_map = {
+                (a.shortid, a.difficulty, a.server): a
+                for a in latest_rows
+                if (a.shortid, a.difficulty, a.server) in chunk_keys
+            }
+
+            pending_insert: list[dict[str, Any]] = []
+            for v in chunk_values:
+                key = (v["shortid"], v["difficulty"], v["server"])
+                existing = latest_map.get(key)
+                if existing is None:
+                    pending_insert.append(v)
+                    continue
+
+                new_ach_data = utils.MaiChartAch(**v)
+                old_ach = existing.to_data()
+                if _is_achievement_priority_better(new_ach_data, old_ach):
+                    existing.achievement = v["achievement"]
+                    existing.dxscore = v["dxscore"]
+                    existing.combo = v["combo"]
+                    existing.sync = v["sync"]
+                    existing.dxrating = v["dxrating"]
+                    existing.update_time = v["update_time"]
+
+            if not pending_insert:
+                continue
+
+            try:
+                await session.execute(insert(MaiChartAch).values(pending_insert))
+            except IntegrityError:
+                for v in pending_insert:
+                    try:
+                        async with session.begin_nested():
+                            await session.execute(insert(MaiChartAch).values(v))
+                    except IntegrityError:
+                        conflict_stmt = (
+                            select(MaiChartAch)
+                            .where(
+                                MaiChartAch.user_id == v["user_id"],
+                                MaiChartAch.server == v["server"],
+                                MaiChartAch.shortid == v["shortid"],
+                                MaiChartAch.difficulty == v["difficulty"],
+                            )
+                        )
+                        conflict_row = (await session.execute(conflict_stmt)).scalar_one_or_none()
+                        if conflict_row is None:
+                            raise
+
+                        new_ach_data = utils.MaiChartAch(**v)
+                        old_ach = conflict_row.to_data()
+                        if _is_achievement_priority_better(new_ach_data, old_ach):
+                            conflict_row.achievement = v["achievement"]
+                            conflict_row.dxscore = v["dxscore"]
+                            conflict_row.combo = v["combo"]
+                            conflict_row.sync = v["sync"]
+                            conflict_row.dxrating = v["dxrating"]
+                            conflict_row.update_time = v["update_time"]
+
+
 @with_session
 async def upload_achievements_batch(user_id: int, ach_list: Sequence[utils.MaiChartAch],
                                     *, session: AsyncSession) -> MaiChartAchDiffReport:
@@ -1428,9 +2315,6 @@ async def upload_achievements_batch(user_id: int, ach_list: Sequence[utils.MaiCh
         if not chart:
             continue
 
-        maichart = chart.to_data()
-        ap_bonus = _get_ap_bonus_by_server(server)
-
         existing = existing_map.get((shortid, difficulty, server))
         
         # 获取曲目名称用于报告展示
@@ -1453,8 +2337,6 @@ async def upload_achievements_batch(user_id: int, ach_list: Sequence[utils.MaiCh
                 update_time=int(time.time()),
                 user_id=incoming.user_id,
             )
-            maichart.set_ach(merged)
-            new_dxrating = maichart.get_dxrating(server=server, ap_bonus=ap_bonus, user_id=user_id)
 
             # 判断实际数据是否有变化（避免无意义的更新记录）
             if (incoming.achievement > old_ach.achievement or 
@@ -1464,7 +2346,8 @@ async def upload_achievements_batch(user_id: int, ach_list: Sequence[utils.MaiCh
                 
                 to_update.append({
                     "ach_obj": existing,
-                    "new_dxrating": new_dxrating,
+                    "chart": chart,
+                    "server": server,
                     "new_update_time": merged.update_time,
                     "new_achievement": merged.achievement,
                     "new_dxscore": merged.dxscore,
@@ -1486,9 +2369,6 @@ async def upload_achievements_batch(user_id: int, ach_list: Sequence[utils.MaiCh
 
         else:
             # --- 插入场景 ---
-            maichart.set_ach(incoming)
-            new_dxrating = maichart.get_dxrating(server=server, ap_bonus=ap_bonus, user_id=user_id)
-
             to_insert.append({
                 "chart_id": chart.id,
                 "values": {
@@ -1499,7 +2379,7 @@ async def upload_achievements_batch(user_id: int, ach_list: Sequence[utils.MaiCh
                     "server": server,
                     "achievement": incoming.achievement,
                     "dxscore": incoming.dxscore,
-                    "dxrating": new_dxrating,
+                    "dxrating": 0,  # 稍后批量计算
                     "combo": incoming.combo,
                     "sync": incoming.sync,
                     "update_time": int(time.time()),
@@ -1520,93 +2400,119 @@ async def upload_achievements_batch(user_id: int, ach_list: Sequence[utils.MaiCh
             report.new_song.append(diff)
             affected_servers.add(server)
 
-    if to_update:
-        for update_item in to_update:
-            ach_obj = update_item["ach_obj"]
-            ach_obj.achievement = update_item["new_achievement"]
-            ach_obj.dxscore = update_item["new_dxscore"]
-            ach_obj.combo = update_item["new_combo"]
-            ach_obj.sync = update_item["new_sync"]
-            ach_obj.dxrating = update_item["new_dxrating"]
-            ach_obj.update_time = update_item["new_update_time"]
-
-    await session.flush()
+    # 批量计算 DXRating（向量化，避免逐条构建 utils.MaiChart）
+    rating_items = [(u["chart"], u["server"], u["new_achievement"]) for u in to_update]
+    rating_items += [(i["chart"], i["values"]["server"], i["values"]["achievement"]) for i in to_insert]
+    if rating_items:
+        ap_bonus_map = {srv: _get_ap_bonus_by_server(srv) for srv in incoming_servers}
+        dxratings = utils.get_dxrating_batch(
+            [achievement for _, _, achievement in rating_items],
+            [c.lv_cn if srv == "CN" and c.lv_cn is not None else c.lv for c, srv, _ in rating_items],
+            [ap_bonus_map[srv] for _, srv, _ in rating_items],
+        ).tolist()
+        for update_item, dxrating in zip(to_update, dxratings):
+            update_item["new_dxrating"] = dxrating
+        for insert_item, dxrating in zip(to_insert, dxratings[len(to_update):]):
+            insert_item["values"]["dxrating"] = dxrating
+
+    # 写入后的成绩行 (id, shortid, difficulty, server, dxrating, achievement, update_time)，用于维护 B35/B15 缓存
+    written_rows: list[Any] = []
+    chunk_size = 512  # 分批写入
+    sql_type = PluginRegistry.get_sql_name()
 
-    # 执行批量插入
-    if to_insert:
-        chunk_size = 512  # 分批插入
-        for i in range(0, len(to_insert), chunk_size):
-            chunk = to_insert[i:i + chunk_size]
-            chunk_values = [item["values"] for item in chunk]
+    # 1. 高性能方言 (SQLite / PostgreSQL)：每块一条 INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+    if sql_type in ("sqlite", "postgresql"):
+        if sql_type == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            greatest = func.max
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            greatest = func.greatest
 
-            chunk_shortids = sorted({v["shortid"] for v in chunk_values})
-            latest_stmt = (
-                select(MaiChartAch)
-                .where(MaiChartAch.user_id == user_id, MaiChartAch.shortid.in_(chunk_shortids))
-            )
-            latest_rows = (await session.execute(latest_stmt)).scalars().all()
-            chunk_keys = {(v["shortid"], v["difficulty"], v["server"]) for v in chunk_values}
-            latest_map = {
-                (a.shortid, a.difficulty, a.server): a
-                for a in latest_rows
-                if (a.shortid, a.difficulty, a.server) in chunk_keys
+        upsert_values = [
+            {
+                "user_id": user_id,
+                "shortid": u["ach_obj"].shortid,
+                "chart_id": u["ach_obj"].chart_id,
+                "difficulty": u["ach_obj"].difficulty,
+                "server": u["server"],
+                "achievement": u["new_achievement"],
+                "dxscore": u["new_dxscore"],
+                "dxrating": u["new_dxrating"],
+                "combo": u["new_combo"],
+                "sync": u["new_sync"],
+                "update_time": u["new_update_time"],
             }
+            for u in to_update
+        ] + [item["values"] for item in to_insert]
+
+        for i in range(0, len(upsert_values), chunk_size):
+            stmt = dialect_insert(MaiChartAch).values(upsert_values[i:i + chunk_size])
+            excluded = stmt.excluded
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["user_id", "shortid", "difficulty", "server"],
+                # 与并发写入冲突时逐项取较大值，保证成绩只升不降
+                set_={
+                    "achievement": greatest(MaiChartAch.achievement, excluded.achievement),
+                    "dxscore": greatest(MaiChartAch.dxscore, excluded.dxscore),
+                    "combo": greatest(MaiChartAch.combo, excluded.combo),
+                    "sync": greatest(MaiChartAch.sync, excluded.sync),
+                    "dxrating": case(
+                        (excluded.achievement >= MaiChartAch.achievement, excluded.dxrating),
+                        else_=MaiChartAch.dxrating,
+                    ),
+                    # 仅当任一字段确有提升时才推进成绩时间，与降级路径一致
+                    "update_time": case(
+                        (
+                            or_(
+                                excluded.achievement > MaiChartAch.achievement,
+                                excluded.dxscore > MaiChartAch.dxscore,
+                                excluded.combo > MaiChartAch.combo,
+                                excluded.sync > MaiChartAch.sync,
+                            ),
+                            excluded.update_time,
+                        ),
+                        else_=MaiChartAch.update_time,
+                    ),
+                },
+            ).returning(
+                MaiChartAch.id, MaiChartAch.shortid, MaiChartAch.difficulty, MaiChartAch.server,
+                MaiChartAch.dxrating, MaiChartAch.achievement, MaiChartAch.update_time,
+            )
+            written_rows.extend((await session.execute(stmt)).all())
 
-            pending_insert: list[dict[str, Any]] = []
-            for v in chunk_values:
-                key = (v["shortid"], v["difficulty"], v["server"])
-                existing = latest_map.get(key)
-                if existing is None:
-                    pending_insert.append(v)
-                    continue
-
-                new_ach_data = utils.MaiChartAch(**v)
-                old_ach = existing.to_data()
-                if _is_achievement_priority_better(new_ach_data, old_ach):
-                    existing.achievement = v["achievement"]
-                    existing.dxscore = v["dxscore"]
-                    existing.combo = v["combo"]
-                    existing.sync = v["sync"]
-                    existing.dxrating = v["dxrating"]
-                    existing.update_time = v["update_time"]
-
-            if not pending_insert:
-                continue
-
-            try:
-                await session.execute(insert(MaiChartAch).values(pending_insert))
-            except IntegrityError:
-                for v in pending_insert:
-                    try:
-                        async with session.begin_nested():
-                            await session.execute(insert(MaiChartAch).values(v))
-                    except IntegrityError:
-                        conflict_stmt = (
-                            select(MaiChartAch)
-                            .where(
-                                MaiChartAch.user_id == v["user_id"],
-                                MaiChartAch.server == v["server"],
-                                MaiChartAch.shortid == v["shortid"],
-                                MaiChartAch.difficulty == v["difficulty"],
-                            )
-                        )
-                        conflict_row = (await session.execute(conflict_stmt)).scalar_one_or_none()
-                        if conflict_row is None:
-                            raise
-
-                        new_ach_data = utils.MaiChartAch(**v)
-                        old_ach = conflict_row.to_data()
-                        if _is_achievement_priority_better(new_ach_data, old_ach):
-                            conflict_row.achievement = v["achievement"]
-                            conflict_row.dxscore = v["dxscore"]
-                            conflict_row.combo = v["combo"]
-                            conflict_row.sync = v["sync"]
-                            conflict_row.dxrating = v["dxrating"]
-                            conflict_row.update_time = v["update_time"]
-
-    # 7. 重算用户缓存
-    for server in incoming_servers:
-        await refresh_user_dxrating_cache(user_id=user_id, server=server, session=session)
+    # 2. 通用降级逻辑 (MySQL 或其他)
+    else:
+        await _write_achievements_fallback(user_id, to_update, to_insert, chunk_size=chunk_size, session=session)
+        changed_keys = {(d.shortid, d.difficulty, d.server) for d in report.new_song + report.updated_song}
+        if changed_keys:
+            written_stmt = (
+                select(
+                    MaiChartAch.id, MaiChartAch.shortid, MaiChartAch.difficulty, MaiChartAch.server,
+                    MaiChartAch.dxrating, MaiChartAch.achievement, MaiChartAch.update_time,
+                )
+                .where(MaiChartAch.user_id == user_id, MaiChartAch.shortid.in_({sid for sid, _, _ in changed_keys}))
+            )
+            written_rows = [
+                row for row in (await session.execute(written_stmt)).all()
+                if (row.shortid, row.difficulty, row.server) in changed_keys
+            ]
+
+    # 7. 增量维护 B35/B15 缓存与用户汇总缓存
+    candidates_map: dict[SERVER_TAG, list[BestCandidate]] = {server: [] for server in incoming_servers}
+    cut_versions = {server: get_cut_version(server) for server in incoming_servers}
+    for ach_id, sid, diff, server, dxrating, achievement, update_time in written_rows:
+        maidata = chart_map[(sid, diff)].maidata
+        version = maidata.version_cn if server == "CN" else maidata.version
+        candidates_map[server].append(BestCandidate(
+            ach_id=ach_id,
+            is_b15=_is_b15_version(version, cut_versions[server]),
+            dxrating=dxrating,
+            achievement=achievement,
+            update_time=update_time,
+        ))
+    for server, candidates in candidates_map.items():
+        await update_user_best(user_id=user_id, server=server, candidates=candidates, session=session)
 
     # 返回新的报告对象
     return report
@@ -0,0 +1,135 @@
+"""
+maib 并发控制
+
+- `SingleFlight`：按键合并并发调用，同一时刻同一个键只执行一次，其余调用方共享结果；
+  成功结果在新鲜期 (ttl) 内可直接复用
+- `TokenBucket`：令牌桶限流，令牌不足时按顺序排队等待，超过最长等待时间则拒绝
+- `CircuitBreaker`：熔断器，连续失败达到阈值后在冷却期内直接拒绝请求，冷却后放行单个探测请求
+"""
+import asyncio
+import contextvars
+import time
+from typing import Awaitable, Callable, Generic, Hashable, Literal, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+def _retrieve_exception(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
+
+
+class SingleFlight(Generic[K, V]):
+    """按键合并并发调用（single-flight），并在新鲜期内复用最近一次成功结果"""
+
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self._inflight: dict[K, asyncio.Task[Optional[V]]] = {}
+        self._results: dict[K, tuple[float, V]] = {}
+
+    def get_fresh(self, key: K) -> Optional[V]:
+        """获取新鲜期内的最近一次结果，不存在或已过期时返回 None"""
+        cached = self._results.get(key)
+        if cached is None:
+            return None
+        finished_at, value = cached
+        if time.monotonic() - finished_at > self.ttl:
+            del self._results[key]
+            return None
+        return value
+
+    async def run(self, key: K, factory: Callable[[], Awaitable[Optional[V]]]) -> Optional[V]:
+        """
+        执行 `factory`，同一个键已有进行中的调用时直接等待其结果
+        - 任务在独立上下文中执行，不继承调用方的 contextvars（如请求级数据库会话）
+        - 调用方被取消不会中断共享任务；结果为 None 或抛出异常时不进入新鲜期缓存
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._execute(key, factory), context=contextvars.Context())
+            # 所有调用方都已取消时无人等待结果，由回调取走异常，避免 "Task exception was never retrieved"
+            task.add_done_callback(_retrieve_exception)
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _execute(self, key: K, factory: Callable[[], Awaitable[Optional[V]]]) -> Optional[V]:
+        try:
+            value = await factory()
+            if value is not None and self.ttl > 0:
+                self._results[key] = (time.monotonic(), value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+
+class TokenBucket:
+    """令牌桶：容量 `capacity`，每秒补充 `rate` 个令牌"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, max_wait: float = 0.0) -> bool:
+        """获取一个令牌；需等待时间超过 `max_wait` 秒则放弃并返回 False"""
+        self._refill()
+        wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+        if wait > max_wait:
+            return False
+        # 预占令牌（可为负），后续请求据此按顺序排队
+        self._tokens -= 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+
+class CircuitBreaker:
+    """熔断器：closed（正常）-> open（熔断）-> half_open（探测）"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state: Literal["closed", "open", "half_open"] = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started_at = 0.0
+
+    def allow(self) -> bool:
+        """是否放行请求；熔断冷却期结束后仅放行一个探测请求（探测请求超时未回报时重新放行）"""
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open":
+            if self._probing and now - self._probe_started_at < self.reset_timeout:
+                return False
+            self._probing = True
+            self._probe_started_at = now
+        return True
+
+    def record_success(self):
+        """请求成功（上游可用），恢复正常状态"""
+        self.state = "closed"
+        self._failures = 0
+        self._probing = False
+
+    def record_failure(self) -> bool:
+        """记录一次上游失败，返回本次是否触发熔断"""
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            opened = self.state != "open"
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probing = False
+            return opened
+        return False
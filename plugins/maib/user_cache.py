@@ -0,0 +1,86 @@
+"""
+maib 用户缓存
+
+进程级的 `utils.MaiUser` 快照 LRU 缓存（按 user_id），由 `services.get_user_data` 读穿填充。
+写入 `MaiUser` 的服务函数在写入时及事务结束时调用 `invalidate` 使条目失效。
+
+并发一致性：
+- 每次失效都会递增全局代数 (generation)
+- 读穿前记录代数，回填时代数已变化则放弃回填，避免读取期间发生的写入被旧快照覆盖
+"""
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Iterable, Optional
+
+from . import utils
+
+
+# 默认缓存容量（用户数）
+DEFAULT_USER_CACHE_SIZE = 1024
+
+
+class MaiUserCache:
+    """`utils.MaiUser` 快照的有界 LRU 缓存"""
+
+    def __init__(self, maxsize: int = DEFAULT_USER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._users: OrderedDict[int, utils.MaiUser] = OrderedDict()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self) -> int:
+        """当前失效代数，读穿前记录，回填时传入 `put`"""
+        return self._generation
+
+    @property
+    def hit_ratio(self) -> float:
+        """命中率（无请求时为 0）"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, user_id: int) -> Optional[utils.MaiUser]:
+        """读取快照副本，未命中返回 None"""
+        user = self._users.get(user_id)
+        if user is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._users.move_to_end(user_id)
+        return replace(user)
+
+    def put(self, user: utils.MaiUser, generation: int) -> bool:
+        """回填快照；读取期间发生过失效（代数变化）时放弃，返回是否写入"""
+        if generation != self._generation:
+            return False
+        self._users[user.user_id] = replace(user)
+        self._users.move_to_end(user.user_id)
+        while len(self._users) > self.maxsize:
+            self._users.popitem(last=False)
+        return True
+
+    def invalidate(self, user_ids: int | Iterable[int]):
+        """使指定用户的快照失效"""
+        if isinstance(user_ids, int):
+            user_ids = (user_ids,)
+        self._generation += 1
+        for user_id in user_ids:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        """清空缓存（统计数据保留）"""
+        self._generation += 1
+        self._users.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """缓存统计：命中、未命中、命中率与当前条目数"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+            "size": len(self._users),
+        }
+
+
+user_cache = MaiUserCache()
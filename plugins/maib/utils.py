@@ -4,10 +4,11 @@ import time
 import bisect
 import zipfile
 from difflib import get_close_matches
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from pathlib import Path
 from typing import Optional, Literal
 
+import numpy as np
 from PIL import Image
 from loguru import logger
 
@@ -87,6 +88,18 @@ def _build_version_id_map() -> dict[str, int]:
 # 预先生成版本字典
 VERSION_ID_MAP = _build_version_id_map()
 
+def _build_full_width_table():
+    """构建半角到全角的转换表"""
+    # 半角空格 (32) 对应全角空格 (12288)
+    # 其他 ASCII 可打印字符 (33-126) 对应全角 (65281-65374)
+    # 偏移量通常为 0xFEE0 (65248)
+    half_width = "".join(chr(i) for i in range(32, 127))
+    full_width = "　" + "".join(chr(i + 0xFEE0) for i in range(33, 127))
+    return str.maketrans(half_width, full_width)
+
+# 半角 -> 全角转换表（绘图与曲目目录归一化共用）
+CHAR_FULL_WIDTH_TABLE = _build_full_width_table()
+
 async def parse_version(version_str: str, parse_cn: bool = False) -> int:
     """辅助函数：解析版本号"""
     normalized_text = _normalize_version_text(version_str)
@@ -148,6 +161,19 @@ def get_dxrating(achievement: float, level: float, ap_bonus: int = 0) -> int:
         ra += ap_bonus
     return ra
 
+# RATE_FACTOR_TABLE 的升序阈值/系数数组，供 np.searchsorted 使用
+_RATE_THRESHOLDS = np.array([threshold for threshold, _ in reversed(RATE_FACTOR_TABLE)], dtype=np.float64)
+_RATE_FACTORS = np.array([0.0] + [f for _, f in reversed(RATE_FACTOR_TABLE)], dtype=np.float64)
+
+def get_dxrating_batch(achievements, levels, ap_bonus=0) -> np.ndarray:
+    """[批量] 根据成就率和定数数组计算 DX Rating 数组（与 `get_dxrating` 逐项一致）"""
+    achievements = np.asarray(achievements, dtype=np.float64)
+    levels = np.asarray(levels, dtype=np.float64)
+    # side="right"：成就率恰好等于阈值时取该档系数；低于最低阈值时索引为 0，对应系数 0.0
+    factors = _RATE_FACTORS[np.searchsorted(_RATE_THRESHOLDS, achievements, side="right")]
+    ra = (levels * np.minimum(achievements, 100.5) * factors).astype(np.int64)  # 与 int() 一致，向零截断
+    return ra + np.maximum(np.asarray(ap_bonus, dtype=np.int64), 0)
+
 
 # ==============================================================
 
@@ -283,6 +309,10 @@ class MaiChart:
         frac_part = level - int_part
         return f"{int_part}+" if frac_part * 10 >= plus else f"{level}"
 
+    def copy(self) -> 'MaiChart':
+        """复制谱面信息（不包含成就数据）"""
+        return replace(self, _achs={"JP": {}, "CN": {}})
+
     def get_ach(self, server: SERVER_TAG = "JP", user_id: int | None = None) -> MaiChartAch:
         """获取谱面成绩"""
         achs = self._achs.get(server, {})
@@ -364,8 +394,8 @@ class MaiData:
     @property
     def wholebpm(self) -> int: return self.bpm
 
-    def get_image(self, shared_zip: Optional[zipfile.ZipFile] = None) -> Optional[Image.Image]:
-        """获取封面图片对象"""
+    def open_image(self, shared_zip: Optional[zipfile.ZipFile] = None) -> Optional[Image.Image]:
+        """读取封面图片对象，不写入 `_cached_image`（调用方负责关闭，可用于共享的目录快照）"""
         path_str = str(self.img_path)
 
         # 场景 A: 路径包含 .zip/，说明是 ZIP 内部文件
@@ -385,14 +415,12 @@ class MaiData:
                         with shared_zip.open(inner_path) as f:
                             img = Image.open(f)
                             img.load()  # with 作用域外，强加载
-                            self._cached_image = img
-                            return self._cached_image
+                            return img
                     with zipfile.ZipFile(zip_full_path, 'r') as z:
                         with z.open(inner_path) as f:
                             img = Image.open(f)
                             img.load()  # with 作用域外，强加载
-                            self._cached_image = img
-                            return self._cached_image
+                            return img
                 except Exception as e:
                     logger.error(e)
                     return None
@@ -400,12 +428,28 @@ class MaiData:
         # 场景 B: 普通物理路径
         p = Path(path_str)
         if p.exists() and p.is_file():
-            self._cached_image = Image.open(p)
-            self._cached_image.load()
-            return self._cached_image
+            img = Image.open(p)
+            img.load()
+            return img
 
         return None
 
+    def get_image(self, shared_zip: Optional[zipfile.ZipFile] = None) -> Optional[Image.Image]:
+        """获取封面图片对象"""
+        img = self.open_image(shared_zip=shared_zip)
+        if img is not None:
+            self._cached_image = img
+        return img
+
+    def copy(self) -> 'MaiData':
+        """复制曲目信息（谱面一并复制，不包含成就数据）"""
+        return replace(
+            self,
+            _cached_image=None,
+            _charts=[chart.copy() if chart else None for chart in self._charts],
+            aliases=list(self.aliases),
+        )
+
     @property
     def image(self) -> Optional[Image.Image]:
         """获取封面图片对象"""